@@ -23,3 +23,16 @@ app.add_middleware(
 app.include_router(therapist_router, prefix="/api", tags=["Therapist QA"])
 app.include_router(backend_router, prefix="/backend", tags=["Backend"])
 # Run via: uvicorn main:app --host 0.0.0.0 --port 7878 --reload
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    from backend.therapist_client import get_transport
+    from backend.backend_api import writer
+    from backend.database import async_engine
+    from therapist.llm_client import llm
+    await writer.close()
+    await async_engine.dispose()
+    await get_transport().aclose()
+    await llm.aclose()
+    llm.close()
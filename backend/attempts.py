@@ -0,0 +1,82 @@
+"""
+Per-attempt validation history.
+
+Each turn of /backend/validate_sets appends one ValidationAttempt row with
+what the turn added (the response, the hint, the evaluation) instead of
+storing both full histories again, so a turn costs the same at attempt 20
+as at attempt 1. `rebuild_history` turns a session's rows back into the
+user_history/hint_history dicts the therapist expects.
+"""
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from backend.models import ValidationAttempt
+
+
+def decode_history(value) -> dict:
+    """History dict with int keys, from a JSON string or a dict (keys are strings after JSON transport)."""
+    if value is None:
+        return {}
+    try:
+        if not isinstance(value, dict):
+            value = json.loads(value)
+        return {int(k): v for k, v in value.items()}
+    except Exception:
+        return {}
+
+
+def turn_from_histories(prev_user: dict, prev_hint: dict, user_history: dict, hint_history: dict) -> Optional[dict]:
+    """ValidationAttempt fields for one turn, from the histories before and after it (None if it added no response)."""
+    new_user = [k for k in user_history if k not in prev_user]
+    if not new_user:
+        return None
+    attempt = max(new_user)
+    new_hint = [k for k in hint_history if k not in prev_hint or hint_history[k] != prev_hint[k]]
+    opening_hint = hint_history[attempt] if attempt in new_hint else None
+    later = [k for k in new_hint if k > attempt]
+    hint_key = max(later) if later else None
+    return {
+        "attempt": attempt,
+        "user_response": user_history[attempt],
+        "opening_hint": opening_hint,
+        "hint_key": hint_key,
+        "hint": hint_history[hint_key] if hint_key is not None else None,
+    }
+
+
+def rebuild_history(attempts: Iterable[ValidationAttempt]) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """(user_history, hint_history) from a session's attempt rows, in attempt order."""
+    user_history, hint_history = {}, {}
+    for row in sorted(attempts, key=lambda r: r.attempt):
+        user_history[row.attempt] = row.user_response
+        if row.opening_hint is not None:
+            hint_history[row.attempt] = row.opening_hint
+        if row.hint_key is not None:
+            hint_history[row.hint_key] = row.hint
+    return user_history, hint_history
+
+
+def explode_validation_rows(question_id: str, rows) -> List[ValidationAttempt]:
+    """Attempt rows for one session's legacy ValidationInteraction rows (oldest first)."""
+    attempts, prev_user, prev_hint = [], {}, {}
+    for row in rows:
+        user_history, hint_history = decode_history(row.user_history), decode_history(row.hint_history)
+        turn = turn_from_histories(prev_user, prev_hint, user_history, hint_history)
+        if turn is not None:
+            if turn["hint_key"] is None and row.hint:
+                # the hint returned without being added to the history (a correct answer)
+                try:
+                    turn["hint"] = json.loads(row.hint)
+                except ValueError:
+                    turn["hint"] = row.hint
+            attempts.append(ValidationAttempt(question_id=question_id, timestamp=row.timestamp, **turn))
+        prev_user, prev_hint = user_history, hint_history
+    return attempts
+
+
+def attempts_query(question_id: str):
+    return (select(ValidationAttempt)
+            .filter(ValidationAttempt.question_id == question_id)
+            .order_by(ValidationAttempt.attempt))
@@ -1,20 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Dict
-from backend.database import SessionLocal, init_db
-from backend.models import ExerciseInteraction, ValidationInteraction
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-import uuid
+from backend.database import AsyncSessionLocal
+from backend.models import ExerciseInteraction, ValidationAttempt
+from backend.write_behind import WriteBehindQueue
+from backend.session_state import SessionStateStore
+from backend.attempts import attempts_query, decode_history, turn_from_histories
+from backend.response_store import ResponseStore
+import time
 import json
-import httpx, json
+from backend.therapist_client import get_transport, TherapistError
 
 
 router = APIRouter()
-
-# Therapist API URL
-THERAPIST_EXERCISE_URL = "http://localhost:7878/api/exercise_sets"
-THERAPIST_VALIDATE_URL = "http://localhost:7878/api/validate_sets"
+# interaction rows are inserted in batches off the request path
+writer = WriteBehindQueue(AsyncSessionLocal)
+# latest history per question_id: LRU over the indexed session_states table
+session_states = SessionStateStore(AsyncSessionLocal, writer)
+# exercise responses: zstd-compressed, URLs/objects in lookup tables
+responses = ResponseStore(AsyncSessionLocal)
 
 class PromptRequest(BaseModel):
     age:str
@@ -33,70 +36,78 @@ class ValidRequest(BaseModel):
     user_response: str
     
 
-# Dependency for DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def _as_dict(value):
-    if value is None:
-        return {}
-    if isinstance(value, dict):
-        return value
-    try:
-        return {int(k): v for k, v in json.loads(value).items()}
-    except Exception:
-        return {}
-
-def get_latest_validation(db: Session, question_id: str):
-    row = (
-        db.query(ValidationInteraction)
-        .filter(ValidationInteraction.question_id == question_id)  # filter by session
-        .order_by(desc(ValidationInteraction.id))
-        .first()
-    )
-    if not row:
-        return None
+async def get_latest_validation(question_id: str):
+    return await session_states.get(question_id)
 
-    return {
-        "id": row.id,
-        "session_id": question_id,
-        "object": row.object,
-        "question": row.question,
-        "question_type": row.question_type,
-        "user_history": _as_dict(row.user_history),
-        "hint_history": _as_dict(row.hint_history),
-        "created_at": str(getattr(row, "created_at", "")),
-    }
+async def _save_exercise(request: PromptRequest, result: dict):
+    try:
+        blob, dict_id = await responses.pack(result)
+        stored = {"response_blob": blob, "response_dict_id": dict_id}
+    except Exception as e:
+        print(f"[backend] response compression failed, storing plain JSON: {type(e).__name__}: {e}")
+        stored = {"response": json.dumps(result, ensure_ascii=False)}
+    await writer.submit(ExerciseInteraction(
+        age=request.age,
+        gender=request.gender,
+        location=request.location,
+        profession=request.profession,
+        language=request.language,
+        severity=request.severity,
+        **stored
+    ))
 
 @router.post("/exercise_sets")
-def generate_exercise_sets(request: PromptRequest, db: Session = Depends(get_db)):
+async def generate_exercise_sets(request: PromptRequest):
     try:
-        response = httpx.post(THERAPIST_EXERCISE_URL, json=request.dict(),timeout=60)
-        response.raise_for_status()
-        result = response.json()
-        db.add(ExerciseInteraction(
-            age=request.age,
-            gender=request.gender,
-            location=request.location,
-            profession=request.profession,
-            language=request.language,
-            severity=request.severity,
-            response=json.dumps(result, ensure_ascii=False)
-        ))
-        db.commit()
+        result = await get_transport().exercise_sets(request.dict())
+        await _save_exercise(request, result)
         return result
+    except TherapistError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _save_validation(request: ValidRequest, result: dict, previous: dict, latency_ms: int):
+    response = result["response"]
+    user_history = decode_history(response["user_history"])
+    hint_history = decode_history(response["hint_history"])
+    turn = turn_from_histories(previous["user_history"], previous["hint_history"], user_history, hint_history)
+    if turn is None:
+        return
+    if turn["hint_key"] is None and response.get("hint") is not None:
+        hint = response["hint"]
+        turn["hint"] = hint if isinstance(hint, str) else json.dumps(hint, ensure_ascii=False)
+    await session_states.record(request.question_id, {
+        "session_id": request.question_id,
+        "object": request.object,
+        "question": request.question,
+        "question_type": request.question_type,
+        "user_history": user_history,
+        "hint_history": hint_history,
+        "attempts": len(user_history),
+        "created_at": "",
+    }, ValidationAttempt(
+        question_id=request.question_id,
+        evaluation=response.get("evaluation"),
+        latency_ms=latency_ms,
+        **turn
+    ))
+
+@router.get("/exercise_sets/{interaction_id}")
+async def get_exercise_set(interaction_id: int):
+    """A logged exercise set, decompressed."""
+    async with AsyncSessionLocal() as db:
+        row = await db.get(ExerciseInteraction, interaction_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"no exercise set {interaction_id}")
+    return {"id": row.id, "timestamp": str(row.timestamp or ""), "response": await responses.load(row)}
+
+
 @router.post("/validate_sets")
-def validate_user_response(request: ValidRequest, db: Session = Depends(get_db)):
+async def validate_user_response(request: ValidRequest):
     try:
-        latest_data = get_latest_validation(db,request.question_id)
+        latest_data = await get_latest_validation(request.question_id)
         if latest_data:
             print(latest_data["user_history"])
             print(latest_data["hint_history"])
@@ -105,33 +116,51 @@ def validate_user_response(request: ValidRequest, db: Session = Depends(get_db))
         else:
             user_history={}
             hint_history={}
+        previous = {"user_history": user_history, "hint_history": hint_history}
+        # copies: an in-process therapist adds this turn to the dicts it is given
         payload={
         "question_id":request.question_id,
         "object":request.object,
         "question_type":request.question_type,
         "question":request.question,
         "user_response":request.user_response,
-        "user_history":user_history,
-        "hint_history":hint_history
+        "user_history":dict(user_history),
+        "hint_history":dict(hint_history)
         }
 
-        response = httpx.post(THERAPIST_VALIDATE_URL, json=payload,timeout=60)
-        response.raise_for_status()
-        result = response.json()
-
-        db.add(ValidationInteraction(
-            question_id=request.question_id,
-            object=request.object,
-            question=request.question,
-            question_type=request.question_type,
-            user_response=request.user_response,
-            user_history=json.dumps(result["response"]["user_history"], ensure_ascii=False),
-            hint_history=json.dumps(result["response"]["hint_history"], ensure_ascii=False),
-            hint=json.dumps(result["response"]["hint"], ensure_ascii=False)
-        ))
-
-        db.commit()
+        start = time.perf_counter()
+        result = await get_transport().validate_sets(payload)
+        latency_ms = int((time.perf_counter() - start) * 1000)
+        await _save_validation(request, result, previous, latency_ms)
         return result
+    except TherapistError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/history/{question_id}")
+async def get_history(question_id: str):
+    """A session's attempts and the histories rebuilt from them."""
+    state = await session_states.get(question_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"no validation history for {question_id}")
+    await writer.flush()  # the latest attempts may still be queued
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(attempts_query(question_id))).scalars().all()
+    return {
+        **state,
+        "attempt_log": [{
+            "attempt": r.attempt,
+            "user_response": r.user_response,
+            "evaluation": r.evaluation,
+            "hint": r.hint,
+            "latency_ms": r.latency_ms,
+            "timestamp": str(r.timestamp or ""),
+        } for r in rows],
+    }
+
+
+@router.get("/write_stats")
+async def write_stats():
+    return {"writer": writer.stats(), "session_states": session_states.stats()}
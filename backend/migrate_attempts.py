@@ -0,0 +1,87 @@
+"""
+Explode legacy validation_interactions rows into validation_attempts.
+
+Each legacy row stored both full histories; consecutive rows of a session
+are diffed into one attempt row per turn, and a session_states row is added.
+Sessions that already have attempts are skipped, so the script can be rerun.
+With --clear-legacy the migrated sessions' history blobs are then emptied
+(and an SQLite file vacuumed) to give the space back.
+
+    python -m backend.migrate_attempts [--batch 500] [--clear-legacy]
+"""
+import argparse
+
+from sqlalchemy import select, update, text
+
+from backend.attempts import explode_validation_rows
+from backend.database import SessionLocal, engine, init_db, IS_SQLITE
+from backend.models import SessionState, ValidationAttempt, ValidationInteraction
+
+
+def _pending_sessions(db):
+    migrated = select(ValidationAttempt.question_id).distinct()
+    return [q for (q,) in db.execute(
+        select(ValidationInteraction.question_id)
+        .filter(ValidationInteraction.question_id.isnot(None))
+        .filter(ValidationInteraction.question_id.notin_(migrated))
+        .distinct()
+    )]
+
+
+def migrate(batch: int = 500, clear_legacy: bool = False) -> dict:
+    init_db()
+    counts = {"sessions": 0, "legacy_rows": 0, "attempts": 0}
+    db = SessionLocal()
+    try:
+        question_ids = _pending_sessions(db)
+        print(f"{len(question_ids)} sessions to migrate")
+        for i, question_id in enumerate(question_ids, 1):
+            rows = db.execute(
+                select(ValidationInteraction)
+                .filter(ValidationInteraction.question_id == question_id)
+                .order_by(ValidationInteraction.id)
+            ).scalars().all()
+            attempts = explode_validation_rows(question_id, rows)
+            db.add_all(attempts)
+            if attempts and db.get(SessionState, question_id) is None:
+                last = rows[-1]
+                db.add(SessionState(question_id=question_id, object=last.object, question=last.question,
+                                    question_type=last.question_type, attempts=len(attempts)))
+            counts["sessions"] += 1
+            counts["legacy_rows"] += len(rows)
+            counts["attempts"] += len(attempts)
+            if i % batch == 0:
+                db.commit()
+                db.expunge_all()
+                print(f"migrated {i}/{len(question_ids)} sessions")
+        db.commit()
+
+        if clear_legacy:
+            migrated = select(ValidationAttempt.question_id).distinct()
+            cleared = db.execute(
+                update(ValidationInteraction)
+                .where(ValidationInteraction.question_id.in_(migrated))
+                .values(user_history=None, hint_history=None)
+            ).rowcount
+            db.commit()
+            counts["cleared_rows"] = cleared
+    finally:
+        db.close()
+
+    if clear_legacy and IS_SQLITE:
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=500, help="sessions per transaction")
+    parser.add_argument("--clear-legacy", action="store_true",
+                        help="empty the migrated rows' history blobs and vacuum")
+    args = parser.parse_args()
+    print(migrate(args.batch, args.clear_legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, UniqueConstraint, LargeBinary
 from datetime import datetime
 from backend.database import Base  
 
@@ -12,11 +12,14 @@ class ExerciseInteraction(Base):
     profession = Column(String)
     language = Column(String)
     severity=Column(String)
-    response = Column(Text)
+    response = Column(Text)  # legacy rows; new rows use response_blob (see backend/response_store.py)
+    response_blob = Column(LargeBinary)
+    response_dict_id = Column(Integer)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
 
 class ValidationInteraction(Base):
+    """Legacy per-turn log with full histories; new turns go to ValidationAttempt."""
     __tablename__ = "validation_interactions"
     id = Column(Integer, primary_key=True, index=True)
     question_id=Column(String)
@@ -28,3 +31,62 @@ class ValidationInteraction(Base):
     hint_history = Column(Text)
     hint=Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+    # latest row of a session without scanning or sorting the table
+    __table_args__ = (Index("ix_validation_question_id_id", "question_id", "id"),)
+
+
+class SessionState(Base):
+    """One row per question session; its history is in validation_attempts."""
+    __tablename__ = "session_states"
+    question_id = Column(String, primary_key=True)
+    object = Column(String)
+    question = Column(Text)
+    question_type = Column(String)
+    attempts = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ValidationAttempt(Base):
+    """
+    One row per answered attempt, appended once and never rewritten.
+
+    `hint` is the hint returned for the attempt; `hint_key` is its key in the
+    hint history (NULL when it was not added there, e.g. after a correct
+    answer). `opening_hint` is the placeholder put at hint key 1 on a
+    session's first attempt.
+    """
+    __tablename__ = "validation_attempts"
+    id = Column(Integer, primary_key=True)
+    question_id = Column(String, nullable=False)
+    attempt = Column(Integer, nullable=False)
+    user_response = Column(Text)
+    evaluation = Column(String)
+    hint_key = Column(Integer)
+    hint = Column(Text)
+    opening_hint = Column(Text)
+    latency_ms = Column(Integer)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint("question_id", "attempt", name="uq_validation_attempts_question_id_attempt"),)
+
+
+class ImageUrl(Base):
+    __tablename__ = "image_urls"
+    id = Column(Integer, primary_key=True)
+    value = Column(Text, nullable=False, unique=True)
+
+
+class ObjectName(Base):
+    __tablename__ = "object_names"
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+class CompressionDictionary(Base):
+    """zstd dictionaries trained on exercise-set responses; rows keep the id they were compressed with."""
+    __tablename__ = "compression_dictionaries"
+    id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    samples = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
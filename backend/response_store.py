@@ -0,0 +1,344 @@
+"""
+Compressed storage for ExerciseInteraction responses.
+
+A response is stored as compact JSON with every "image" URL and "object"
+name replaced by an id into the image_urls / object_names lookup tables
+(the same few hundred of each repeat across all sets), compressed with
+zstd using a dictionary trained on past responses. Rows record the
+dictionary they were written with, so retraining never breaks old rows.
+Running servers look for a newer dictionary every DICTIONARY_CHECK_SEC and
+switch new rows to it. Legacy rows with a plain `response` text column are read as before.
+
+    python -m backend.response_store train [--samples 2000] [--size 65536]
+    python -m backend.response_store recompress [--vacuum]
+    python -m backend.response_store stats
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import zstandard as zstd
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from backend.models import CompressionDictionary, ExerciseInteraction, ImageUrl, ObjectName
+
+ZSTD_LEVEL = 9
+# how often pack() checks for a dictionary trained since it last looked
+DICTIONARY_CHECK_SEC = float(os.getenv("DICTIONARY_CHECK_SEC", "300"))
+# response key -> lookup table for its string values
+LOOKUPS = {"image": ImageUrl, "object": ObjectName}
+_REF = "#"  # "#image": 12 stands for "image": <image_urls.value of id 12>
+
+
+def _collect(value, found: Dict[str, set]):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k in LOOKUPS and isinstance(v, str):
+                found[k].add(v)
+            else:
+                _collect(v, found)
+    elif isinstance(value, list):
+        for v in value:
+            _collect(v, found)
+
+
+def _to_refs(value, ids: Dict[str, Dict[str, int]]):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if k in LOOKUPS and isinstance(v, str):
+                out[_REF + k] = ids[k][v]
+            else:
+                out[k] = _to_refs(v, ids)
+        return out
+    if isinstance(value, list):
+        return [_to_refs(v, ids) for v in value]
+    return value
+
+
+def _collect_refs(value, found: Dict[str, set]):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k.startswith(_REF) and k[1:] in LOOKUPS:
+                found[k[1:]].add(v)
+            else:
+                _collect_refs(v, found)
+    elif isinstance(value, list):
+        for v in value:
+            _collect_refs(v, found)
+
+
+def _from_refs(value, values: Dict[str, Dict[int, str]]):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if k.startswith(_REF) and k[1:] in LOOKUPS:
+                out[k[1:]] = values[k[1:]].get(v)
+            else:
+                out[k] = _from_refs(v, values)
+        return out
+    if isinstance(value, list):
+        return [_from_refs(v, values) for v in value]
+    return value
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseCodec:
+    """Lookup-table ids and zstd (de)compressors, cached in memory; the DB access is left to the callers."""
+
+    def __init__(self):
+        self.ids: Dict[str, Dict[str, int]] = {k: {} for k in LOOKUPS}
+        self.values: Dict[str, Dict[int, str]] = {k: {} for k in LOOKUPS}
+        self.dictionaries: Dict[int, zstd.ZstdCompressionDict] = {}
+        self.current_dict_id: Optional[int] = None
+        self._compressors: Dict[Optional[int], zstd.ZstdCompressor] = {}
+        self._decompressors: Dict[Optional[int], zstd.ZstdDecompressor] = {}
+
+    def learn(self, kind: str, rows: Iterable[Tuple[int, str]]):
+        for id_, value in rows:
+            self.ids[kind][value] = id_
+            self.values[kind][id_] = value
+
+    def add_dictionary(self, dict_id: int, data: bytes, current: bool = False):
+        self.dictionaries[dict_id] = zstd.ZstdCompressionDict(data)
+        if current:
+            self.current_dict_id = dict_id
+
+    def compressor(self, dict_id: Optional[int]) -> zstd.ZstdCompressor:
+        if dict_id not in self._compressors:
+            kwargs = {"dict_data": self.dictionaries[dict_id]} if dict_id is not None else {}
+            self._compressors[dict_id] = zstd.ZstdCompressor(level=ZSTD_LEVEL, **kwargs)
+        return self._compressors[dict_id]
+
+    def decompressor(self, dict_id: Optional[int]) -> zstd.ZstdDecompressor:
+        if dict_id not in self._decompressors:
+            kwargs = {"dict_data": self.dictionaries[dict_id]} if dict_id is not None else {}
+            self._decompressors[dict_id] = zstd.ZstdDecompressor(**kwargs)
+        return self._decompressors[dict_id]
+
+    def missing_ids(self, result) -> Dict[str, set]:
+        found = {k: set() for k in LOOKUPS}
+        _collect(result, found)
+        return {k: {v for v in vs if v not in self.ids[k]} for k, vs in found.items()}
+
+    def serialize(self, result) -> bytes:
+        """Compact JSON with lookup refs (uncompressed); also the dictionary training sample format."""
+        return _dumps(_to_refs(result, self.ids))
+
+    def compress(self, result) -> Tuple[bytes, Optional[int]]:
+        dict_id = self.current_dict_id
+        return self.compressor(dict_id).compress(self.serialize(result)), dict_id
+
+    def decompress(self, blob: bytes, dict_id: Optional[int]):
+        """Decoded response with refs still in place, and the ids it refers to that are not cached."""
+        packed = json.loads(self.decompressor(dict_id).decompress(blob))
+        found = {k: set() for k in LOOKUPS}
+        _collect_refs(packed, found)
+        return packed, {k: {i for i in ids if i not in self.values[k]} for k, ids in found.items()}
+
+    def resolve(self, packed):
+        return _from_refs(packed, self.values)
+
+
+class ResponseStore:
+    """Async pack/load of exercise responses for backend_api."""
+
+    def __init__(self, session_factory, dictionary_check_sec: float = DICTIONARY_CHECK_SEC):
+        self.session_factory = session_factory
+        self.codec = ResponseCodec()
+        self.dictionary_check_sec = dictionary_check_sec
+        self._checked_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def _check_due(self) -> bool:
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.dictionary_check_sec
+
+    async def _load_dictionaries(self, db):
+        """Add dictionaries trained since the last look; the newest becomes current."""
+        self._checked_at = time.monotonic()
+        latest = await db.scalar(select(func.max(CompressionDictionary.id)))
+        if latest is None or latest in self.codec.dictionaries:
+            return
+        known = max(self.codec.dictionaries, default=0)
+        rows = (await db.execute(select(CompressionDictionary.id, CompressionDictionary.data)
+                                 .where(CompressionDictionary.id > known)
+                                 .order_by(CompressionDictionary.id))).all()
+        for id_, data in rows:
+            self.codec.add_dictionary(id_, data, current=(id_ == rows[-1][0]))
+
+    async def _intern(self, db, kind: str, values: set, retries: int = 3):
+        model = LOOKUPS[kind]
+        for _ in range(retries):
+            self.codec.learn(kind, (await db.execute(select(model.id, model.value)
+                                                     .where(model.value.in_(values)))).all())
+            new = [v for v in values if v not in self.codec.ids[kind]]
+            if not new:
+                return
+            rows = [model(value=v) for v in new]
+            db.add_all(rows)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # another process added some of them first; pick those up and retry the rest
+                await db.rollback()
+                continue
+            self.codec.learn(kind, ((r.id, r.value) for r in rows))
+            return
+
+    async def pack(self, result) -> Tuple[bytes, Optional[int]]:
+        """(blob, dictionary id) for a response; only never-seen URLs/objects touch the database."""
+        missing = self.codec.missing_ids(result)
+        if self._check_due() or any(missing.values()):
+            async with self._lock:
+                async with self.session_factory() as db:
+                    if self._check_due():
+                        await self._load_dictionaries(db)
+                    for kind, values in self.codec.missing_ids(result).items():
+                        if values:
+                            await self._intern(db, kind, values)
+        return self.codec.compress(result)
+
+    async def load(self, row: ExerciseInteraction):
+        """The response stored in an ExerciseInteraction row."""
+        if row.response_blob is None:
+            return json.loads(row.response) if row.response else None
+        async with self.session_factory() as db:
+            if row.response_dict_id is not None and row.response_dict_id not in self.codec.dictionaries:
+                await self._load_dictionaries(db)
+            packed, missing = self.codec.decompress(row.response_blob, row.response_dict_id)
+            for kind, ids in missing.items():
+                if ids:
+                    model = LOOKUPS[kind]
+                    self.codec.learn(kind, (await db.execute(select(model.id, model.value)
+                                                             .where(model.id.in_(ids)))).all())
+        return self.codec.resolve(packed)
+
+
+# ---- offline maintenance (sync) ----
+
+def _sync_codec(db) -> ResponseCodec:
+    codec = ResponseCodec()
+    rows = db.execute(select(CompressionDictionary.id, CompressionDictionary.data)
+                      .order_by(CompressionDictionary.id)).all()
+    for id_, data in rows:
+        codec.add_dictionary(id_, data, current=(id_ == rows[-1][0]))
+    for kind, model in LOOKUPS.items():
+        codec.learn(kind, db.execute(select(model.id, model.value)).all())
+    return codec
+
+
+def _sync_intern(db, codec: ResponseCodec, result):
+    for kind, values in codec.missing_ids(result).items():
+        if values:
+            rows = [LOOKUPS[kind](value=v) for v in values]
+            db.add_all(rows)
+            db.flush()
+            codec.learn(kind, ((r.id, r.value) for r in rows))
+
+
+def _sync_load(codec: ResponseCodec, row: ExerciseInteraction):
+    if row.response_blob is None:
+        return json.loads(row.response) if row.response else None
+    packed, _ = codec.decompress(row.response_blob, row.response_dict_id)
+    return codec.resolve(packed)
+
+
+def train(db, samples: int = 2000, size: int = 65536) -> int:
+    """Train a dictionary on the latest `samples` responses and make it current; returns its id."""
+    codec = _sync_codec(db)
+    rows = db.execute(select(ExerciseInteraction).order_by(ExerciseInteraction.id.desc()).limit(samples)).scalars()
+    data = []
+    for row in rows:
+        result = _sync_load(codec, row)
+        if result is not None:
+            _sync_intern(db, codec, result)
+            data.append(codec.serialize(result))
+    if len(data) < 10:
+        raise SystemExit(f"only {len(data)} responses to train on; log more exercise sets first")
+    dictionary = zstd.train_dictionary(size, data, level=ZSTD_LEVEL)
+    row = CompressionDictionary(data=dictionary.as_bytes(), samples=len(data))
+    db.add(row)
+    db.commit()
+    print(f"trained dictionary {row.id} ({len(row.data)} bytes) on {len(data)} responses; "
+          f"running servers switch to it within {DICTIONARY_CHECK_SEC:.0f}s")
+    return row.id
+
+
+def recompress(db, batch: int = 500) -> int:
+    """Rewrite legacy and older-dictionary rows with the current dictionary."""
+    codec = _sync_codec(db)
+    current = codec.current_dict_id
+    done, last_id = 0, 0
+    while True:
+        query = select(ExerciseInteraction).where(ExerciseInteraction.id > last_id)
+        if current is not None:
+            query = query.where((ExerciseInteraction.response_dict_id.is_(None)) |
+                                (ExerciseInteraction.response_dict_id != current))
+        rows = db.execute(query.order_by(ExerciseInteraction.id).limit(batch)).scalars().all()
+        if not rows:
+            break
+        for row in rows:
+            result = _sync_load(codec, row)
+            if result is not None:
+                _sync_intern(db, codec, result)
+                row.response_blob, row.response_dict_id = codec.compress(result)
+                row.response = None
+        last_id = rows[-1].id
+        db.commit()
+        done += len(rows)
+        print(f"recompressed {done} rows")
+    return done
+
+
+def stats(db) -> dict:
+    return {
+        "rows": db.scalar(select(func.count(ExerciseInteraction.id))),
+        "legacy_rows": db.scalar(select(func.count(ExerciseInteraction.id))
+                                 .where(ExerciseInteraction.response_blob.is_(None))),
+        "legacy_text_bytes": db.scalar(select(func.sum(func.length(ExerciseInteraction.response)))) or 0,
+        "compressed_bytes": db.scalar(select(func.sum(func.length(ExerciseInteraction.response_blob)))) or 0,
+        "image_urls": db.scalar(select(func.count(ImageUrl.id))),
+        "object_names": db.scalar(select(func.count(ObjectName.id))),
+        "dictionaries": db.scalar(select(func.count(CompressionDictionary.id))),
+    }
+
+
+def main():
+    from sqlalchemy import text
+    from backend.database import SessionLocal, engine, init_db, IS_SQLITE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="train a new current dictionary")
+    p_train.add_argument("--samples", type=int, default=2000)
+    p_train.add_argument("--size", type=int, default=65536, help="dictionary size in bytes")
+    p_re = sub.add_parser("recompress", help="rewrite rows not using the current dictionary")
+    p_re.add_argument("--batch", type=int, default=500)
+    p_re.add_argument("--vacuum", action="store_true", help="vacuum the SQLite file afterwards")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.command == "train":
+            train(db, args.samples, args.size)
+        elif args.command == "recompress":
+            recompress(db, args.batch)
+        print(stats(db))
+    finally:
+        db.close()
+    if args.command == "recompress" and args.vacuum and IS_SQLITE:
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Latest state of each question session for /backend/validate_sets.
+
+A session is one `session_states` row (primary key question_id) plus its
+append-only `validation_attempts` rows, with an LRU of rebuilt states in
+front. A turn reads the summary row by key; when its attempt count matches
+the cached state (no other worker has moved the session on) nothing else is
+read, otherwise the session is rebuilt from one indexed range of small rows.
+Writes go through the write-behind queue; until they land the
+state is pinned in memory so the next attempt still sees it. Sessions from
+before these tables are exploded from `validation_interactions` on first
+use (`python -m backend.migrate_attempts` does all of them at once).
+"""
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from backend.attempts import attempts_query, explode_validation_rows, rebuild_history
+from backend.models import SessionState, ValidationAttempt, ValidationInteraction
+
+
+class SessionStateStore:
+
+    def __init__(self, session_factory, writer, max_entries: int = 4096):
+        self.session_factory = session_factory
+        self.writer = writer
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()
+        # question_id -> state whose write is still queued; never evicted
+        self._unwritten: Dict[str, dict] = {}
+        self.counters = {"memory_hits": 0, "db_hits": 0, "legacy_hits": 0, "misses": 0}
+
+    def _remember(self, question_id: str, state: dict):
+        self._lru[question_id] = state
+        self._lru.move_to_end(question_id)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    async def get(self, question_id: str) -> Optional[dict]:
+        state = self._unwritten.get(question_id)
+        if state is not None:
+            # written by this process and not flushed yet: newer than the tables
+            self._remember(question_id, state)
+            self.counters["memory_hits"] += 1
+            return state
+        async with self.session_factory() as db:
+            summary = await db.get(SessionState, question_id)
+            state = self._lru.get(question_id)
+            # another worker may have recorded attempts since this one cached the session
+            if state is not None and (summary is None or summary.attempts == state.get("attempts")):
+                self._remember(question_id, state)
+                self.counters["memory_hits"] += 1
+                return state
+            attempts = (await db.execute(attempts_query(question_id))).scalars().all()
+            if attempts:
+                self.counters["db_hits"] += 1
+                state = self._state(question_id, summary, attempts)
+            else:
+                state = await self._from_legacy(db, question_id)
+        if state is None:
+            self.counters["misses"] += 1
+            return None
+        self._remember(question_id, state)
+        return state
+
+    @staticmethod
+    def _state(question_id: str, summary: Optional[SessionState], attempts) -> dict:
+        user_history, hint_history = rebuild_history(attempts)
+        return {
+            "session_id": question_id,
+            "object": summary.object if summary else None,
+            "question": summary.question if summary else None,
+            "question_type": summary.question_type if summary else None,
+            "user_history": user_history,
+            "hint_history": hint_history,
+            "attempts": len(user_history),
+            "created_at": str(attempts[-1].timestamp or ""),
+        }
+
+    async def _from_legacy(self, db, question_id: str) -> Optional[dict]:
+        rows = (await db.execute(
+            select(ValidationInteraction)
+            .filter(ValidationInteraction.question_id == question_id)
+            .order_by(ValidationInteraction.id)
+        )).scalars().all()
+        attempts = explode_validation_rows(question_id, rows)
+        if not attempts:
+            return None
+        self.counters["legacy_hits"] += 1
+        last = rows[-1]
+        summary = SessionState(question_id=question_id, object=last.object, question=last.question,
+                               question_type=last.question_type, attempts=len(attempts))
+        state = self._state(question_id, summary, attempts)
+        self._unwritten[question_id] = state
+        for row in attempts:
+            await self.writer.submit(row)
+        await self.writer.submit(summary, on_written=self._unpin(question_id, state), merge=True)
+        return state
+
+    def _unpin(self, question_id: str, state: dict):
+        def written():
+            if self._unwritten.get(question_id) is state:
+                del self._unwritten[question_id]
+        return written
+
+    async def record(self, question_id: str, state: dict, attempt: ValidationAttempt):
+        """Make `state` the session's latest and append `attempt`; in memory now, in the tables once the queue flushes."""
+        self._unwritten[question_id] = state
+        self._remember(question_id, state)
+        await self.writer.submit(attempt)
+        summary = SessionState(
+            question_id=question_id,
+            object=state.get("object"),
+            question=state.get("question"),
+            question_type=state.get("question_type"),
+            attempts=state.get("attempts", len(state.get("user_history") or {})),
+        )
+        # the queue is FIFO, so the attempt row is written no later than the summary
+        await self.writer.submit(summary, on_written=self._unpin(question_id, state), merge=True)
+
+    def stats(self) -> dict:
+        return {**self.counters, "cached": len(self._lru), "unwritten": len(self._unwritten)}
@@ -0,0 +1,119 @@
+"""
+How backend_api reaches the therapist service.
+
+When the therapist router is mounted in the same app (app_v1.py), requests
+go straight to its route functions: no loopback HTTP, no double JSON
+encoding. When it runs elsewhere, they go over a pooled async HTTP client.
+Either way the wait is bounded by the therapist's own deadlines plus a
+small margin, so the backend never gives up before the therapist does.
+"""
+import asyncio
+import os
+import sys
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException
+
+from therapist.config import EXERCISE_SET_DEADLINE_SEC, VALIDATE_DEADLINE_SEC
+
+THERAPIST_BASE_URL = os.getenv("THERAPIST_BASE_URL", "http://localhost:7878")
+# auto: in-process if the therapist router is loaded in this process, else http
+THERAPIST_TRANSPORT = os.getenv("THERAPIST_TRANSPORT", "auto")
+DEADLINE_MARGIN_SEC = 5.0
+
+
+class TherapistError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class InProcessTransport:
+    """Calls the therapist route functions directly."""
+
+    name = "inprocess"
+
+    def __init__(self):
+        from therapist import th_api
+        self.th_api = th_api
+
+    async def _call(self, route, request, deadline):
+        try:
+            return await asyncio.wait_for(route(request), deadline + DEADLINE_MARGIN_SEC)
+        except HTTPException as e:
+            raise TherapistError(e.status_code, str(e.detail))
+        except asyncio.TimeoutError:
+            raise TherapistError(504, f"therapist did not answer within {deadline + DEADLINE_MARGIN_SEC:.0f}s")
+
+    async def exercise_sets(self, payload: dict) -> dict:
+        return await self._call(self.th_api.generate_exercise_sets,
+                                self.th_api.PromptRequest(**payload), EXERCISE_SET_DEADLINE_SEC)
+
+    async def validate_sets(self, payload: dict) -> dict:
+        return await self._call(self.th_api.validate_user_response,
+                                self.th_api.ValidRequest(**payload), VALIDATE_DEADLINE_SEC)
+
+    async def aclose(self):
+        pass
+
+
+class HTTPTransport:
+    """Pooled keep-alive HTTP client for a therapist service running elsewhere."""
+
+    name = "http"
+
+    def __init__(self, base_url: str = THERAPIST_BASE_URL, max_connections: int = 100):
+        self.base_url = base_url.rstrip("/")
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created lazily inside the serving event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=self.limits)
+        return self._client
+
+    async def _post(self, path: str, payload: dict, deadline: float) -> dict:
+        timeout = httpx.Timeout(deadline + DEADLINE_MARGIN_SEC, connect=5.0)
+        try:
+            response = await self.client.post(path, json=payload, timeout=timeout)
+        except httpx.TimeoutException:
+            raise TherapistError(504, f"therapist did not answer within {deadline + DEADLINE_MARGIN_SEC:.0f}s")
+        except httpx.TransportError as e:
+            raise TherapistError(502, f"therapist unreachable: {type(e).__name__}: {e}")
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            raise TherapistError(response.status_code, str(detail))
+        return response.json()
+
+    async def exercise_sets(self, payload: dict) -> dict:
+        return await self._post("/api/exercise_sets", payload, EXERCISE_SET_DEADLINE_SEC)
+
+    async def validate_sets(self, payload: dict) -> dict:
+        return await self._post("/api/validate_sets", payload, VALIDATE_DEADLINE_SEC)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_transport = None
+
+
+def get_transport():
+    """The process-wide transport, chosen on first use (routers are mounted by then)."""
+    global _transport
+    if _transport is None:
+        mode = THERAPIST_TRANSPORT
+        if mode == "auto":
+            mode = "inprocess" if "therapist.th_api" in sys.modules else "http"
+        _transport = InProcessTransport() if mode == "inprocess" else HTTPTransport()
+        print(f"[backend] therapist transport: {_transport.name}")
+    return _transport
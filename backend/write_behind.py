@@ -0,0 +1,164 @@
+"""
+Write-behind queue for interaction logging.
+
+Request handlers `submit` ORM rows and return; one background task drains
+the queue and inserts whatever has accumulated (up to `max_batch` rows,
+waiting at most `max_delay` seconds for stragglers) in a single
+transaction. With SQLite that turns one write lock and fsync per request
+into one per batch; with a server database it is one round trip per batch.
+Rows submitted with `merge=True` are upserts by primary key (session state).
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from sqlalchemy import inspect
+
+
+class WriteBehindQueue:
+
+    def __init__(self, session_factory, max_batch: int = 200, max_delay: float = 0.05,
+                 max_pending: int = 10000, retries: int = 3):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.retries = retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.counters = {"submitted": 0, "written": 0, "batches": 0, "dropped": 0}
+        # table names of the most recently dropped rows, for stats()
+        self.dropped = deque(maxlen=100)
+
+    def _ensure_started(self):
+        # created lazily inside the serving event loop
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, row, on_written: Optional[Callable[[], None]] = None, merge: bool = False):
+        """Queue a row for insertion; only waits when `max_pending` rows are already queued."""
+        if self._closing:
+            raise RuntimeError("write-behind queue is closed")
+        self._ensure_started()
+        self.counters["submitted"] += 1
+        await self._queue.put((row, on_written, merge))
+
+    async def _next_batch(self) -> List[tuple]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._closing:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @staticmethod
+    def _rows(batch: List[tuple]) -> List[tuple]:
+        """
+        (row, merge, callbacks) to write; of several upserts to one key only the
+        last is kept, and it carries the callbacks of the ones it replaces.
+        """
+        rows, upserts = [], {}
+        for row, on_written, merge in batch:
+            callbacks = [on_written] if on_written is not None else []
+            if not merge:
+                rows.append((row, merge, callbacks))
+                continue
+            key = (type(row), tuple(inspect(row).mapper.primary_key_from_instance(row)))
+            if key in upserts:
+                i = upserts[key]
+                callbacks = rows[i][2] + callbacks
+                rows[i] = None
+            upserts[key] = len(rows)
+            rows.append((row, merge, callbacks))
+        return [r for r in rows if r is not None]
+
+    async def _insert(self, rows: List[tuple]):
+        async with self.session_factory() as session:
+            async with session.begin():
+                for row, merge, _ in rows:
+                    if merge:
+                        await session.merge(row)
+                    else:
+                        session.add(row)
+
+    @staticmethod
+    def _written(rows: List[tuple]):
+        for _, _, callbacks in rows:
+            for on_written in callbacks:
+                on_written()
+
+    async def _write(self, batch: List[tuple]) -> List[tuple]:
+        """Write a batch; returns the (row, merge, callbacks) entries that had to be dropped."""
+        rows = self._rows(batch)
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self._insert(rows)
+                break
+            except Exception as e:
+                print(f"[write-behind] batch of {len(rows)} failed (attempt {attempt}/{self.retries}): "
+                      f"{type(e).__name__}: {e}")
+                if attempt == self.retries:
+                    return await self._write_one_by_one(rows)
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        self.counters["written"] += len(rows)
+        self.counters["batches"] += 1
+        self._written(rows)
+        return []
+
+    async def _write_one_by_one(self, rows: List[tuple]) -> List[tuple]:
+        # keep one bad row (say, a duplicate key) from losing the rest of its batch
+        dropped = []
+        for entry in rows:
+            try:
+                await self._insert([entry])
+            except Exception as e:
+                dropped.append(entry)
+                print(f"[write-behind] dropped {type(entry[0]).__name__}: {type(e).__name__}: {e}")
+                continue
+            self.counters["written"] += 1
+            self._written([entry])
+        self.counters["dropped"] += len(dropped)
+        self.dropped.extend(type(row).__name__ for row, _, _ in dropped)
+        return dropped
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def flush(self):
+        """Wait until every row submitted so far is written (or given up on)."""
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def close(self):
+        """Flush pending rows and stop the writer; called on app shutdown."""
+        self._closing = True
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": self._queue.qsize() if self._queue is not None else 0,
+                "recently_dropped": list(self.dropped)}
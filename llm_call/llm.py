@@ -1,22 +1,92 @@
-import openai
+import asyncio
 import os
+from openai import OpenAI, AsyncOpenAI
+from llm_call.response_cache import cache_key
 
 class OpenAITextGenerator:
-    def __init__(self, model_name="gpt-4o-mini"):
+    """
+    Chat completions against OpenAI, sync and async.
+
+    The async path is what the /generate route uses: at most `max_concurrency`
+    upstream calls are in flight per process, and identical prompts that
+    arrive while one is already in flight await that call instead of making
+    their own (single-flight).
+    """
+    def __init__(self, model_name="gpt-4o-mini", temperature=0.7,
+                 max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "256"))):
         self.api_key = os.getenv("OPENAI_API_KEY")  # Load from env variable
         self.model_name = model_name
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
 
         if not self.api_key:
             raise ValueError("Please set the OPENAI_API_KEY environment variable.")
 
-        openai.api_key = self.api_key
+        self.client = OpenAI(api_key=self.api_key)
+        self.aclient = AsyncOpenAI(api_key=self.api_key)
+        self._semaphore = None
+        self._inflight = {}
+        self.coalesced = 0
 
-    def generate(self, input_text):
+    @staticmethod
+    def _messages(input_text):
         if hasattr(input_text[0],"dict"):
             input_text=[m.dict() for m in input_text]
-        response = openai.ChatCompletion.create(
-            model=self.model_name,
-            messages=input_text,
-            temperature=0.7
-        )
+        return input_text
+
+    def _request(self, messages, stream=False):
+        return dict(model=self.model_name, messages=messages, temperature=self.temperature, stream=stream)
+
+    @property
+    def semaphore(self):
+        # created on first use so it binds to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def generate(self, input_text):
+        response = self.client.chat.completions.create(**self._request(self._messages(input_text)))
         return response.choices[0].message.content.strip()
+
+    def stream(self, input_text):
+        """Yield the completion as text deltas as OpenAI produces them."""
+        for chunk in self.client.chat.completions.create(**self._request(self._messages(input_text), stream=True)):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _agenerate(self, messages):
+        async with self.semaphore:
+            response = await self.aclient.chat.completions.create(**self._request(messages))
+        return response.choices[0].message.content.strip()
+
+    async def agenerate(self, input_text, coalesce=True):
+        """
+        Async `generate`; identical in-flight prompts share one upstream call
+        unless `coalesce` is False (callers sampling several distinct candidates).
+        """
+        messages = self._messages(input_text)
+        if not coalesce:
+            return await self._agenerate(messages)
+        key = cache_key(self.model_name, messages, self.temperature)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: one waiter being cancelled must not cancel the shared call
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._agenerate(messages))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def astream(self, input_text):
+        """Async `stream`; streams are not coalesced but count against the limiter."""
+        async with self.semaphore:
+            response = await self.aclient.chat.completions.create(**self._request(self._messages(input_text), stream=True))
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "coalesced": self.coalesced,
+                "max_concurrency": self.max_concurrency,
+                "available": self._semaphore._value if self._semaphore is not None else self.max_concurrency}
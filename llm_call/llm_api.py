@@ -1,10 +1,15 @@
+import asyncio
+import json
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from llm_call.llm import OpenAITextGenerator
+from llm_call.response_cache import ResponseCache, cache_key
 
 router = APIRouter()
 llm = OpenAITextGenerator()
+response_cache = ResponseCache()
 
 class Message(BaseModel):
     role: str
@@ -12,12 +17,69 @@ class Message(BaseModel):
 
 class PromptRequest(BaseModel):
     input_text: List[Message]
+    # opt-in cache route (see response_cache.DEFAULT_ROUTE_TTLS); None = never cached
+    cache_route: Optional[str] = None
+    # stream the completion as server-sent events instead of one JSON body
+    stream: bool = False
+    # False: always make a fresh upstream call, even if the same prompt is in flight
+    coalesce: bool = True
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _stream_events(messages, route, key):
+    """delta events while the model writes, then done (full text) or error."""
+    if route:
+        cached = await asyncio.to_thread(response_cache.get, route, key)
+        if cached is not None:
+            yield _sse("delta", {"delta": cached})
+            yield _sse("done", {"response": cached, "cached": True})
+            return
+    parts = []
+    try:
+        async for delta in llm.astream(messages):
+            parts.append(delta)
+            yield _sse("delta", {"delta": delta})
+    except Exception as e:
+        yield _sse("error", {"detail": str(e)})
+        return
+    output = "".join(parts).strip()
+    if route:
+        await asyncio.to_thread(response_cache.put, route, key, output)
+    yield _sse("done", {"response": output})
 
 @router.post("/generate")
-def generate_text(request: PromptRequest):
+async def generate_text(request: PromptRequest):
     try:
-        # Forward input_text directly to OpenAI
-        output = llm.generate(request.input_text)
+        messages = [m.dict() for m in request.input_text]
+        route = request.cache_route if response_cache.enabled_for(request.cache_route) else None
+        key = cache_key(llm.model_name, messages, llm.temperature) if route else None
+        if request.stream:
+            return StreamingResponse(_stream_events(messages, route, key), media_type="text/event-stream")
+        if route:
+            cached = await asyncio.to_thread(response_cache.get, route, key)
+            if cached is not None:
+                return {"response": cached, "cached": True}
+        # Forward input_text to OpenAI; identical in-flight prompts share one call
+        output = await llm.agenerate(messages, coalesce=request.coalesce)
+        if route:
+            await asyncio.to_thread(response_cache.put, route, key, output)
         return {"response": output}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/cache/invalidate")
+async def invalidate_cached(request: PromptRequest):
+    """Forget the cached reply to this prompt, e.g. after the client failed to parse it."""
+    if not response_cache.enabled_for(request.cache_route):
+        return {"invalidated": False}
+    key = cache_key(llm.model_name, [m.dict() for m in request.input_text], llm.temperature)
+    return {"invalidated": await asyncio.to_thread(response_cache.invalidate, request.cache_route, key)}
+
+@router.get("/cache_stats")
+def cache_stats():
+    return {"response": response_cache.stats()}
+
+@router.get("/stats")
+def llm_stats():
+    return {"response": llm.stats()}
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# callers opt in per route; value is the TTL in seconds. Routes not listed are never cached.
+DEFAULT_ROUTE_TTLS = {
+    "question_framing": 7 * 24 * 3600,
+    "captions": 30 * 24 * 3600,
+    "negative_patterns": 30 * 24 * 3600,
+}
+
+
+def cache_key(model: str, messages: List[dict], temperature: float) -> str:
+    """Content address of a completion request: sha256 over (model, messages, temperature)."""
+    payload = json.dumps({"model": model, "messages": messages, "temperature": temperature},
+                         sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU in memory in front of a content-addressed disk cache for LLM responses.
+
+    Entries live in `cache_dir/ab/<sha256>.json` as {response, route, created_at,
+    expires_at}. The memory tier holds at most `max_memory_entries`; the disk
+    tier is trimmed oldest-first once it exceeds `max_disk_bytes`. Expired
+    entries are dropped on read. Hits and misses are counted per route.
+    """
+
+    def __init__(self, cache_dir: str = "llm_cache", route_ttls: Optional[Dict[str, float]] = None,
+                 max_memory_entries: int = 2048, max_disk_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.route_ttls = dict(DEFAULT_ROUTE_TTLS if route_ttls is None else route_ttls)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_bytes = self._scan_disk_bytes()
+
+    def enabled_for(self, route: Optional[str]) -> bool:
+        return route is not None and route in self.route_ttls
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _scan_disk_bytes(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def _count(self, route: str, name: str):
+        with self._lock:
+            counters = self.counters.setdefault(route, {"hit": 0, "disk_hit": 0, "miss": 0, "store": 0,
+                                                       "invalidated": 0})
+            counters[name] += 1
+
+    def _remember(self, key: str, entry: dict):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, route: str, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None and entry["expires_at"] > now:
+            self._count(route, "hit")
+            return entry["response"]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or entry.get("expires_at", 0) <= now:
+            if entry is not None:
+                self._remove(key)
+            self._count(route, "miss")
+            return None
+        self._remember(key, entry)
+        self._count(route, "disk_hit")
+        return entry["response"]
+
+    def put(self, route: str, key: str, response: str):
+        now = time.time()
+        entry = {"response": response, "route": route, "created_at": now,
+                 "expires_at": now + self.route_ttls[route]}
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        old = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += len(data) - old
+        self._remember(key, entry)
+        self._count(route, "store")
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict()
+
+    def invalidate(self, route: str, key: str) -> bool:
+        """Drop an entry (e.g. a reply the client could not parse); True if there was one."""
+        existed = key in self._memory or os.path.exists(self._path(key))
+        self._remove(key)
+        if existed:
+            self._count(route, "invalidated")
+        return existed
+
+    def _remove(self, key: str):
+        path = self._path(key)
+        with self._lock:
+            self._memory.pop(key, None)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._disk_bytes -= size
+            except OSError:
+                pass
+
+    def _evict(self):
+        """Drop the least recently written disk entries until under 90% of max_disk_bytes."""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".json"):
+                    p = os.path.join(root, name)
+                    try:
+                        st = os.stat(p)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, name[:-5]))
+        files.sort()
+        target = int(self.max_disk_bytes * 0.9)
+        for _, size, key in files:
+            if self._disk_bytes <= target:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {r: dict(c) for r, c in self.counters.items()}
+            memory_entries = len(self._memory)
+            disk_bytes = self._disk_bytes
+        for c in routes.values():
+            lookups = c["hit"] + c["disk_hit"] + c["miss"]
+            c["hit_rate"] = round((c["hit"] + c["disk_hit"]) / lookups, 4) if lookups else None
+        return {"routes": routes, "memory_entries": memory_entries,
+                "disk_bytes": disk_bytes, "evictions": self.evictions}
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from therapist.conversation_generator.object_lexicon import ObjectLexicon
+
+
+@pytest.fixture
+def lexicon(tmp_path):
+    path = tmp_path / "object_lexicon.json"
+    path.write_text(json.dumps({
+        "toothbrush": ["टूथब्रश", "ब्रश", "brush"],
+        "bed": ["बिस्तर", "पलंग", "palang", "bed"],
+    }, ensure_ascii=False), encoding="utf-8")
+    return ObjectLexicon(str(path), build_missing=False)
+
+
+@pytest.mark.parametrize("obj, response, name", [
+    ("toothbrush", "brush", "brush"),
+    ("toothbrush", "Toothbrush", "toothbrush"),
+    ("toothbrush", "टूथब्रश", "टूथब्रश"),
+    ("toothbrush", "yeh brush hai", "brush"),
+    ("toothbrush", "यह ब्रश है", "ब्रश"),
+    ("toothbrush", "it's a toothbrush", "toothbrush"),
+    ("bed", "ye palang h", "palang"),
+])
+def test_match_accepts_name_with_fillers(lexicon, obj, response, name):
+    assert lexicon.match(obj, response) == name
+
+
+@pytest.mark.parametrize("obj, response", [
+    ("toothbrush", "hair brush"),
+    ("toothbrush", "paint brush"),
+    ("toothbrush", "yeh baalon ka brush hai"),
+    ("bed", "flower bed"),
+    ("toothbrush", "brush nahi"),
+    ("toothbrush", "yeh hai"),
+])
+def test_match_leaves_compounds_to_the_evaluator(lexicon, obj, response):
+    assert lexicon.match(obj, response) is None
+
+
+def test_mentions_finds_a_name_inside_a_question(lexicon):
+    assert lexicon.mentions("toothbrush", "इस ब्रश से आप क्या करते हैं?") == "ब्रश"
+    assert lexicon.mentions("toothbrush", "सुबह दाँत साफ़ करने के लिए आप क्या इस्तेमाल करते हैं?") is None
@@ -0,0 +1,22 @@
+import pytest
+
+from therapist.structured_output import first_json_object, strip_code_fence
+
+
+@pytest.mark.parametrize("text, body", [
+    ('```json {"a":1}```', '{"a":1}'),
+    ('```json{"a":1}```', '{"a":1}'),
+    ('```json\n{"a":1}\n```', '{"a":1}'),
+    ('```\n{"a":1}\n```', '{"a":1}'),
+    ('hint:\n```JSON\n{"a":1}```\nthanks', '{"a":1}'),
+    ('```python\nx = 1\n```', 'x = 1'),
+    ('```hello world```', 'hello world'),
+    ('no fence', 'no fence'),
+    ('```json {"a":1}', '```json {"a":1}'),
+])
+def test_strip_code_fence(text, body):
+    assert strip_code_fence(text) == body
+
+
+def test_first_json_object_in_one_line_fence():
+    assert first_json_object('```json {"a": 1}```') == {"a": 1}
@@ -0,0 +1,74 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from therapist.config import LLM_CONCURRENCY, EMBEDDING_CONCURRENCY, DOWNLOAD_CONCURRENCY, CLIP_WORKERS
+
+
+class ResourceLimits:
+    """
+    Per-resource concurrency limits for the async exercise pipeline.
+
+    LLM calls, embedding calls and image downloads each get their own
+    semaphore so a burst of one kind can't starve the others. CLIP inference
+    runs on a small dedicated thread pool (it is CPU/GPU bound and holds the
+    model), other blocking work (parquet reads, pandas, sqlite) on a general
+    IO pool. Semaphores are created lazily so they bind to the loop in use.
+    """
+
+    def __init__(self, llm: int = LLM_CONCURRENCY, embedding: int = EMBEDDING_CONCURRENCY,
+                 download: int = DOWNLOAD_CONCURRENCY, clip_workers: int = CLIP_WORKERS,
+                 io_workers: int = 16):
+        self.sizes = {"llm": llm, "embedding": embedding, "download": download}
+        self._sems = {}
+        self._loop = None
+        self.clip_executor = ThreadPoolExecutor(max_workers=clip_workers, thread_name_prefix="clip")
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="pipeline-io")
+
+    def _sem(self, name: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._sems = {k: asyncio.Semaphore(v) for k, v in self.sizes.items()}
+        return self._sems[name]
+
+    @staticmethod
+    async def _run(executor, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+    async def llm_call(self, coro):
+        """Await an LLM coroutine under the LLM limit."""
+        async with self._sem("llm"):
+            return await coro
+
+    async def embedding(self, fn, *args, **kwargs):
+        """Run a blocking embedding call under the embedding limit."""
+        async with self._sem("embedding"):
+            return await self._run(self.io_executor, fn, *args, **kwargs)
+
+    async def download(self, fn, *args, **kwargs):
+        """Run a blocking download call under the download limit."""
+        async with self._sem("download"):
+            return await self._run(self.io_executor, fn, *args, **kwargs)
+
+    async def clip(self, fn, *args, **kwargs):
+        """Run CLIP inference on the bounded CLIP pool."""
+        return await self._run(self.clip_executor, fn, *args, **kwargs)
+
+    async def cpu(self, fn, *args, **kwargs):
+        """Run other blocking work (pandas, parquet, sqlite) off the event loop."""
+        return await self._run(self.io_executor, fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {name: {"limit": size,
+                       "available": self._sems[name]._value if name in self._sems else size}
+                for name, size in self.sizes.items()}
+
+    def shutdown(self):
+        self.clip_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+
+
+# process-wide limits shared by every exercise request
+limits = ResourceLimits()
@@ -1 +1,32 @@
-url="http://localhost:7879/api/llm/generate"
\ No newline at end of file
+import os
+
+# LLM router (llm_call/llm_api.py), used through therapist.llm_client
+LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "http://localhost:7879/api/llm/generate")
+LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+
+# generate_image result cache (therapist/image_generator/result_cache.py)
+IMAGE_CACHE_MIN_SCORE = 0.3          # stored images below this CLIP score get refreshed
+IMAGE_CACHE_TTL_SEC = 7 * 24 * 3600  # stored images older than this get refreshed
+IMAGE_CACHE_LOW_SCORE_RETRY_SEC = 6 * 3600  # first retry of a low-score image; doubles while refreshes don't help
+IMAGE_CACHE_TTL_OVERRIDES = {}       # per-object TTLs, e.g. {"food": 24 * 3600}
+
+# async exercise pipeline limits (therapist/concurrency.py)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))              # in-flight router calls
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))   # in-flight embedding batches
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "16"))    # concurrent image fetch batches
+CLIP_WORKERS = int(os.getenv("CLIP_WORKERS", "2"))                     # threads running CLIP inference
+
+# speculative evaluate() (generate_therapist._evaluate_speculative)
+EVAL_SPECULATIVE = os.getenv("EVAL_SPECULATIVE", "0") == "1"        # default mode for /validate_sets; opt in with 1
+EVAL_HINT_CANDIDATES = int(os.getenv("EVAL_HINT_CANDIDATES", "2"))   # hints critiqued in parallel
+EVAL_EXTRA_LLM_BUDGET = int(os.getenv("EVAL_EXTRA_LLM_BUDGET", "4")) # LLM calls allowed beyond the sequential chain
+
+# local gibberish filter in front of ClassifierAgent; tune with
+# python -m therapist.conversation_generator.gibberish_calibration
+GIBBERISH_LOCAL_THRESHOLD = float(os.getenv("GIBBERISH_LOCAL_THRESHOLD", "0.9"))
+
+# request deadlines of the therapist routes; backend_api's calls to them wait this long (+ margin)
+EXERCISE_SET_DEADLINE_SEC = float(os.getenv("EXERCISE_SET_DEADLINE_SEC", "240"))  # profiled at 100-200 s
+VALIDATE_DEADLINE_SEC = float(os.getenv("VALIDATE_DEADLINE_SEC", "60"))
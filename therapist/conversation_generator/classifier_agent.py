@@ -1,13 +1,37 @@
 import json
-from therapist.utils import clean_json
-from therapist.config import url
-import httpx
+import threading
+from therapist.structured_output import generate_structured, CLASSIFIER
+from therapist.config import GIBBERISH_LOCAL_THRESHOLD
+from therapist.conversation_generator.gibberish_filter import GibberishFilter
+from therapist.conversation_generator.object_lexicon import ObjectLexicon
 
 
 class ClassifierAgent:
-    def __init__(self):
-        pass
-    def evaluate_and_predict(self,patient_response):
+    def __init__(self, local_threshold=GIBBERISH_LOCAL_THRESHOLD, lexicon=None):
+        # local verdicts at or above this confidence skip the LLM call
+        self.local = GibberishFilter()
+        self.local_threshold = local_threshold
+        # accepted names per object; naming the target is never gibberish
+        self.lexicon = lexicon if lexicon is not None else ObjectLexicon(build_missing=False)
+        self.counters = {"local": 0, "llm": 0, "object_name": 0}
+        self._lock = threading.Lock()
+
+    def evaluate_and_predict(self,patient_response, object_name=None):
+        """True if the response is gibberish; the LLM is asked only when the local filter is unsure."""
+        verdict = self.local.classify(patient_response)
+        decided_locally = verdict.confidence >= self.local_threshold
+        if decided_locally and verdict.is_gibberish and object_name \
+                and self.lexicon.match(object_name, patient_response) is not None:
+            with self._lock:
+                self.counters["object_name"] += 1
+            return False
+        with self._lock:
+            self.counters["local" if decided_locally else "llm"] += 1
+        if decided_locally:
+            return verdict.is_gibberish
+        return self.llm_predict(patient_response)
+
+    def llm_predict(self,patient_response):
         classifier_prompt = f"""
 You are a **response classifier** assisting a **speech therapist** working with patients who have **aphasia**. Your job is to **classify the patient’s spoken response** as either **gibberish** or **non-gibberish**.
 
@@ -69,15 +93,7 @@ Return only a valid JSON dictionary like this — **no extra quotes or character
     """
         messages=[{"role": "user", "content": classifier_prompt}]
 
-        response = httpx.post(
-                url,
-                json={"input_text": messages},
-                timeout=60
-            )
-        response.raise_for_status()
-        content = response.json()["response"]
-        content=clean_json(content)
-        decision_dict = json.loads(content)
+        decision_dict = generate_structured(messages, CLASSIFIER)
         # print("classi",decision_dict)
 
         return decision_dict["classification"]
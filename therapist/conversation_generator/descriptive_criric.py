@@ -1,8 +1,6 @@
 from typing import Dict, Tuple
 import json 
-from therapist.utils import clean_json
-from therapist.config import url
-import httpx
+from therapist.structured_output import generate_structured, CRITIC
 
 class ValidatorAgent:
     def __init__(self):
@@ -55,7 +53,8 @@ Return only a valid JSON dictionary like this — **no extra quotes or character
 
     """
          # Construct validation request
-        self.messages = [
+        # local, not self.messages: critics run concurrently on several candidates
+        messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"""
             Object name:{object_name}
@@ -66,17 +65,8 @@ Return only a valid JSON dictionary like this — **no extra quotes or character
         ]
 
         try:
-            messages=self.messages
-            response = httpx.post(
-                url,
-                json={"input_text": messages},
-                timeout=60
-            )
-            response.raise_for_status()
-            content = response.json()["response"]
-            content=clean_json(content)
-            decision_dict = json.loads(content)
-            return (decision_dict["accepted"], decision_dict["reason"])
+            decision_dict = generate_structured(messages, CRITIC)
+            return (decision_dict["accepted"], decision_dict.get("reason", ""))
 
             
         except Exception as e:
@@ -1,8 +1,7 @@
 import openai
 import os
 from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
-import httpx
+from therapist.llm_client import llm
 
 class HintgeneratorAgent:
     def __init__(self):
@@ -13,7 +12,7 @@ class HintgeneratorAgent:
     def add_assistant_message(self, content):
         self.messages.append({"role": "assistant", "content": content})
 
-    def generate_hint(self, object_name,question,user_response,eval_reason,ph_hint_history,critic_feedback):
+    def _build_messages(self, object_name,question,user_response,eval_reason,ph_hint_history,critic_feedback):
         descriptive_hint_prompt = """
 You are a **warm, supportive, and creative speech therapy assistant** helping patients with **aphasia** recognize and name everyday objects.
 Your hints must feel **like a natural conversation**, not a list of facts.
@@ -103,17 +102,32 @@ No extra text, no formatting, no explanations.
                 """}
             ]
 
+        return messages
+
+    def generate_hint(self, object_name,question,user_response,eval_reason,ph_hint_history,critic_feedback,coalesce=True):
+        messages = self._build_messages(object_name,question,user_response,eval_reason,ph_hint_history,critic_feedback)
         try:
-            response = httpx.post(
-                    url,
-                    json={"input_text": messages},
-                    timeout=60
-                )
-            response.raise_for_status()
-            content = response.json()["response"]
+            content = llm.generate(messages, coalesce=coalesce)
             content=clean_json(content)
                 # print(content)
             return (content)
         except Exception as e:
             print("Error in _descriptive_hint_generation:", e)
             return None
+
+    def stream_hint(self, object_name,question,user_response,eval_reason,ph_hint_history,critic_feedback):
+        """
+        Same hint as `generate_hint`, yielded as text deltas while the model writes it.
+        A failure before the first delta yields nothing; after it the error is
+        raised, so a truncated hint is never taken for a finished one.
+        """
+        started = False
+        try:
+            messages = self._build_messages(object_name,question,user_response,eval_reason,ph_hint_history,critic_feedback)
+            for delta in llm.stream(messages):
+                started = True
+                yield delta
+        except Exception as e:
+            print("Error in _descriptive_hint_generation:", e)
+            if started:
+                raise
@@ -1,11 +1,20 @@
-from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
-import httpx
+from therapist.structured_output import generate_structured, EVALUATOR, ParseError
+from therapist.conversation_generator.object_lexicon import ObjectLexicon
 
 class EvaluatorAgent:
-    def __init__(self):
-        pass
+    def __init__(self, lexicon=None):
+        # accepted names per object; a match is Correct without an LLM call
+        self.lexicon = lexicon if lexicon is not None else ObjectLexicon()
+        self.counters = {"lexicon": 0, "llm": 0}
+
     def evaluate_and_predict(self, object,question,question_type,patient_response):
+        """Parsed verdict: {"Evaluation": "Correct" | "Partially Correct" | "Incorrect", "Reason": ...}."""
+        match = self.lexicon.match(object, patient_response)
+        if match is not None:
+            self.counters["lexicon"] += 1
+            return {"Evaluation": "Correct",
+                    "Reason": f"Response matches '{match}', an accepted name for the target object."}
+        self.counters["llm"] += 1
         evaluation_prompt = f"""
     You are an evaluator in a speech therapy system for aphasia patients. Assume the patient's response is already non-gibberish.
 
@@ -74,17 +83,11 @@ Output:
 
         messages=[{"role": "user", "content": evaluation_prompt}]
         try:
-            response = httpx.post(
-                    url,
-                    json={"input_text": messages},
-                    timeout=60
-                )
-            response.raise_for_status()
-            content = response.json()["response"]
-            content=clean_json(content)
-            return (content)
-        except Exception as e:
+            return generate_structured(messages, EVALUATOR)
+        except ParseError as e:
+            # the model answered but never in a usable form: give a hint as for an incorrect answer.
+            # transport errors (LLMError) propagate so the route fails instead of logging a made-up verdict
             print("Error in _evaluatequestion:", e)
-            return None
+            return {"Evaluation": "Incorrect", "Reason": ""}
         
 
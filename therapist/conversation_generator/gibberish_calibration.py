@@ -0,0 +1,112 @@
+"""
+Calibrate the local gibberish filter against logged patient responses.
+
+Reads distinct `user_response` values from `validation_attempts` (and legacy
+`validation_interactions`), labels
+them with the LLM classifier (labels are cached in a JSON file so reruns cost
+nothing) and reports, per confidence threshold, how many responses the local
+filter would decide on its own and how often it agrees with the LLM there.
+
+    python -m therapist.conversation_generator.gibberish_calibration --limit 2000
+"""
+import argparse
+import json
+import os
+import time
+
+from therapist.conversation_generator.classifier_agent import ClassifierAgent
+from therapist.conversation_generator.gibberish_filter import GibberishFilter
+
+THRESHOLDS = (0.75, 0.8, 0.85, 0.88, 0.9, 0.92, 0.95, 0.97, 0.99)
+
+
+def load_responses(limit=None):
+    from backend.database import SessionLocal
+    from backend.models import ValidationAttempt, ValidationInteraction
+
+    db = SessionLocal()
+    try:
+        query = (db.query(ValidationAttempt.user_response.label("user_response"))
+                 .filter(ValidationAttempt.user_response.isnot(None))
+                 .union(db.query(ValidationInteraction.user_response)
+                        .filter(ValidationInteraction.user_response.isnot(None)))
+                 .order_by("user_response"))
+        if limit:
+            query = query.limit(limit)
+        return [r for (r,) in query.all() if r.strip()]
+    finally:
+        db.close()
+
+
+def llm_labels(responses, labels_path):
+    """response -> LLM gibberish label, cached in labels_path."""
+    labels = {}
+    if os.path.exists(labels_path):
+        with open(labels_path, encoding="utf-8") as f:
+            labels = json.load(f)
+    agent = ClassifierAgent()
+    todo = [r for r in responses if r not in labels]
+    for i, response in enumerate(todo, 1):
+        try:
+            labels[response] = bool(agent.llm_predict(response))
+        except Exception as e:
+            print(f"LLM label failed for {response!r}: {e}")
+        if i % 50 == 0 or i == len(todo):
+            print(f"labelled {i}/{len(todo)}")
+            with open(labels_path, "w", encoding="utf-8") as f:
+                json.dump(labels, f, ensure_ascii=False, indent=1)
+    return labels
+
+
+def calibrate(responses, labels, gibberish_filter, thresholds=THRESHOLDS):
+    start = time.perf_counter()
+    verdicts = {r: gibberish_filter.classify(r) for r in responses}
+    per_call_us = (time.perf_counter() - start) / max(len(responses), 1) * 1e6
+
+    labelled = [r for r in responses if r in labels]
+    rows = []
+    for t in thresholds:
+        local = [r for r in labelled if verdicts[r].confidence >= t]
+        agree = sum(verdicts[r].is_gibberish == labels[r] for r in local)
+        # the costly mistake: a real word routed to phonetic hints as gibberish
+        false_gibberish = sum(verdicts[r].is_gibberish and not labels[r] for r in local)
+        rows.append({
+            "threshold": t,
+            "local_share": round(len(local) / len(labelled), 4) if labelled else None,
+            "agreement": round(agree / len(local), 4) if local else None,
+            "false_gibberish": false_gibberish,
+            "missed_gibberish": sum(not verdicts[r].is_gibberish and labels[r] for r in local),
+        })
+    disagreements = [(r, verdicts[r], labels[r]) for r in labelled
+                     if verdicts[r].is_gibberish != labels[r]]
+    return rows, disagreements, per_call_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=None, help="at most this many distinct responses")
+    parser.add_argument("--labels", default="gibberish_llm_labels.json", help="LLM label cache")
+    parser.add_argument("--show", type=int, default=20, help="disagreements to print")
+    args = parser.parse_args()
+
+    responses = load_responses(args.limit)
+    print(f"{len(responses)} distinct logged responses")
+    labels = llm_labels(responses, args.labels)
+    rows, disagreements, per_call_us = calibrate(responses, labels, GibberishFilter())
+
+    print(f"\nlocal filter: {per_call_us:.1f} µs per response")
+    print(f"{'threshold':>9} {'local':>7} {'agree':>7} {'false_gib':>9} {'missed_gib':>10}")
+    for row in rows:
+        share = f"{row['local_share']:.1%}" if row["local_share"] is not None else "-"
+        agree = f"{row['agreement']:.1%}" if row["agreement"] is not None else "-"
+        print(f"{row['threshold']:>9} {share:>7} {agree:>7} {row['false_gibberish']:>9} {row['missed_gibberish']:>10}")
+
+    if disagreements and args.show:
+        print("\nlocal verdict vs LLM (most confident first):")
+        for response, verdict, label in sorted(disagreements, key=lambda d: -d[1].confidence)[:args.show]:
+            print(f"  {response!r:30} local={verdict.is_gibberish} ({verdict.confidence:.2f}, {verdict.reason})  llm={label}")
+    print("\nSet GIBBERISH_LOCAL_THRESHOLD to the lowest threshold whose false_gibberish you can accept.")
+
+
+if __name__ == "__main__":
+    main()
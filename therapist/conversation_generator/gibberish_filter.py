@@ -0,0 +1,152 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+LEXICON_PATH = Path(__file__).with_name("hindi_lexicon.txt")
+
+_TOKEN = re.compile(r"[a-z]+|[ऀ-ॿ]+")
+_LATIN_VOWELS = set("aeiouy")
+_REPEATED_SYLLABLE = re.compile(r"^(.{1,3}?)\1{2,}$")
+_DEV_SIGNS = "ऺ-ॏॢॣ"  # dependent vowel signs, virama, nukta
+_DEV_BAD_START = re.compile(f"^[{_DEV_SIGNS}ऀ-ः]")
+_DEV_DOUBLE_SIGN = re.compile(f"[ा-ौ][ा-्]|्[ा-्]")
+# n-gram verdicts stay below the usual local threshold: English compounds like
+# "matchbox" or "bookshelf" score like noise under a mostly-Hindi trigram model
+NGRAM_MAX_CONFIDENCE = 0.85
+# romanized spelling variants collapse onto one key: pyaaj/pyaaz/piyaz, phal/fal, doodh/dudh
+_LATIN_RULES = [("ph", "f"), ("w", "v"), ("z", "j"), ("q", "k"), ("ee", "i"), ("oo", "u"),
+                ("iya", "ya"), ("y", "i")]
+
+
+class Verdict(NamedTuple):
+    is_gibberish: bool
+    confidence: float  # 0.5 = no idea, 1.0 = certain
+    reason: str
+
+
+def _squeeze(word: str) -> str:
+    return re.sub(r"(.)\1+", r"\1", word)
+
+
+def phonetic_key(word: str) -> str:
+    """Spelling-insensitive key for a token: romanized variants and nukta/chandrabindu forms coincide."""
+    if word and "ऀ" <= word[0] <= "ॿ":
+        word = unicodedata.normalize("NFC", word).replace("़", "").replace("ँ", "ं")
+        return _squeeze(word)
+    for a, b in _LATIN_RULES:
+        word = word.replace(a, b)
+    # aspiration and doubled letters are the usual transliteration noise
+    word = word[:1] + re.sub(r"(?<=[^aeiou])h", "", word[1:])
+    return _squeeze(word)
+
+
+def _deletes(key: str) -> Iterable[str]:
+    return (key[:i] + key[i + 1:] for i in range(len(key)))
+
+
+class GibberishFilter:
+    """
+    Local gibberish / non-gibberish check for a patient response.
+
+    In order: lexicon hit (exact, spelling-variant or one edit away) means
+    non-gibberish; phonotactic violations (no vowels, repeated syllables,
+    malformed Devanagari) mean gibberish; otherwise a character-trigram model
+    trained on the lexicon scores how word-like the token is. Every verdict
+    carries a confidence; callers fall back to the LLM classifier below their
+    threshold, which n-gram verdicts never reach.
+    """
+
+    def __init__(self, lexicon_path=LEXICON_PATH, extra_words: Iterable[str] = (),
+                 midpoint: Optional[float] = None, scale: float = 2.5):
+        words = set(extra_words)
+        with open(lexicon_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip().lower()
+                if line and not line.startswith("#"):
+                    words.add(line)
+        self.words = {w for w in words if _TOKEN.fullmatch(w)}
+        self.keys = {phonetic_key(w) for w in self.words}
+        # one-edit neighbourhood (symmetric deletes), only for keys long enough to be specific
+        self.delete_index = {}
+        for key in self.keys:
+            if len(key) >= 4:
+                for d in _deletes(key):
+                    self.delete_index.setdefault(d, key)
+        self._train(self.keys)
+        self.scale = scale
+        self.midpoint = self._default_midpoint() if midpoint is None else midpoint
+
+    def _train(self, keys):
+        self.trigrams, self.bigrams, self.unigrams = Counter(), Counter(), Counter()
+        for key in keys:
+            padded = f"^^{key}$"
+            for i in range(2, len(padded)):
+                self.trigrams[padded[i - 2:i + 1]] += 1
+                self.bigrams[padded[i - 2:i]] += 1
+                self.unigrams[padded[i]] += 1
+        self.total = sum(self.unigrams.values())
+        self.alphabet = len(self.unigrams) + 1
+
+    def ngram_score(self, key: str) -> float:
+        """Mean log-probability per character under the lexicon trigram model (interpolated)."""
+        padded = f"^^{key}$"
+        logp = 0.0
+        for i in range(2, len(padded)):
+            tri = self.trigrams.get(padded[i - 2:i + 1], 0)
+            ctx = self.bigrams.get(padded[i - 2:i], 0)
+            uni = (self.unigrams.get(padded[i], 0) + 1) / (self.total + self.alphabet)
+            p = 0.7 * (tri / ctx if ctx else 0.0) + 0.3 * uni
+            logp += math.log(p)
+        return logp / (len(padded) - 2)
+
+    def _default_midpoint(self) -> float:
+        # a bit below the score of the least word-like 5% of the lexicon itself
+        scores = sorted(self.ngram_score(k) for k in self.keys)
+        return scores[len(scores) // 20] - 0.5 if scores else -3.0
+
+    def _token_verdict(self, token: str) -> Verdict:
+        key = phonetic_key(token)
+        if token in self.words or key in self.keys:
+            return Verdict(False, 0.99, f"lexicon:{token}")
+        devanagari = "ऀ" <= token[0] <= "ॿ"
+        # vowel signs are code points of their own, so Devanagari keys are specific sooner
+        if len(key) >= (3 if devanagari else 4) and (
+                key in self.delete_index or any(d in self.keys or d in self.delete_index for d in _deletes(key))):
+            return Verdict(False, 0.92, f"near-lexicon:{token}")
+
+        if devanagari:
+            if _DEV_BAD_START.match(token) or _DEV_DOUBLE_SIGN.search(token):
+                return Verdict(True, 0.95, f"malformed-devanagari:{token}")
+        else:
+            squeezed = _squeeze(token)
+            if len(squeezed) >= 3 and not (set(squeezed) & _LATIN_VOWELS):
+                return Verdict(True, 0.95, f"no-vowels:{token}")
+        if len(key) >= 4 and _REPEATED_SYLLABLE.match(key):
+            return Verdict(True, 0.9, f"repeated-syllable:{token}")
+        if len(token) >= 2 * len(key) + 1:
+            # "aallaaa": mostly stretched letters around a tiny core
+            return Verdict(True, 0.88, f"stretched:{token}")
+        if len(key) <= 2:
+            # short and unknown: the prompt's "tu / le / ra" case, leave close calls to the LLM
+            return Verdict(True, 0.75, f"short-unknown:{token}")
+
+        margin = self.ngram_score(key) - self.midpoint
+        confidence = 1.0 / (1.0 + math.exp(-abs(margin) * self.scale))
+        # the Devanagari half of the lexicon is small, so its scores are trusted even less
+        confidence = min(confidence, 0.8 if devanagari else NGRAM_MAX_CONFIDENCE)
+        return Verdict(margin < 0, confidence, f"ngram:{token}:{margin:+.2f}")
+
+    def classify(self, response: str) -> Verdict:
+        """Verdict for a whole response; any clearly meaningful token makes it non-gibberish."""
+        tokens = _TOKEN.findall(unicodedata.normalize("NFC", (response or "").lower()))
+        if not tokens:
+            return Verdict(True, 0.97, "no-letters")
+        verdicts = [self._token_verdict(t) for t in tokens]
+        meaningful = [v for v in verdicts if not v.is_gibberish]
+        if meaningful:
+            return max(meaningful, key=lambda v: v.confidence)
+        # all tokens look like gibberish: trust the least certain one
+        return min(verdicts, key=lambda v: v.confidence)
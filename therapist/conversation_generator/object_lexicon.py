@@ -0,0 +1,228 @@
+"""
+Per-object lexicon of accepted answers: names, synonyms, short forms and
+transliterations ("टूथब्रश", "ब्रश", "toothbrush", "brush", ...).
+
+Entries are generated once per object by the LLM and kept in
+object_lexicon.json. EvaluatorAgent checks it before its LLM call and marks a
+response Correct when it names the object in one of its accepted forms.
+
+    python -m therapist.conversation_generator.object_lexicon            # objects in object_metadata.json
+    python -m therapist.conversation_generator.object_lexicon cup broom  # specific objects
+"""
+import argparse
+import fcntl
+import json
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from therapist.structured_output import generate_structured, OBJECT_NAMES
+from therapist.conversation_generator.gibberish_filter import phonetic_key
+
+DEFAULT_LEXICON_PATH = "object_lexicon.json"
+_TOKEN = re.compile(r"[a-z]+|[ऀ-ॿ]+")
+# names shorter than this (as phonetic keys) are never looked for inside longer text
+MIN_CONTAINED_KEY_LEN = 3
+# pronouns, copulas and articles around a name ("yeh kela hai", "it's a cup"); any
+# other extra word may make it a different object ("hair brush", "flower bed")
+_FILLERS = {phonetic_key(w) for w in (
+    "yeh", "ye", "yah", "woh", "wo", "vo", "hai", "h", "hain", "ek", "to",
+    "यह", "ये", "वह", "वो", "है", "हैं", "एक", "तो",
+    "it", "its", "is", "this", "that", "thats", "s", "a", "an", "the",
+)}
+# "brush nahi": a negated name is left to the LLM evaluator
+_NEGATIONS = {phonetic_key(w) for w in ("nahi", "nahin", "nhi", "not", "no", "नहीं", "नही", "ना")}
+
+
+def _keys(text: str) -> List[str]:
+    return [phonetic_key(t) for t in _TOKEN.findall(unicodedata.normalize("NFC", text.lower()))]
+
+
+class ObjectLexicon:
+    """
+    object -> accepted names, with an index of their phonetic keys.
+
+    `match` accepts a response when its tokens equal an accepted name
+    (spelling variants collapse through `phonetic_key`), possibly with filler
+    words around it ("yeh kela hai"); any other containment is left to the
+    LLM. `mentions` finds a name anywhere in a text. Missing objects are built
+    in the background so the next evaluation of them is local.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEXICON_PATH, build_missing: bool = True):
+        self.path = path
+        self.build_missing = build_missing
+        self.entries: Dict[str, List[str]] = {}
+        self._index: Dict[str, List[tuple]] = {}
+        self._lock = threading.Lock()
+        self._building = set()
+        # objects built by this process since the file was read; they win when saving
+        self._built = set()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="object-lexicon")
+        for obj, names in self._read().items():
+            self._add(obj, names)
+
+    def _read(self) -> Dict[str, List[str]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _norm_object(object_name: str) -> str:
+        return object_name.strip().lower()
+
+    def _add(self, object_name: str, names: List[str]):
+        obj = self._norm_object(object_name)
+        names = list(dict.fromkeys([object_name.strip(), *[n.strip() for n in names if isinstance(n, str)]]))
+        keyed = [(name, tuple(_keys(name))) for name in names]
+        with self._lock:
+            self.entries[obj] = names
+            self._index[obj] = [(name, k) for name, k in keyed if k]
+
+    def __contains__(self, object_name: str) -> bool:
+        return self._norm_object(object_name) in self.entries
+
+    def _names(self, object_name: str) -> List[tuple]:
+        obj = self._norm_object(object_name)
+        with self._lock:
+            names = self._index.get(obj)
+        if names is None:
+            names = [(object_name, tuple(_keys(object_name)))]
+            self.schedule_build(object_name)
+        return names
+
+    @staticmethod
+    def _contained(names: List[tuple], text_keys: tuple) -> Optional[str]:
+        for name, key in sorted(names, key=lambda n: -len(n[1])):
+            if sum(map(len, key)) < MIN_CONTAINED_KEY_LEN:
+                continue
+            n = len(key)
+            if any(text_keys[i:i + n] == key for i in range(len(text_keys) - n + 1)):
+                return name
+        return None
+
+    @staticmethod
+    def _without_fillers(keys: tuple) -> tuple:
+        return tuple(k for k in keys if k not in _FILLERS)
+
+    def match(self, object_name: str, response: str) -> Optional[str]:
+        """The accepted name the response matches, or None."""
+        names = self._names(object_name)
+        response_keys = tuple(_keys(response or ""))
+        if not response_keys or _NEGATIONS.intersection(response_keys):
+            return None
+        for name, key in names:
+            if response_keys == key:
+                return name
+        content = self._without_fillers(response_keys)
+        if not content:
+            return None
+        for name, key in names:
+            if content == self._without_fillers(key):
+                return name
+        return None
+
+    def mentions(self, object_name: str, text: str) -> Optional[str]:
+        """The accepted name that occurs in `text` (a framed question, say), or None."""
+        return self._contained(self._names(object_name), tuple(_keys(text or "")))
+
+    def _build_messages(self, object_name: str):
+        prompt = f"""
+        A speech therapy patient in India is asked to name this object: "{object_name}".
+        List every answer that should count as naming it correctly:
+        - its common Hindi names in Devanagari, including everyday short forms (e.g. टूथब्रश → ब्रश)
+        - the same Hindi names written in English letters, with common spelling variants
+        - its English name, common English synonyms and short forms
+        Do not include broader categories, related objects or parts of the object.
+        Return strict JSON only, no markdown: {{"names": ["...", "..."]}}
+        """
+        return [{"role": "user", "content": prompt}]
+
+    def build(self, object_name: str) -> List[str]:
+        """Ask the LLM for the object's accepted names and store them."""
+        names = generate_structured(self._build_messages(object_name), OBJECT_NAMES)["names"]
+        self._add(object_name, names)
+        with self._lock:
+            self._built.add(self._norm_object(object_name))
+        self.save()
+        return self.entries[self._norm_object(object_name)]
+
+    def ensure(self, object_names: List[str], max_workers: int = 8) -> List[str]:
+        """Build the objects missing from the lexicon now, in parallel; returns those still missing."""
+        missing = list(dict.fromkeys(o for o in object_names if o not in self))
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+                list(pool.map(self._build_quietly, missing))
+        return [o for o in missing if o not in self]
+
+    def schedule_build(self, object_name: str):
+        if not self.build_missing:
+            return
+        obj = self._norm_object(object_name)
+        with self._lock:
+            if obj in self._building or obj in self.entries:
+                return
+            self._building.add(obj)
+        self._pool.submit(self._build_quietly, object_name)
+
+    def _build_quietly(self, object_name: str):
+        try:
+            self.build(object_name)
+        except Exception as e:
+            print(f"Object lexicon build failed for '{object_name}': {type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(self._norm_object(object_name))
+
+    def save(self):
+        """
+        Merge this process's builds into the file. Other workers build other
+        objects, so the file is re-read under a lock and their entries are
+        kept (and picked up here) rather than overwritten.
+        """
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = self._read()
+                with self._lock:
+                    built = {obj: self.entries[obj] for obj in self._built}
+                for obj, names in data.items():
+                    if obj not in built:
+                        self._add(obj, names)
+                data.update(built)
+                tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=1)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("objects", nargs="*", help="objects to build (default: keys of --metadata)")
+    parser.add_argument("--metadata", default="object_metadata.json")
+    parser.add_argument("--lexicon", default=DEFAULT_LEXICON_PATH)
+    parser.add_argument("--force", action="store_true", help="rebuild objects already in the lexicon")
+    args = parser.parse_args()
+
+    objects = args.objects
+    if not objects:
+        with open(args.metadata, encoding="utf-8") as f:
+            objects = list(json.load(f))
+    lexicon = ObjectLexicon(args.lexicon, build_missing=False)
+    for obj in objects:
+        if obj in lexicon and not args.force:
+            continue
+        try:
+            print(f"{obj}: {lexicon.build(obj)}")
+        except Exception as e:
+            print(f"{obj}: failed ({type(e).__name__}: {e})")
+
+
+if __name__ == "__main__":
+    main()
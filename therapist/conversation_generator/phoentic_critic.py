@@ -2,9 +2,7 @@ import openai
 import os
 from typing import Tuple
 import json
-from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
-import httpx
+from therapist.structured_output import generate_structured, CRITIC
 
 class PhoneticValidatorAgent:
     def __init__(self):
@@ -75,7 +73,8 @@ Return only a valid JSON dictionary like this — **no extra quotes or character
 {{"accepted": true if correct false if not correct , "reason": "Brief explanation here."}}        
               """
 
-      self.messages = [
+      # local, not self.messages: critics run concurrently on several candidates
+      messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"""
             Object name:{object_name}
@@ -86,20 +85,9 @@ Return only a valid JSON dictionary like this — **no extra quotes or character
         ]
 
       try:
-          messages=self.messages
-          response = httpx.post(
-                url,
-                json={"input_text": messages},
-                timeout=60
-            )
-          response.raise_for_status()
-          content = response.json()["response"]
-          content=clean_json(content)
-          print("content",content)
-          decision_dict = json.loads(content)
-          print("go")
+          decision_dict = generate_structured(messages, CRITIC)
           print("reason",decision_dict)
-          return (decision_dict["accepted"], decision_dict["reason"])
+          return (decision_dict["accepted"], decision_dict.get("reason", ""))
 
       except Exception as e:
           print(f"Validation error: {str(e)}")
@@ -1,13 +1,12 @@
 
 from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
-import httpx
+from therapist.llm_client import llm
 
 class PhoneticHintAgent:
     def __init__(self):
         pass
 
-    def generate_hint(self, object_name,question,user_response,ph_hint_history,critic_feedback):
+    def _build_messages(self, object_name,question,user_response,ph_hint_history,critic_feedback):
         phonetic_hint_prompt = f"""
 
 You are a **warm, patient, and encouraging speech therapy assistant** working with **aphasia patients** to help them speak common object names correctly using **phonetic and repetition-based cues**.
@@ -72,8 +71,7 @@ Use your **judgment** to decide how to respond, like a human therapist would:
 ### Output Format
 <one liner hint >
 """
-        try:
-            messages=[
+        messages=[
                     {"role": "user", "content": phonetic_hint_prompt},
                     {"role": "user", "content": f"""
                 Object name: {object_name}
@@ -83,18 +81,32 @@ Use your **judgment** to decide how to respond, like a human therapist would:
                 Critic Feedback :{critic_feedback}
                 """}
                 ]
-            response = httpx.post(
-                        url,
-                        json={"input_text": messages},
-                        timeout=60
-                    )
-            response.raise_for_status()
-            content = response.json()["response"]
+        return messages
+
+    def generate_hint(self, object_name,question,user_response,ph_hint_history,critic_feedback,coalesce=True):
+        try:
+            messages = self._build_messages(object_name,question,user_response,ph_hint_history,critic_feedback)
+            content = llm.generate(messages, coalesce=coalesce)
             content=clean_json(content)
             print(content)
             return (content)
         except Exception as e:
             print("Error in _phonetic_hint_generation:", e)
             return None
-        
-        
+
+    def stream_hint(self, object_name,question,user_response,ph_hint_history,critic_feedback):
+        """
+        Same hint as `generate_hint`, yielded as text deltas while the model writes it.
+        A failure before the first delta yields nothing; after it the error is
+        raised, so a truncated hint is never taken for a finished one.
+        """
+        started = False
+        try:
+            messages = self._build_messages(object_name,question,user_response,ph_hint_history,critic_feedback)
+            for delta in llm.stream(messages):
+                started = True
+                yield delta
+        except Exception as e:
+            print("Error in _phonetic_hint_generation:", e)
+            if started:
+                raise
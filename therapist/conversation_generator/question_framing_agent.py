@@ -1,10 +1,16 @@
 
-import os , httpx
-from therapist.config import url
+import os
+import re
+from therapist.structured_output import parse_structured, QUESTION_BATCH
+from therapist.llm_client import llm
+from therapist.conversation_generator.object_lexicon import ObjectLexicon
+
+_DEVANAGARI = re.compile(r"[\u0900-\u097F]")
 class QuestionFramingAgent:
-    def __init__(self):
-        pass
-    def frame_question_and_hint(self, object_name,question_type):
+    def __init__(self, lexicon=None):
+        # Hindi names and transliterations of each object, for the answer-leak check
+        self.lexicon = lexicon if lexicon is not None else ObjectLexicon(build_missing=False)
+    def _build_messages(self, object_name, question_type):
         prompt = f"""
         Frame a simple {question_type} style question in Hindi to help a patient with aphasia name this object: "{object_name}"
         Format:
@@ -14,14 +20,78 @@ class QuestionFramingAgent:
         #     model="gpt-4o",
         #     messages=[{"role": "user", "content": prompt}]
         # )
-        messages=[{"role": "user", "content": prompt}]
-        response = httpx.post(
-            url,
-            json={"input_text": messages},
-            timeout=60
-        )
-        response.raise_for_status()
-        content = response.json()["response"]
+        return [{"role": "user", "content": prompt}]
+
+    def frame_question_and_hint(self, object_name,question_type):
+        content = llm.generate(self._build_messages(object_name, question_type),
+                               cache_route="question_framing")
         print(content, ' inside framer')
         return content
-    
+
+    async def aframe_question_and_hint(self, object_name, question_type):
+        content = await llm.agenerate(self._build_messages(object_name, question_type),
+                                      cache_route="question_framing")
+        print(content, ' inside framer')
+        return content
+
+    def _build_batch_messages(self, object_names, question_type):
+        objects = "\n".join(f"- {o}" for o in object_names)
+        prompt = f"""
+        Frame a simple {question_type} style question in Hindi for each object below, to help a patient with aphasia name it.
+        Never mention the object's name in its own question.
+        Objects:
+{objects}
+        Return strict JSON only, no markdown:
+        {{"questions": {{"<object exactly as given>": "<description-style question>", ...}}}}
+        """
+        return [{"role": "user", "content": prompt}]
+
+    def prepare(self, object_names):
+        """Make sure the lexicon knows every object's names before questions for them are checked."""
+        for obj in self.lexicon.ensure(object_names):
+            print(f"No lexicon entry for '{obj}'; its question will be framed on its own")
+
+    def is_valid_question(self, question, object_name):
+        """A usable framed question: Hindi text that doesn't give the answer away in any of the object's names."""
+        if not isinstance(question, str) or not 5 <= len(question.strip()) <= 400:
+            return False
+        if not _DEVANAGARI.search(question):
+            return False
+        if object_name.strip().lower() in question.lower():
+            return False
+        if object_name not in self.lexicon:
+            # only the English name could be checked
+            return False
+        leaked = self.lexicon.mentions(object_name, question)
+        if leaked:
+            print(f"Framed question for '{object_name}' names it as '{leaked}'")
+            return False
+        return True
+
+    @staticmethod
+    def _parse_batch(content, object_names):
+        try:
+            questions = parse_structured(content, QUESTION_BATCH)["questions"]
+        except Exception as e:
+            # unframed objects fall back to per-object framing
+            print("Unparseable batch framing output:", e)
+            return {}
+        by_lower = {str(k).strip().lower(): v for k, v in questions.items()}
+        return {o: by_lower.get(o.strip().lower()) for o in object_names}
+
+    def frame_questions_batch(self, object_names, question_type):
+        """One call framing every object; returns object -> question (None where missing)."""
+        try:
+            content = llm.generate(self._build_batch_messages(object_names, question_type))
+        except Exception as e:
+            print("Error in frame_questions_batch:", e)
+            return {}
+        return self._parse_batch(content, object_names)
+
+    async def aframe_questions_batch(self, object_names, question_type):
+        try:
+            content = await llm.agenerate(self._build_batch_messages(object_names, question_type))
+        except Exception as e:
+            print("Error in frame_questions_batch:", e)
+            return {}
+        return self._parse_batch(content, object_names)
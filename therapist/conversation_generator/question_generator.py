@@ -2,9 +2,7 @@ import os
 import openai
 from typing import List, Dict, Optional
 import random
-from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
-import httpx
+from therapist.structured_output import generate_structured, agenerate_structured, QUESTION_SET
 class QuestionGeneratorAgent:
     def __init__(self):
         self._themes_by_severity: Dict[str, List[str]] = {
@@ -56,13 +54,40 @@ class QuestionGeneratorAgent:
         """
         chosen_theme = self._pick_theme(severity)
         print('checkpoint: 1 : ', chosen_theme)
-        raw = self.generate_question(age,gender,location,profession,severity,chosen_theme)
-        return safe_parse_json(raw)
+        return self.generate_question(age,gender,location,profession,severity,chosen_theme)
 
-    def generate_question(self, age: str,gender: str,location: str,profession: str,severity: str,theme: str) -> str:
+    async def agenerate_questions_for_severity(self, age=None, gender=None, location=None,
+                                               profession=None, language=None, severity=None) -> dict:
+        """Async version of `generate_questions_for_severity`."""
+        chosen_theme = self._pick_theme(severity)
+        print('checkpoint: 1 : ', chosen_theme)
+        return await self.agenerate_question(age,gender,location,profession,severity,chosen_theme)
+
+    def generate_question(self, age: str,gender: str,location: str,profession: str,severity: str,theme: str) -> dict:
         """
-        Generate questions for a concrete theme. Returns a JSON string from the model.
+        Generate questions for a concrete theme. Returns the parsed question set.
         """
+        try:
+            messages = self._build_messages(age, gender, location, profession, severity, theme)
+            content = generate_structured(messages, QUESTION_SET)
+            print(content)
+            return (content)
+        except Exception as e:
+            print("Error in _generatequestion:", e)
+            return None
+
+    async def agenerate_question(self, age: str,gender: str,location: str,profession: str,severity: str,theme: str) -> dict:
+        """Async version of `generate_question`."""
+        try:
+            messages = self._build_messages(age, gender, location, profession, severity, theme)
+            content = await agenerate_structured(messages, QUESTION_SET)
+            print(content)
+            return (content)
+        except Exception as e:
+            print("Error in _generatequestion:", e)
+            return None
+
+    def _build_messages(self, age, gender, location, profession, severity, theme):
         
         system_msg = f"""
         
@@ -100,12 +125,14 @@ Understand that severe patients can only understand very basic day to day things
 ### Keep in mind
 1.Object names are simple and in english
 2.There are 10 objects in the list 
+3.question_list[i] is a simple description-style naming question in Hindi for object_list[i], without saying the object name
 
 
 ### Output Format (JSON):
 
 {{
-  "object_list": ["object1", "object2", ...],}}
+  "object_list": ["object1", "object2", ...],
+  "question_list": ["question for object1", "question for object2", ...]}}
 
 ### Example:
 If theme = "Eating & Drinking" and persona = Severe, Rural:
@@ -114,32 +141,18 @@ If theme = "Eating & Drinking" and persona = Severe, Rural:
 """
 
  
-        try:
-            messages=[
-                {"role": "user", "content": system_msg},
-                {"role": "user", "content": f"""
-                Theme:{theme}
-                Severity: {severity}
-                Location: {location}
-                Profession: {profession}
-                Age:{age}
-                Gender:{gender}
-
-                """}
-                ]
-            response = httpx.post(
-                url,
-                json={"input_text": messages},
-                timeout=60
-            )
-            response.raise_for_status()
-            content = response.json()["response"]
-            content=clean_json(content)
-            print(content)
-            return (content)
-        except Exception as e:
-            print("Error in _generatequestion:", e)
-            return None
+        return [
+            {"role": "user", "content": system_msg},
+            {"role": "user", "content": f"""
+            Theme:{theme}
+            Severity: {severity}
+            Location: {location}
+            Profession: {profession}
+            Age:{age}
+            Gender:{gender}
+
+            """}
+            ]
         # response = openai.ChatCompletion.create(
         #     model="gpt-4o",
         #     messages=[{"role": "system", "content": system_msg},
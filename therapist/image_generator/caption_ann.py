@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+DEFAULT_ANN_DIR = Path(__file__).resolve().parent / "caption_ann"
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)
+
+
+def spherical_kmeans(x: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0,
+                     chunk: int = 65536) -> np.ndarray:
+    """Cosine k-means on unit vectors; returns unit-length centroids [nlist, dim]."""
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(x))
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.concatenate([np.argmax(x[i:i + chunk] @ centroids.T, axis=1)
+                                 for i in range(0, len(x), chunk)])
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty lists from random points so every list stays useful
+            sums[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class CaptionANNIndex:
+    """
+    IVF (inverted file) approximate nearest-neighbour index over caption
+    embeddings of the whole corpus, CPU/NumPy only.
+
+    index_dir/
+      manifest.json   model, dim, nlist
+      centroids.npy   float32 [nlist, dim] unit vectors
+      vectors.f16     append-only float16 [n, dim] unit vectors
+      lists.i32       append-only int32 [n] list assignment of every vector
+      row_ids.i64     append-only int64 [n] corpus row id of every vector
+
+    `add` appends (vectors, then lists, then row ids), so the committed size is
+    the shortest of the three files and an interrupted insert is simply ignored.
+    A search probes the `nprobe` lists closest to the query and ranks their
+    members exactly.
+    """
+
+    def __init__(self, index_dir=DEFAULT_ANN_DIR):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / "manifest.json", "r") as f:
+            self.manifest = json.load(f)
+        self.dim = int(self.manifest["dim"])
+        self.model = self.manifest.get("model")
+        self.centroids = np.load(self.index_dir / "centroids.npy")
+        self._lock = threading.Lock()
+        self._load_lists()
+
+    @classmethod
+    def create(cls, index_dir, train_vectors: np.ndarray, model: str, nlist: int = 1024) -> "CaptionANNIndex":
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        train = _normalize(train_vectors)
+        centroids = spherical_kmeans(train, nlist)
+        np.save(index_dir / "centroids.npy", centroids)
+        for name in ("vectors.f16", "lists.i32", "row_ids.i64"):
+            (index_dir / name).touch()
+        with open(index_dir / "manifest.json", "w") as f:
+            json.dump({"model": model, "dim": int(train.shape[1]), "nlist": int(len(centroids))}, f, indent=4)
+        return cls(index_dir)
+
+    @classmethod
+    def open(cls, index_dir=DEFAULT_ANN_DIR) -> Optional["CaptionANNIndex"]:
+        if not (Path(index_dir) / "manifest.json").exists():
+            return None
+        return cls(index_dir)
+
+    def __len__(self):
+        return self.size
+
+    def _load_lists(self):
+        d = self.index_dir
+        n = min(os.path.getsize(d / "vectors.f16") // (2 * self.dim),
+                os.path.getsize(d / "lists.i32") // 4,
+                os.path.getsize(d / "row_ids.i64") // 8)
+        self.size = n
+        self._map_vectors()
+        lists = np.fromfile(d / "lists.i32", dtype=np.int32, count=n)
+        self.row_ids = np.fromfile(d / "row_ids.i64", dtype=np.int64, count=n)
+        # members of list k are self._members[self._list_offsets[k]:self._list_offsets[k + 1]]
+        self._members = np.argsort(lists, kind="stable")
+        self._list_offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        self._list_offsets[1:] = np.cumsum(np.bincount(lists, minlength=len(self.centroids)))
+        self._row_order = np.argsort(self.row_ids, kind="stable")
+
+    def _map_vectors(self):
+        self.vectors = (np.memmap(self.index_dir / "vectors.f16", dtype=np.float16, mode="r",
+                                  shape=(self.size, self.dim))
+                        if self.size else np.zeros((0, self.dim), dtype=np.float16))
+
+    def _merge(self, row_ids: np.ndarray, lists: np.ndarray):
+        """Fold rows just appended to the files into the in-memory lists without re-sorting the index."""
+        new = np.arange(self.size, self.size + len(row_ids), dtype=np.int64)
+        # each new row goes to the end of its list, in insertion order
+        by_list = np.argsort(lists, kind="stable")
+        self._members = np.insert(self._members, self._list_offsets[lists[by_list] + 1], new[by_list])
+        self._list_offsets[1:] += np.cumsum(np.bincount(lists, minlength=len(self.centroids)))
+        by_row = np.argsort(row_ids, kind="stable")
+        pos = np.searchsorted(self.row_ids[self._row_order], row_ids[by_row], side="right")
+        self._row_order = np.insert(self._row_order, pos, new[by_row])
+        self.row_ids = np.concatenate([self.row_ids, row_ids])
+        self.size += len(row_ids)
+        self._map_vectors()
+
+    def contains(self, row_ids) -> np.ndarray:
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if self.size == 0:
+            return np.zeros(len(row_ids), dtype=bool)
+        sorted_rows = self.row_ids[self._row_order]
+        pos = np.clip(np.searchsorted(sorted_rows, row_ids), 0, self.size - 1)
+        return sorted_rows[pos] == row_ids
+
+    def add(self, row_ids, vectors: np.ndarray) -> int:
+        """Insert new (row_id, vector) pairs; rows already in the index are skipped."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        with self._lock:
+            keep = ~self.contains(row_ids)
+            row_ids, vectors = row_ids[keep], _normalize(np.asarray(vectors)[keep])
+            if len(row_ids) == 0:
+                return 0
+            lists = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+            for name, arr in (("vectors.f16", vectors.astype(np.float16)),
+                              ("lists.i32", lists), ("row_ids.i64", row_ids)):
+                with open(self.index_dir / name, "ab") as f:
+                    f.write(np.ascontiguousarray(arr).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._merge(row_ids, lists)
+        return len(row_ids)
+
+    def get_vectors(self, row_ids) -> np.ndarray:
+        """float32 vectors for row ids that are in the index (caller checks `contains`)."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        sorted_rows = self.row_ids[self._row_order]
+        pos = self._row_order[np.searchsorted(sorted_rows, row_ids)]
+        return np.asarray(self.vectors[pos], dtype=np.float32)
+
+    def search(self, queries: np.ndarray, k: int = 200, nprobe: int = 16,
+               chunk: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k neighbours (cosine) for each query.
+        Returns (row_ids [q, k], sims [q, k]); missing slots are -1 / -inf.
+        Probed members are scored `chunk` rows at a time against a running
+        top-k, so memory stays bounded however large the probed lists are.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        out_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        out_sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if self.size == 0:
+            return out_rows, out_sims
+
+        probe = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        for qi, q in enumerate(queries):
+            members = np.concatenate([self._members[self._list_offsets[c]:self._list_offsets[c + 1]]
+                                      for c in probe[qi]])
+            if len(members) == 0:
+                continue
+            members.sort()  # sequential reads from the memmap
+            best_idx = np.zeros(0, dtype=np.int64)
+            best_sims = np.zeros(0, dtype=np.float32)
+            for start in range(0, len(members), chunk):
+                idx = members[start:start + chunk]
+                sims = np.asarray(self.vectors[idx], dtype=np.float32) @ q
+                idx = np.concatenate([best_idx, idx])
+                sims = np.concatenate([best_sims, sims])
+                if len(sims) > k:
+                    keep = np.argpartition(-sims, k - 1)[:k]
+                    idx, sims = idx[keep], sims[keep]
+                best_idx, best_sims = idx, sims
+            order = np.argsort(-best_sims)
+            top = len(order)
+            out_rows[qi, :top] = self.row_ids[best_idx[order]]
+            out_sims[qi, :top] = best_sims[order]
+        return out_rows, out_sims
+
+def build_ann_index(corpus, index_dir=DEFAULT_ANN_DIR, model: str = "text-embedding-3-large",
+                    batch_size: int = 200, nlist: int = 1024, train_size: int = 50000,
+                    limit: Optional[int] = None, max_tokens: int = 20):
+    """
+    Embed corpus captions and insert them into the index, row group by row
+    group. Rows already in the index are skipped, so the job resumes where it
+    stopped. The first `train_size` embeddings train the IVF centroids.
+    """
+    from therapist.image_generator.create_embeddings import create_embeddings
+    import pyarrow.compute as pc
+
+    index = CaptionANNIndex.open(index_dir)
+    if index is not None and index.model != model:
+        raise ValueError(f"Index in {index_dir} was built with {index.model}, not {model}")
+    pending_ids, pending_vecs = [], []
+    done = 0
+
+    for g, table in corpus.iter_row_groups(["caption"]):
+        start = int(corpus._offsets[g])
+        captions = pc.utf8_trim_whitespace(pc.fill_null(table["caption"], ""))
+        n_tokens = np.asarray(pc.list_value_length(pc.utf8_split_whitespace(captions)))
+        row_ids = start + np.flatnonzero((n_tokens > 0) & (n_tokens < max_tokens))
+        if index is not None:
+            row_ids = row_ids[~index.contains(row_ids)]
+        if limit is not None:
+            row_ids = row_ids[:max(0, limit - done)]
+        if len(row_ids) == 0:
+            continue
+
+        texts = [" ".join(c.split()) for c in captions.take(row_ids - start).to_pylist()]
+        vecs = np.asarray(create_embeddings(texts, model=model, batch_size=batch_size), dtype=np.float32)
+        done += len(row_ids)
+
+        if index is None:
+            pending_ids.append(row_ids)
+            pending_vecs.append(vecs)
+            if sum(len(p) for p in pending_ids) < train_size:
+                continue
+            index = CaptionANNIndex.create(index_dir, np.concatenate(pending_vecs), model=model, nlist=nlist)
+            row_ids, vecs = np.concatenate(pending_ids), np.concatenate(pending_vecs)
+            pending_ids, pending_vecs = [], []
+        index.add(row_ids, vecs)
+        print(f"Row group {g + 1}/{corpus.num_row_groups}: index size {len(index)}")
+        if limit is not None and done >= limit:
+            break
+
+    if index is None and pending_ids:
+        # corpus smaller than train_size: train on what we have
+        index = CaptionANNIndex.create(index_dir, np.concatenate(pending_vecs), model=model,
+                                       nlist=min(nlist, max(1, int(np.sqrt(done)))))
+        index.add(np.concatenate(pending_ids), np.concatenate(pending_vecs))
+    return index
+
+
+def main(argv=None) -> int:
+    from therapist.image_generator.corpus import CaptionCorpus
+
+    parser = argparse.ArgumentParser(description="Build / extend the caption embedding ANN index")
+    parser.add_argument("--index-dir", default=str(DEFAULT_ANN_DIR))
+    parser.add_argument("--model", default="text-embedding-3-large")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=1024, help="Number of IVF lists")
+    parser.add_argument("--train-size", type=int, default=50000)
+    parser.add_argument("--limit", type=int, default=None, help="Embed at most this many new rows")
+    args = parser.parse_args(argv)
+
+    index = build_ann_index(CaptionCorpus(), args.index_dir, args.model, args.batch_size,
+                            args.nlist, args.train_size, args.limit)
+    print(f"Index size: {len(index) if index is not None else 0}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
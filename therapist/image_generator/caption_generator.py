@@ -1,12 +1,10 @@
 
-import httpx
-from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
+from therapist.structured_output import generate_structured, agenerate_structured, CAPTIONS
 import json
 class CaptionGenerator:
     def __init__(self):
         pass
-    def generate_positive_and_negative_captions(self, object_name):
+    def _build_messages(self, object_name):
         system_prompt = """
         You are a caption generator that generates suitable captions for flashcard style images 
         used in naming from description exercise for speech therapy.
@@ -137,24 +135,10 @@ class CaptionGenerator:
         #     model="gpt-4o",
         #     messages=messages
         # )
-        response = httpx.post(
-                url,
-                json={"input_text": messages},
-                timeout=60
-            )
-        response.raise_for_status()
-        data=response.json()["response"]
-        content=clean_json(data)
-        print(content)
-        content=json.loads(content)
-
-        # response = httpx.post(
-        #     url,
-        #     json={"input_text": messages},
-        #     timeout=60
-        # )
-        # response.raise_for_status()
-        # content = response.json()["response"]
-        # print(content, ' inside framer')
-        return content
-    
+        return messages
+
+    def generate_positive_and_negative_captions(self, object_name):
+        return generate_structured(self._build_messages(object_name), CAPTIONS, cache_route="captions")
+
+    async def agenerate_positive_and_negative_captions(self, object_name):
+        return await agenerate_structured(self._build_messages(object_name), CAPTIONS, cache_route="captions")
@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Tokens are runs of letters/digits/combining marks (so Devanagari matras stay
+# attached). Anything longer than MAX_TOKEN_BYTES is a URL/hash and is dropped.
+TOKEN_SPLIT_PATTERN = r"[^\p{L}\p{N}\p{M}]+"
+MAX_TOKEN_BYTES = 32
+# Tokens at least this long are matched as prefixes ("tomato" -> "tomatoes"),
+# shorter ones ("of", "tv") only exactly.
+MIN_PREFIX_LEN = 3
+INDEX_VERSION = 1
+
+
+def tokenize(strings: pa.Array) -> pa.ListArray:
+    """Lower-case and split captions (or a query) into index tokens."""
+    lower = pc.utf8_lower(pc.fill_null(strings, ""))
+    return pc.split_pattern_regex(lower, TOKEN_SPLIT_PATTERN)
+
+
+def _query_tokens(text: str) -> List[bytes]:
+    tokens = tokenize(pa.array([text]))[0].as_py() or []
+    return [t.encode("utf-8") for t in tokens if t and len(t.encode("utf-8")) <= MAX_TOKEN_BYTES]
+
+
+def _row_group_fingerprint(metadata, i: int, start: int) -> str:
+    rg = metadata.row_group(i)
+    col = rg.column(0)
+    return f"{start}:{rg.num_rows}:{rg.total_byte_size}:{col.data_page_offset}:{col.total_compressed_size}"
+
+
+def _build_shard(table: pa.Table) -> Dict[str, np.ndarray]:
+    """Inverted index for one row group, with row ids local to the group."""
+    captions = table["caption"].combine_chunks()
+    words = tokenize(captions)
+    flat = pc.list_flatten(words)
+    rows = np.asarray(pc.list_parent_indices(words), dtype=np.uint32)
+
+    nbytes = np.asarray(pc.fill_null(pc.binary_length(flat), 0))
+    keep = (nbytes > 0) & (nbytes <= MAX_TOKEN_BYTES)
+    flat = flat.filter(pa.array(keep))
+    rows = rows[keep]
+
+    # same whitespace split as str.split(), used for the "< 20 tokens" filter
+    token_len = np.asarray(
+        pc.list_value_length(pc.utf8_split_whitespace(pc.fill_null(captions, ""))), dtype=np.int64
+    )
+    token_len = np.minimum(token_len, 255).astype(np.uint8)
+
+    if len(flat) == 0:
+        return {
+            "vocab": np.array([], dtype=f"S{MAX_TOKEN_BYTES}"),
+            "offsets": np.zeros(1, dtype=np.int64),
+            "postings": np.array([], dtype=np.uint32),
+            "token_len": token_len,
+        }
+
+    encoded = flat.dictionary_encode()
+    vocab = np.array(encoded.dictionary.cast(pa.binary()).to_pylist(), dtype=f"S{MAX_TOKEN_BYTES}")
+    codes = np.asarray(encoded.indices, dtype=np.int64)
+
+    order = np.argsort(vocab, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    vocab, codes = vocab[order], rank[codes]
+
+    o = np.lexsort((rows, codes))
+    codes, rows = codes[o], rows[o]
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = (codes[1:] != codes[:-1]) | (rows[1:] != rows[:-1])
+    codes, rows = codes[first], rows[first]
+
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(vocab)))
+    return {"vocab": vocab, "offsets": offsets, "postings": rows, "token_len": token_len}
+
+
+def _merge_shards(shards: List[Dict[str, np.ndarray]], starts: List[int]):
+    vocab = np.unique(np.concatenate([s["vocab"] for s in shards]))
+    all_codes, all_rows = [], []
+    for shard, start in zip(shards, starts):
+        mapping = np.searchsorted(vocab, shard["vocab"])
+        all_codes.append(np.repeat(mapping, np.diff(shard["offsets"])))
+        all_rows.append(shard["postings"].astype(np.uint32) + np.uint32(start))
+    codes = np.concatenate(all_codes) if all_codes else np.array([], dtype=np.int64)
+    rows = np.concatenate(all_rows) if all_rows else np.array([], dtype=np.uint32)
+
+    # shards are in row order, so a stable sort by token keeps postings sorted by row
+    o = np.argsort(codes, kind="stable")
+    postings = rows[o]
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(vocab)))
+    token_len = np.concatenate([s["token_len"] for s in shards])
+    return vocab, offsets, postings, token_len
+
+
+def build_index(corpus, index_dir, force: bool = False) -> dict:
+    """
+    Build (or incrementally refresh) the inverted index for `corpus` in `index_dir`.
+    Row groups whose fingerprint is unchanged since the last build are reused
+    from their on-disk shard; only new/changed row groups are re-read.
+    """
+    index_dir = Path(index_dir)
+    shard_dir = index_dir / "shards"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    previous = {}
+    manifest_path = index_dir / "manifest.json"
+    if manifest_path.exists() and not force:
+        with open(manifest_path, "r") as f:
+            old = json.load(f)
+        if old.get("version") == INDEX_VERSION:
+            previous = {rg["fingerprint"]: rg["shard"] for rg in old["row_groups"]}
+
+    metadata = corpus._metadata
+    shards, starts, row_groups = [], [], []
+    rebuilt = 0
+    for i in range(corpus.num_row_groups):
+        start = int(corpus._offsets[i])
+        fingerprint = _row_group_fingerprint(metadata, i, start)
+        shard_name = previous.get(fingerprint)
+        if shard_name and (shard_dir / shard_name).exists():
+            with np.load(shard_dir / shard_name) as z:
+                shard = {k: z[k] for k in z.files}
+        else:
+            shard = _build_shard(corpus.read_row_group(i, ["caption"]))
+            shard_name = f"rg_{i:05d}_{hashlib.sha1(fingerprint.encode()).hexdigest()[:10]}.npz"
+            np.savez(shard_dir / shard_name, **shard)
+            rebuilt += 1
+            print(f"Indexed row group {i + 1}/{corpus.num_row_groups}")
+        shards.append(shard)
+        starts.append(start)
+        row_groups.append({"fingerprint": fingerprint, "shard": shard_name})
+
+    # drop shards that no longer belong to any row group
+    live = {rg["shard"] for rg in row_groups}
+    for p in shard_dir.glob("*.npz"):
+        if p.name not in live:
+            p.unlink()
+
+    vocab, offsets, postings, token_len = _merge_shards(shards, starts)
+    for name, arr in (("vocab", vocab), ("offsets", offsets), ("postings", postings), ("token_len", token_len)):
+        tmp = index_dir / f"{name}.tmp.npy"
+        np.save(tmp, arr)
+        os.replace(tmp, index_dir / f"{name}.npy")
+
+    stat = Path(corpus.parquet_path).stat()
+    manifest = {
+        "version": INDEX_VERSION,
+        "parquet_path": corpus.parquet_path,
+        "parquet_size": stat.st_size,
+        "parquet_mtime": stat.st_mtime,
+        "num_rows": corpus.num_rows,
+        "num_tokens": int(len(vocab)),
+        "row_groups": row_groups,
+    }
+    tmp = index_dir / "manifest.tmp.json"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, manifest_path)
+    print(f"Caption index: {len(vocab)} tokens, {len(postings)} postings, "
+          f"{rebuilt}/{corpus.num_row_groups} row groups rebuilt")
+    return manifest
+
+
+class CaptionIndex:
+    """
+    Persisted token -> row id index over corpus captions. Arrays are opened
+    with mmap, so loading is O(1) and pages are shared between workers.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / "manifest.json", "r") as f:
+            self.manifest = json.load(f)
+        self.vocab = np.load(self.index_dir / "vocab.npy", mmap_mode="r")
+        self.offsets = np.load(self.index_dir / "offsets.npy", mmap_mode="r")
+        self.postings = np.load(self.index_dir / "postings.npy", mmap_mode="r")
+        self.token_len = np.load(self.index_dir / "token_len.npy", mmap_mode="r")
+
+    @classmethod
+    def load(cls, index_dir) -> Optional["CaptionIndex"]:
+        if not (Path(index_dir) / "manifest.json").exists():
+            return None
+        return cls(index_dir)
+
+    def is_stale(self, parquet_path) -> bool:
+        stat = Path(parquet_path).stat()
+        return (
+            self.manifest.get("version") != INDEX_VERSION
+            or self.manifest.get("parquet_size") != stat.st_size
+            or self.manifest.get("parquet_mtime") != stat.st_mtime
+        )
+
+    def _token_rows(self, token: bytes) -> np.ndarray:
+        if len(token) >= MIN_PREFIX_LEN:
+            lo = np.searchsorted(self.vocab, token, side="left")
+            hi = np.searchsorted(self.vocab, token + b"\xff", side="left")
+        else:
+            lo = np.searchsorted(self.vocab, token, side="left")
+            hi = lo + 1 if lo < len(self.vocab) and self.vocab[lo] == token else lo
+        if hi <= lo:
+            return np.array([], dtype=np.uint32)
+        if hi - lo == 1:
+            return np.asarray(self.postings[self.offsets[lo]:self.offsets[lo + 1]])
+        return np.unique(np.concatenate(
+            [self.postings[self.offsets[k]:self.offsets[k + 1]] for k in range(lo, hi)]
+        ))
+
+    def lookup(self, object_name: str, max_tokens: Optional[int] = None) -> np.ndarray:
+        """
+        Candidate row ids for `object_name`: rows containing every query token
+        (as a word or word prefix). Multi-word objects still need a phrase check
+        on the decoded captions. Optionally keeps only captions shorter than
+        `max_tokens` whitespace tokens.
+        """
+        tokens = _query_tokens(object_name)
+        if not tokens:
+            return np.array([], dtype=np.int64)
+
+        posting_lists = sorted((self._token_rows(t) for t in tokens), key=len)
+        rows = posting_lists[0]
+        for other in posting_lists[1:]:
+            if len(rows) == 0:
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+
+        rows = rows.astype(np.int64)
+        if max_tokens is not None and len(rows):
+            rows = rows[self.token_len[rows] < max_tokens]
+        return rows
+
+
+def main(argv=None) -> int:
+    from therapist.image_generator.corpus import CaptionCorpus, DEFAULT_INDEX_DIR, DEFAULT_PARQUET_PATH
+
+    parser = argparse.ArgumentParser(description="Build the inverted token index over corpus captions")
+    parser.add_argument("--parquet", default=str(DEFAULT_PARQUET_PATH), help="Caption corpus parquet")
+    parser.add_argument("--index-dir", default=str(DEFAULT_INDEX_DIR), help="Output directory")
+    parser.add_argument("--force", action="store_true", help="Rebuild every row group from scratch")
+    args = parser.parse_args(argv)
+
+    corpus = CaptionCorpus(args.parquet, index_dir=None)
+    build_index(corpus, args.index_dir, force=args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,6 +5,7 @@ import re
 import json
 from typing import List, Dict, Any, Optional
 import math
+import numpy as np
     
 
 class caption_scorer:
@@ -30,43 +31,75 @@ class caption_scorer:
             return 0.0
         return dot / (na * nb)          
 
+    @staticmethod
+    def _normalized_matrix(vectors) -> np.ndarray:
+        """Stack embeddings into a contiguous float32 matrix with unit-length rows (zero rows stay zero)."""
+        vecs = [json.loads(v) if isinstance(v, str) else v for v in vectors]
+        if not vecs:
+            return np.zeros((0, 0), dtype=np.float32)
+        mat = np.ascontiguousarray(np.asarray(vecs, dtype=np.float32))
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)
+
+    @staticmethod
+    def _max_sims(emb_mat: np.ndarray, cap_mat: np.ndarray) -> np.ndarray:
+        """Per-row max cosine similarity of emb_mat against cap_mat (one matmul)."""
+        if cap_mat.size == 0 or emb_mat.size == 0:
+            return np.zeros(len(emb_mat), dtype=np.float32)
+        return (emb_mat @ cap_mat.T).max(axis=1)
+
+    def embed_pos_neg(self, captions: dict, model: str = "text-embedding-3-large"):
+        """Embed the de-duplicated positive and negative captions; returns (pos_embs, neg_embs)."""
+        pos_caps: List[str] = list(dict.fromkeys([c.strip() for c in captions.get("positive_captions", []) if c and c.strip()]))
+        neg_caps: List[str] = list(dict.fromkeys([c.strip() for c in captions.get("negative_captions", []) if c and c.strip()]))
+        return self.embed_texts(pos_caps, model=model), self.embed_texts(neg_caps, model=model)
+
     def score_embeddings_df_with_pos_neg(self,
                                          emb_df: pd.DataFrame,
                                          captions: str,
-                                         model: str = "text-embedding-3-large") -> pd.DataFrame:
+                                         model: str = "text-embedding-3-large",
+                                         pos_embs=None,
+                                         neg_embs=None) -> pd.DataFrame:
         """
         Take a DataFrame with columns ['caption','embedding', optional 'url'] and compute
         per-row MAX similarities against generated positive and negative captions for the object.
+        Precomputed caption embeddings can be passed as pos_embs/neg_embs.
         Returns a new DataFrame with columns: caption, pos_sims, neg_sims, (url if present).
         """
 
         if "embedding" not in emb_df.columns or "caption" not in emb_df.columns:
             raise KeyError("Expected columns 'caption' and 'embedding' in emb_df")
 
-        # caps = self.generate_pos_neg_captions(object_name)
-        pos_caps: List[str] = list(dict.fromkeys([c.strip() for c in captions.get("positive_captions", []) if c and c.strip()]))
-        neg_caps: List[str] = list(dict.fromkeys([c.strip() for c in captions.get("negative_captions", []) if c and c.strip()]))
-
-        pos_embs = self.embed_texts(pos_caps, model=model)
-        neg_embs = self.embed_texts(neg_caps, model=model)
+        # pos_embs/neg_embs can be passed in when the caller already embedded the captions
+        if pos_embs is None or neg_embs is None:
+            pos_embs, neg_embs = self.embed_pos_neg(captions, model=model)
 
-        out_rows: List[Dict[str, Any]] = []
-        for _, row in emb_df.iterrows():
-            vec = row["embedding"]
-            if isinstance(vec, str):
-                vec = json.loads(vec)
-            pos_sims_list = [self._cosine_sim(vec, pe) for pe in pos_embs] if pos_embs else [0.0]
-            neg_sims_list = [self._cosine_sim(vec, ne) for ne in neg_embs] if neg_embs else [0.0]
-            pos_max = max(pos_sims_list) if pos_sims_list else 0.0
-            neg_max = max(neg_sims_list) if neg_sims_list else 0.0
-            row_out = {
-                "caption": row["caption"],
-                "pos_sims": float(pos_max),
-                "neg_sims": float(neg_max),
-            }
-            if "url" in emb_df.columns:
-                row_out["url"] = row["url"]
-            out_rows.append(row_out)
+        emb_mat = self._normalized_matrix(emb_df["embedding"].tolist())
+        pos_max = self._max_sims(emb_mat, self._normalized_matrix(pos_embs))
+        neg_max = self._max_sims(emb_mat, self._normalized_matrix(neg_embs))
 
-        return pd.DataFrame(out_rows)
+        out = pd.DataFrame({
+            "caption": emb_df["caption"].to_numpy(),
+            "pos_sims": pos_max.astype(np.float64),
+            "neg_sims": neg_max.astype(np.float64),
+        })
+        if "url" in emb_df.columns:
+            out["url"] = emb_df["url"].to_numpy()
+        if "row_id" in emb_df.columns:
+            # corpus row id, used to look up precomputed CLIP image embeddings
+            out["row_id"] = emb_df["row_id"].to_numpy()
+        return out
 
+    @staticmethod
+    def top_k(scored_df: pd.DataFrame, column: str, k: int) -> pd.DataFrame:
+        """
+        Rows with the k largest values of `column`, in descending order.
+        Uses argpartition so only the k winners get sorted.
+        """
+        if len(scored_df) <= k:
+            return scored_df.sort_values(column, ascending=False)
+        values = scored_df[column].to_numpy(dtype=np.float64)
+        values = np.where(np.isnan(values), -np.inf, values)
+        idx = np.argpartition(-values, k - 1)[:k]
+        idx = idx[np.argsort(-values[idx], kind="stable")]
+        return scored_df.iloc[idx]
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CLIP_STORE_DIR = Path(__file__).resolve().parent / "clip_store"
+
+# values in slots.npy besides a real slot number
+MISSING = -1
+FAILED = -2
+
+
+class ClipImageStore:
+    """
+    Precomputed CLIP image embeddings for corpus rows.
+
+    store_dir/
+      manifest.json   model, pretrained, dim, num_rows
+      slots.npy       int32[num_rows]: row id -> row in vectors.f16, or MISSING / FAILED
+      vectors.f16     append-only float16 matrix [n, dim] of L2-normalized embeddings
+
+    Vectors are appended and flushed before their slot is published, so a
+    crash mid-batch never leaves a slot pointing at an unwritten vector and
+    the build job can resume from whatever slots are set.
+    """
+
+    def __init__(self, store_dir, writable: bool = False):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / "manifest.json", "r") as f:
+            self.manifest = json.load(f)
+        self.dim = int(self.manifest["dim"])
+        self.num_rows = int(self.manifest["num_rows"])
+        self.writable = writable
+        self.slots = np.load(self.store_dir / "slots.npy", mmap_mode="r+" if writable else "r")
+        self._vectors = None
+        self._vectors_len = 0
+
+    @classmethod
+    def create(cls, store_dir, num_rows: int, dim: int, model_name: str, pretrained: str) -> "ClipImageStore":
+        store_dir = Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        slots = np.lib.format.open_memmap(store_dir / "slots.npy", mode="w+", dtype=np.int32, shape=(num_rows,))
+        slots[:] = MISSING
+        slots.flush()
+        del slots
+        (store_dir / "vectors.f16").touch()
+        with open(store_dir / "manifest.json", "w") as f:
+            json.dump({"model_name": model_name, "pretrained": pretrained,
+                       "dim": dim, "num_rows": num_rows}, f, indent=4)
+        return cls(store_dir, writable=True)
+
+    @classmethod
+    def open(cls, store_dir=DEFAULT_CLIP_STORE_DIR, writable: bool = False) -> Optional["ClipImageStore"]:
+        if not (Path(store_dir) / "manifest.json").exists():
+            return None
+        return cls(store_dir, writable=writable)
+
+    def matches(self, model_name: str, pretrained: str) -> bool:
+        return self.manifest.get("model_name") == model_name and self.manifest.get("pretrained") == pretrained
+
+    # ---- reading ----
+    def _vectors_view(self, needed: int) -> np.ndarray:
+        """mmap of vectors.f16, re-mapped when a concurrent build job has appended past it."""
+        if self._vectors is None or needed > self._vectors_len:
+            path = self.store_dir / "vectors.f16"
+            n = os.path.getsize(path) // (2 * self.dim)
+            self._vectors = (np.memmap(path, dtype=np.float16, mode="r", shape=(n, self.dim))
+                             if n else np.zeros((0, self.dim), dtype=np.float16))
+            self._vectors_len = n
+        return self._vectors
+
+    def lookup(self, row_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (found_mask, vectors) where vectors is float32 [found_mask.sum(), dim]
+        in the order of the found row ids.
+        """
+        row_ids = np.asarray(list(row_ids), dtype=np.int64)
+        in_range = (row_ids >= 0) & (row_ids < self.num_rows)
+        slots = np.full(len(row_ids), MISSING, dtype=np.int64)
+        slots[in_range] = self.slots[row_ids[in_range]]
+        found = slots >= 0
+        if not found.any():
+            return found, np.zeros((0, self.dim), dtype=np.float32)
+        vectors = self._vectors_view(int(slots[found].max()) + 1)
+        return found, np.asarray(vectors[slots[found]], dtype=np.float32)
+
+    def pending(self, row_ids: Iterable[int], retry_failed: bool = False) -> np.ndarray:
+        row_ids = np.unique(np.asarray(list(row_ids), dtype=np.int64))
+        state = self.slots[row_ids]
+        todo = (state == MISSING) | ((state == FAILED) if retry_failed else False)
+        return row_ids[todo]
+
+    # ---- writing (build job only) ----
+    def append(self, row_ids: np.ndarray, vectors: np.ndarray, failed_ids: Optional[np.ndarray] = None):
+        if not self.writable:
+            raise RuntimeError("ClipImageStore opened read-only")
+        path = self.store_dir / "vectors.f16"
+        start = os.path.getsize(path) // (2 * self.dim)
+        if len(row_ids):
+            with open(path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.slots[np.asarray(row_ids, dtype=np.int64)] = np.arange(start, start + len(row_ids), dtype=np.int32)
+        if failed_ids is not None and len(failed_ids):
+            self.slots[np.asarray(failed_ids, dtype=np.int64)] = FAILED
+        self.slots.flush()
+
+    def stats(self) -> dict:
+        slots = np.asarray(self.slots)
+        return {"embedded": int((slots >= 0).sum()), "failed": int((slots == FAILED).sum()),
+                "missing": int((slots == MISSING).sum())}
+
+
+def build_store(corpus, scorer, row_ids, store_dir=DEFAULT_CLIP_STORE_DIR,
+                batch_size: int = 256, retry_failed: bool = False) -> ClipImageStore:
+    """
+    Embed the images of `row_ids` into the store, skipping rows that are already
+    done. Every batch is a checkpoint, so the job can be stopped and rerun.
+    """
+    store = ClipImageStore.open(store_dir, writable=True)
+    if store is None:
+        store = ClipImageStore.create(store_dir, num_rows=corpus.num_rows,
+                                      dim=int(scorer.model.visual.output_dim),
+                                      model_name=scorer.model_name, pretrained=scorer.pretrained)
+    elif not store.matches(scorer.model_name, scorer.pretrained):
+        raise ValueError(f"Store in {store_dir} was built with {store.manifest['model_name']}/"
+                         f"{store.manifest['pretrained']}, not {scorer.model_name}/{scorer.pretrained}")
+
+    todo = store.pending(row_ids, retry_failed=retry_failed)
+    print(f"{len(todo)} rows to embed ({store.stats()})")
+    for start in range(0, len(todo), batch_size):
+        batch = corpus.take(todo[start:start + batch_size])
+        ok, features, _ = scorer.encode_images(batch["url"].tolist())
+        ids = batch["row_id"].to_numpy()
+        store.append(ids[ok], features, failed_ids=ids[~ok])
+        print(f"Embedded {min(start + batch_size, len(todo))}/{len(todo)} "
+              f"({int(ok.sum())}/{len(ids)} images ok in this batch)")
+    return store
+
+
+def main(argv=None) -> int:
+    from therapist.image_generator.corpus import CaptionCorpus
+    from therapist.image_generator.create_sim_score import SimilarityScorer
+    from therapist.image_generator.helper_functions import filter_df_with_object
+
+    parser = argparse.ArgumentParser(description="Precompute CLIP image embeddings for corpus rows")
+    parser.add_argument("objects", nargs="*", help="Embed candidate rows for these objects")
+    parser.add_argument("--metadata", default=None,
+                        help="Also embed candidates for every object in this metadata json")
+    parser.add_argument("--all", action="store_true", help="Embed every row of the corpus")
+    parser.add_argument("--store-dir", default=str(DEFAULT_CLIP_STORE_DIR))
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--retry-failed", action="store_true")
+    args = parser.parse_args(argv)
+
+    corpus = CaptionCorpus()
+    scorer = SimilarityScorer(image_store=False)
+
+    objects = list(args.objects)
+    if args.metadata:
+        with open(args.metadata, "r") as f:
+            objects.extend(json.load(f).keys())
+    if args.all:
+        row_ids = np.arange(corpus.num_rows)
+    else:
+        if not objects:
+            parser.error("give objects, --metadata or --all")
+        row_ids = np.unique(np.concatenate(
+            [filter_df_with_object(corpus, o)["row_id"].to_numpy(dtype=np.int64) for o in objects]
+        ))
+
+    store = build_store(corpus, scorer, row_ids, args.store_dir, args.batch_size, args.retry_failed)
+    print(store.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,134 @@
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from therapist.image_generator.caption_index import CaptionIndex
+
+DEFAULT_PARQUET_PATH = Path(__file__).resolve().parent / "cc12m_7m_subset_translated.parquet"
+DEFAULT_INDEX_DIR = Path(__file__).resolve().parent / "caption_index"
+
+
+class CaptionCorpus:
+    """
+    Read-only, memory-mapped view over the cc12m caption parquet.
+
+    Nothing is loaded at construction time except the parquet footer. Reads go
+    through `pa.memory_map`, so the OS page cache is shared between uvicorn
+    workers, and only the `caption`/`url` columns of the row groups that are
+    actually needed get decoded.
+
+    If an up-to-date CaptionIndex exists in `index_dir`, `search` answers from
+    it instead of scanning every caption.
+    """
+
+    def __init__(self, parquet_path=DEFAULT_PARQUET_PATH, columns=("caption", "url"),
+                 index_dir=DEFAULT_INDEX_DIR):
+        self.parquet_path = str(parquet_path)
+        self.columns = list(columns)
+        self._local = threading.local()
+
+        metadata = pq.read_metadata(pa.memory_map(self.parquet_path, "r"))
+        self._metadata = metadata
+        self.num_rows = metadata.num_rows
+        self.num_row_groups = metadata.num_row_groups
+        # global row id of the first row in every row group (+ total at the end)
+        self._offsets = np.cumsum(
+            [0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+        )
+
+        self.index = CaptionIndex.load(index_dir) if index_dir else None
+        if self.index is not None and self.index.is_stale(self.parquet_path):
+            print(f"Caption index in {index_dir} is stale, falling back to full scans. "
+                  "Rebuild with: python -m therapist.image_generator.caption_index")
+            self.index = None
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def mtime(self) -> float:
+        return Path(self.parquet_path).stat().st_mtime
+
+    def _reader(self) -> pq.ParquetFile:
+        # ParquetFile is not safe to share between threads; the memory map is,
+        # so every thread gets its own reader over the same mapped pages.
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = pq.ParquetFile(pa.memory_map(self.parquet_path, "r"), metadata=self._metadata)
+            self._local.reader = reader
+        return reader
+
+    def read_row_group(self, i: int, columns: Optional[List[str]] = None) -> pa.Table:
+        return self._reader().read_row_group(i, columns=columns or self.columns)
+
+    def iter_row_groups(self, columns: Optional[List[str]] = None) -> Iterator[Tuple[int, pa.Table]]:
+        """Yield (row_group_index, table) one row group at a time."""
+        for i in range(self.num_row_groups):
+            yield i, self.read_row_group(i, columns)
+
+    def row_group_of(self, row_ids: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self._offsets, row_ids, side="right") - 1
+
+    def take(self, row_ids: Iterable[int]) -> pd.DataFrame:
+        """
+        Fetch specific rows by global row id, decoding only the row groups
+        that contain them. Returns columns ['row_id', 'caption', 'url'] in row id order.
+        """
+        row_ids = np.unique(np.asarray(list(row_ids), dtype=np.int64))
+        row_ids = row_ids[(row_ids >= 0) & (row_ids < self.num_rows)]
+        if len(row_ids) == 0:
+            return pd.DataFrame(columns=["row_id"] + self.columns)
+
+        groups = self.row_group_of(row_ids)
+        pieces = []
+        for g in np.unique(groups):
+            ids = row_ids[groups == g]
+            table = self.read_row_group(int(g))
+            part = table.take(pa.array(ids - self._offsets[g])).to_pandas()
+            part.insert(0, "row_id", ids)
+            pieces.append(part)
+        return pd.concat(pieces, ignore_index=True)
+
+    def search(self, object_name: str, max_tokens: Optional[int] = None) -> pd.DataFrame:
+        """
+        Case-insensitive match of `object_name` against every caption.
+        Returns columns ['row_id', 'caption', 'url', 'token_len'], optionally
+        restricted to captions with fewer than `max_tokens` whitespace tokens.
+
+        Uses the inverted index when available; otherwise scans row group by
+        row group so peak memory is one row group.
+        """
+        if self.index is not None:
+            df = self.take(self.index.lookup(object_name, max_tokens=max_tokens))
+            # the index matches tokens; confirm the full (possibly multi-word) phrase
+            df = df[df["caption"].astype(str).str.contains(object_name, case=False, regex=False, na=False)]
+            df = df.reset_index(drop=True)
+            df["token_len"] = np.asarray(self.index.token_len[df["row_id"].to_numpy()], dtype=np.int64)
+            return df
+
+        pieces = []
+        for g, table in self.iter_row_groups():
+            mask = pc.fill_null(
+                pc.match_substring(table["caption"], object_name, ignore_case=True), False
+            )
+            local = np.flatnonzero(mask.to_numpy())
+            if len(local) == 0:
+                continue
+            part = table.take(pa.array(local))
+            token_len = pc.list_value_length(pc.utf8_split_whitespace(pc.fill_null(part["caption"], "")))
+            part = part.to_pandas()
+            part.insert(0, "row_id", local + self._offsets[g])
+            part["token_len"] = np.asarray(token_len, dtype=np.int64)
+            if max_tokens is not None:
+                part = part[part["token_len"] < max_tokens]
+            pieces.append(part)
+
+        if not pieces:
+            return pd.DataFrame(columns=["row_id"] + self.columns + ["token_len"])
+        return pd.concat(pieces, ignore_index=True)
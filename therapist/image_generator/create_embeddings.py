@@ -59,6 +59,8 @@ def embed_captions_df(df: pd.DataFrame, model: str = "text-embedding-3-large", b
     })
     if "url" in df.columns:
         out["url"] = df["url"].tolist()
+    if "row_id" in df.columns:
+        out["row_id"] = df["row_id"].tolist()
     return out
 
 
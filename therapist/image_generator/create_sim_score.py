@@ -1,8 +1,9 @@
-from io import BytesIO
 from urllib.parse import urlparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Dict, List, Optional
 
-import requests
 from PIL import Image
 
 import pandas as pd
@@ -10,11 +11,29 @@ import torch
 import open_clip
 import numpy as np
 
+from therapist.image_generator.image_fetcher import ImageFetcher
+from therapist.image_generator.clip_image_store import ClipImageStore
+
 class SimilarityScorer:
-    def __init__(self, model_name: str = "ViT-B-32", pretrained: str = "openai"):
+    def __init__(self, model_name: str = "ViT-B-32", pretrained: str = "openai",
+                 batch_size: Optional[int] = None, load_workers: int = 16,
+                 fetcher: Optional[ImageFetcher] = None, image_store=None):
         self.model_name = model_name
         self.pretrained = pretrained
         self.model, self.preprocess, self.tokenizer, self.device = self._load_model()
+        # CPU forward passes get slower per image past ~16, GPU is happy with more
+        self.batch_size = batch_size or (16 if self.device == "cpu" else 64)
+        self.load_workers = load_workers
+        self.fetcher = fetcher or ImageFetcher(max_workers=load_workers)
+        self._text_cache: Dict[str, torch.Tensor] = {}
+        self._text_lock = threading.Lock()
+        # precomputed image embeddings by corpus row id; None = open the default store, False = disabled
+        if image_store is None:
+            image_store = ClipImageStore.open()
+        if image_store and not image_store.matches(self.model_name, self.pretrained):
+            print(f"Ignoring CLIP image store built for {image_store.manifest.get('model_name')}")
+            image_store = None
+        self.image_store = image_store or None
     
     def _load_model(self):
         device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -26,23 +45,124 @@ class SimilarityScorer:
     def _load_pil_image(self, src: str) -> Image.Image:
         parsed = urlparse(src)
         if parsed.scheme in ("http", "https"):
-            r = requests.get(src, timeout=20)
-            r.raise_for_status()
-            return Image.open(BytesIO(r.content)).convert("RGB")
+            return self.fetcher.load_image(src)
         return Image.open(Path(src)).convert("RGB")
 
+    @torch.no_grad()
+    def encode_text(self, caption: str) -> torch.Tensor:
+        """Normalized CLIP text features for `caption`, cached per caption."""
+        with self._text_lock:
+            cached = self._text_cache.get(caption)
+        if cached is not None:
+            return cached
+        text = self.tokenizer([caption]).to(self.device)
+        use_amp = (self.device == "cuda")
+        with torch.cuda.amp.autocast(enabled=use_amp):
+            text_features = self.model.encode_text(text)
+            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        with self._text_lock:
+            self._text_cache[caption] = text_features
+        return text_features
+
+    def _load_preprocessed(self, src: str) -> torch.Tensor:
+        return self.preprocess(self._load_pil_image(src))
+
+    @torch.no_grad()
+    def encode_images(self, image_srcs: List[str]):
+        """
+        Fetch and preprocess images in parallel, then encode them `batch_size` at a time.
+        Returns (ok_mask, features, errors): features is a float32 array of normalized
+        embeddings for the sources where ok_mask is True, in order; errors maps
+        the index of each failed source to its error message.
+        """
+        ok_mask = np.zeros(len(image_srcs), dtype=bool)
+        errors = {}
+        valid = [(i, str(src)) for i, src in enumerate(image_srcs)
+                 if isinstance(src, str) and src.strip() != ""]
+
+        def load(item):
+            i, src = item
+            try:
+                return i, self._load_preprocessed(src), None
+            except Exception as e:
+                return i, None, e
+
+        loaded = []
+        if valid:
+            with ThreadPoolExecutor(max_workers=min(self.load_workers, len(valid))) as pool:
+                loaded = list(pool.map(load, valid))
+
+        ok = []
+        for i, tensor, err in loaded:
+            if tensor is None:
+                errors[i] = f"{type(err).__name__}: {err}"
+            else:
+                ok.append((i, tensor))
+        if not ok:
+            return ok_mask, np.zeros((0, 0), dtype=np.float32), errors
+
+        features = []
+        use_amp = (self.device == "cuda")
+        for start in range(0, len(ok), self.batch_size):
+            chunk = ok[start:start + self.batch_size]
+            images = torch.stack([t for _, t in chunk]).to(self.device)
+            with torch.cuda.amp.autocast(enabled=use_amp):
+                image_features = self.model.encode_image(images)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+            features.append(image_features.float().cpu().numpy())
+        ok_mask[[i for i, _ in ok]] = True
+        return ok_mask, np.concatenate(features), errors
+
+    def _scores_from_features(self, caption: str, features: np.ndarray) -> List[dict]:
+        text = self.encode_text(caption).float().cpu().numpy().reshape(-1)
+        logit_scale = float(self.model.logit_scale.exp())
+        cos = features @ text
+        return [{"cosine_similarity": float(c), "clip_logit": float(logit_scale * c)} for c in cos]
+
+    def score_images(self, caption: str, image_srcs: List[str]) -> List[dict]:
+        """
+        Batched version of `clip_score`: the caption is encoded once, images are
+        fetched and preprocessed in parallel, then encoded `batch_size` at a time.
+        Returns one dict per source; failed/invalid sources get NaN scores and an 'error'.
+        """
+        results = [{"cosine_similarity": np.nan, "clip_logit": np.nan} for _ in image_srcs]
+        ok_mask, features, errors = self.encode_images(image_srcs)
+        for i, err in errors.items():
+            results[i]["error"] = err
+        if ok_mask.any():
+            for i, out in zip(np.flatnonzero(ok_mask), self._scores_from_features(caption, features)):
+                results[i] = out
+        return results
+
+    def score_rows(self, caption: str, row_ids: List[int], image_srcs: List[str]) -> List[dict]:
+        """
+        Like `score_images`, but rows already in the precomputed image store are
+        scored with a vector lookup + dot product; only the rest are downloaded.
+        """
+        if self.image_store is None:
+            return self.score_images(caption, image_srcs)
+        found, features = self.image_store.lookup(row_ids)
+        results = [None] * len(image_srcs)
+        if found.any():
+            for i, out in zip(np.flatnonzero(found), self._scores_from_features(caption, features)):
+                results[i] = out
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            print(f"{len(missing)}/{len(row_ids)} candidates not in image store, fetching")
+            for i, out in zip(missing, self.score_images(caption, [image_srcs[i] for i in missing])):
+                results[i] = out
+        return results
+
     @torch.no_grad()
     def clip_score(self, caption: str, image_src: str) -> dict:
         img = self._load_pil_image(image_src)
         image = self.preprocess(img).unsqueeze(0).to(self.device)
-        text = self.tokenizer([caption]).to(self.device)
+        text_features = self.encode_text(caption)
 
         use_amp = (self.device == "cuda")
         with torch.cuda.amp.autocast(enabled=use_amp):
             image_features = self.model.encode_image(image)
-            text_features = self.model.encode_text(text)
             image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
             cos = (text_features @ image_features.T).squeeze().item()
             logit = (self.model.logit_scale.exp() * (text_features @ image_features.T)).squeeze().item()
 
@@ -60,32 +180,17 @@ class SimilarityScorer:
         if "url" not in df.columns:
             raise ValueError("Input DataFrame must contain a 'url' column.")
 
-        sim_scores = []
-        logit_scores = []
-
         total = len(df)
         print(f"Scoring {total} rows against target caption...")
-        for i, url in enumerate(df["url"].tolist()):
-            if not isinstance(url, str) or url.strip() == "":
-                sim_scores.append(np.nan)
-                logit_scores.append(np.nan)
-                continue
-
-            try:
-                out = self.clip_score(target_caption, str(url))
-                sim_scores.append(out.get("cosine_similarity", np.nan))
-                logit_scores.append(out.get("clip_logit", np.nan))
-            except Exception as e:
-                # Any fetch/decoding/scoring issue → set NaN
-                sim_scores.append(np.nan)
-                logit_scores.append(np.nan)
-                # Optional: print a lightweight error (kept short to avoid noisy logs)
-                print(f"[{i}] URL failed: {e}")
-
-            if (i + 1) % 50 == 0:
-                print(f"Processed {i + 1}/{total}")
+        if "row_id" in df.columns and self.image_store is not None:
+            scores = self.score_rows(target_caption, df["row_id"].tolist(), df["url"].tolist())
+        else:
+            scores = self.score_images(target_caption, df["url"].tolist())
+        for i, out in enumerate(scores):
+            if "error" in out:
+                print(f"[{i}] URL failed: {out['error']}")
 
         out_df = df.copy()
-        out_df["sim_score_image"] = sim_scores
-        out_df["clip_logit_image"] = logit_scores
+        out_df["sim_score_image"] = [out["cosine_similarity"] for out in scores]
+        out_df["clip_logit_image"] = [out["clip_logit"] for out in scores]
         return out_df
@@ -0,0 +1,255 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def caption_key(caption: str) -> str:
+    return hashlib.sha1(" ".join(str(caption).split()).encode("utf-8")).hexdigest()
+
+
+def record_key(key: str, url, row_id) -> tuple:
+    """Identity of a stored record: its corpus row, else its caption and image url."""
+    return ("row", int(row_id)) if row_id is not None else ("caption", key, url)
+
+
+class EmbeddingStore:
+    """
+    Single append-only store for caption embeddings of every object.
+
+    store_dir/
+      manifest.json    model, dim, dtype
+      vectors.bin      append-only [n, dim] matrix (float32 or float16)
+      captions.jsonl   line i = {"key", "caption", "url", "row_id"} for vector i
+      object_rows.i64  append-only vector positions, grouped per object
+      objects.json     object -> [start, end) range into object_rows.i64
+
+    A corpus row embedded once is reused by every object that retrieves it
+    (keyed by row_id, or by caption hash and url when there is no row_id).
+    Reads are zero-copy views into the memory-mapped
+    matrix. Writers take an flock on store_dir/.lock, so uvicorn workers and
+    the migration tool can share one store; whatever an interrupted writer
+    left half-written is cut off by the next one.
+    """
+
+    def __init__(self, store_dir, model: str = "text-embedding-3-large", dim: Optional[int] = None,
+                 dtype: str = "float32"):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.store_dir / "manifest.json"
+        if manifest_path.exists():
+            with open(manifest_path, "r") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"model": model, "dim": dim, "dtype": dtype}
+        self.dtype = np.dtype(self.manifest["dtype"])
+        self._lock = threading.Lock()
+        self._loaded_state = None
+        # captions.jsonl is append-only: records are parsed once, then only the new tail
+        self.records, self.by_key, self._records_offset = [], {}, 0
+        for name in ("vectors.bin", "captions.jsonl", "object_rows.i64"):
+            (self.store_dir / name).touch()
+        self._reload()
+
+    # ---- on-disk state ----
+    @contextmanager
+    def _file_lock(self):
+        with self._lock, open(self.store_dir / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _state(self):
+        p = self.store_dir / "objects.json"
+        return p.stat().st_mtime_ns if p.exists() else None
+
+    def _reload(self):
+        """(Re)map the store if another process has committed since we last looked."""
+        state = self._state()
+        if state == self._loaded_state and self._loaded_state is not None:
+            return
+        objects_path = self.store_dir / "objects.json"
+        self.objects: Dict[str, list] = {}
+        if objects_path.exists():
+            with open(objects_path, "r") as f:
+                self.objects = json.load(f)
+        n_committed = max((r[1] for r in self.objects.values()), default=0)
+        self.object_rows = np.fromfile(self.store_dir / "object_rows.i64", dtype=np.int64, count=n_committed)
+
+        self._read_new_records()
+        dim = self.manifest.get("dim")
+        n = min(len(self.records), os.path.getsize(self.store_dir / "vectors.bin") // (self.dtype.itemsize * dim)) if dim else 0
+        if len(self.records) > n:
+            # records without a vector (interrupted writer): drop them and reparse next time
+            self.records = self.records[:n]
+            self.by_key = {k: i for k, i in self.by_key.items() if i < n}
+            self._records_offset = None
+        self.vectors = (np.memmap(self.store_dir / "vectors.bin", dtype=self.dtype, mode="r", shape=(n, dim))
+                        if n else np.zeros((0, dim or 0), dtype=self.dtype))
+        self._loaded_state = state
+
+    def _read_new_records(self):
+        if self._records_offset is None:
+            self.records, self.by_key, self._records_offset = [], {}, 0
+        with open(self.store_dir / "captions.jsonl", "rb") as f:
+            f.seek(self._records_offset)
+            tail = f.read()
+        end = tail.rfind(b"\n") + 1  # a line still being written is left for later
+        for line in tail[:end].splitlines():
+            if line.strip():
+                r = json.loads(line)
+                self.by_key.setdefault(record_key(r["key"], r.get("url"), r.get("row_id")), len(self.records))
+                self.records.append(r)
+        self._records_offset += end
+
+    def _drop_orphans(self):
+        """
+        Cut vectors and caption lines an interrupted writer left past the last
+        complete pair, so the next append lines up with len(self.records).
+        Called under the file lock.
+        """
+        n = len(self.records)
+        vectors_path = self.store_dir / "vectors.bin"
+        size = n * self.dtype.itemsize * self.manifest["dim"]
+        if os.path.getsize(vectors_path) > size:
+            print(f"[embedding-store] dropping {os.path.getsize(vectors_path) - size} bytes of orphan vectors")
+            os.truncate(vectors_path, size)
+        captions_path = self.store_dir / "captions.jsonl"
+        if self._records_offset is not None and os.path.getsize(captions_path) == self._records_offset:
+            return
+        with open(captions_path, "rb") as f:
+            data = f.read()
+        end, kept = 0, 0
+        for line in data.splitlines(keepends=True):
+            if kept == n:
+                break
+            end += len(line)
+            if line.strip():
+                kept += 1
+        print(f"[embedding-store] dropping {len(data) - end} bytes of orphan caption records")
+        os.truncate(captions_path, end)
+        self._records_offset = end
+
+    def _commit_objects(self):
+        tmp = self.store_dir / f"objects.json.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.objects, f)
+        os.replace(tmp, self.store_dir / "objects.json")
+
+    # ---- public API ----
+    def has(self, object_name: str) -> bool:
+        self._reload()
+        return object_name in self.objects
+
+    def get(self, object_name: str) -> pd.DataFrame:
+        """
+        Embeddings for an object as a DataFrame ['caption', 'embedding', 'url', 'row_id'];
+        each 'embedding' is a read-only view into the memory-mapped matrix.
+        """
+        meta, matrix = self.get_matrix(object_name)
+        meta["embedding"] = list(matrix)
+        return meta[["caption", "embedding", "url", "row_id"]]
+
+    def get_matrix(self, object_name: str) -> Tuple[pd.DataFrame, np.ndarray]:
+        self._reload()
+        if object_name not in self.objects:
+            raise KeyError(object_name)
+        start, end = self.objects[object_name]
+        positions = self.object_rows[start:end]
+        meta = pd.DataFrame([self.records[p] for p in positions], columns=["key", "caption", "url", "row_id"])
+        # contiguous positions (the common case) are a zero-copy slice
+        if len(positions) and positions[-1] - positions[0] == len(positions) - 1:
+            matrix = self.vectors[positions[0]:positions[-1] + 1]
+        else:
+            matrix = self.vectors[positions]
+        return meta.drop(columns=["key"]), matrix
+
+    def put(self, object_name: str, emb_df: pd.DataFrame):
+        """Store the embeddings of `emb_df` (caption, embedding, optional url/row_id) under object_name."""
+        if emb_df.empty:
+            return
+        with self._file_lock():
+            self._reload()
+            first = np.asarray(emb_df["embedding"].iloc[0])
+            if not self.manifest.get("dim"):
+                self.manifest["dim"] = int(first.shape[-1])
+                with open(self.store_dir / "manifest.json", "w") as f:
+                    json.dump(self.manifest, f, indent=4)
+                self._loaded_state = None
+                self._reload()
+
+            # by_key only learns new records when _reload reads them back from disk
+            positions, new_records, new_vectors, pending = [], [], [], {}
+            n = len(self.records)
+            urls = emb_df["url"].tolist() if "url" in emb_df.columns else [None] * len(emb_df)
+            row_ids = emb_df["row_id"].tolist() if "row_id" in emb_df.columns else [None] * len(emb_df)
+            for caption, emb, url, row_id in zip(emb_df["caption"].tolist(), emb_df["embedding"].tolist(), urls, row_ids):
+                key = caption_key(caption)
+                row_id = None if row_id is None or pd.isna(row_id) else int(row_id)
+                identity = record_key(key, url, row_id)
+                pos = self.by_key.get(identity, pending.get(identity))
+                if pos is None:
+                    pos = n + len(new_records)
+                    pending[identity] = pos
+                    new_records.append({"key": key, "caption": caption, "url": url, "row_id": row_id})
+                    new_vectors.append(json.loads(emb) if isinstance(emb, str) else emb)
+                positions.append(pos)
+
+            if new_records:
+                self._drop_orphans()
+                with open(self.store_dir / "vectors.bin", "ab") as f:
+                    f.write(np.asarray(new_vectors, dtype=self.dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.store_dir / "captions.jsonl", "a", encoding="utf-8") as f:
+                    for r in new_records:
+                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            start = os.path.getsize(self.store_dir / "object_rows.i64") // 8
+            with open(self.store_dir / "object_rows.i64", "ab") as f:
+                f.write(np.asarray(positions, dtype=np.int64).tobytes())
+            self.objects[object_name] = [start, start + len(positions)]
+            self._commit_objects()
+            self._loaded_state = None
+            self._reload()
+
+
+def migrate_parquet_dir(store: EmbeddingStore, src_dir="embeddings") -> int:
+    """Import every embeddings_{object}.parquet in src_dir that is not in the store yet."""
+    imported = 0
+    for path in sorted(Path(src_dir).glob("embeddings_*.parquet")):
+        object_name = re.sub(r"^embeddings_", "", path.stem)
+        if store.has(object_name):
+            continue
+        store.put(object_name, pd.read_parquet(path))
+        imported += 1
+        print(f"Imported {object_name} from {path}")
+    return imported
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import per-object embedding parquet files into the embedding store")
+    parser.add_argument("--src", default="embeddings", help="Directory with embeddings_{object}.parquet files")
+    parser.add_argument("--store-dir", default=os.path.join("embeddings", "store"))
+    parser.add_argument("--model", default="text-embedding-3-large")
+    parser.add_argument("--float16", action="store_true", help="Store vectors as float16 (new store only)")
+    args = parser.parse_args(argv)
+
+    store = EmbeddingStore(args.store_dir, model=args.model, dtype="float16" if args.float16 else "float32")
+    n = migrate_parquet_dir(store, args.src)
+    print(f"Imported {n} objects; store has {len(store.objects)} objects, {len(store.records)} vectors")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,17 @@
 import pandas as pd
+from therapist.image_generator.corpus import CaptionCorpus
+
+def filter_df_with_object(df, object_name: str) -> pd.DataFrame:
+    """`df` is either an in-memory DataFrame or a memory-mapped CaptionCorpus."""
+    if isinstance(df, CaptionCorpus):
+        # token lengths come precomputed from the corpus / caption index
+        df = df.search(object_name, max_tokens=20)
+    else:
+        mask = df["caption"].astype(str).str.contains(object_name, case=False, na=False)
+        df = df.loc[mask].copy()
+        token_len = (df["caption"].fillna("").astype(str).str.split().str.len())
+        df = df[token_len < 20]
 
-def filter_df_with_object(df: pd.DataFrame, object_name: str) -> pd.DataFrame:
-    mask = df["caption"].astype(str).str.contains(object_name, case=False, na=False)
-    df = df.loc[mask].copy()
-    token_len = (df["caption"].fillna("").astype(str).str.split().str.len())
-    df = df[token_len < 20]
-    
     df["caption"] = (df["caption"].fillna("")
                       .astype(str)
                       .str.replace(r"\s+", " ", regex=True)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+
+class ImageFetchError(Exception):
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        # permanent failures are remembered for negative_ttl, transient ones for transient_ttl
+        self.permanent = permanent
+
+
+# statuses that won't change by asking again soon
+PERMANENT_HTTP_STATUSES = {404, 410}
+
+
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ImageFetcher:
+    """
+    Pooled, concurrent image downloader with an on-disk cache.
+
+    Layout of `cache_dir`:
+      objects/ab/<sha256 of bytes>   image bytes (content-addressed, shared by URLs)
+      urls/<sha1 of url>             json {"content": <sha256>} or {"dead": ts, "ttl": s, "error": ...}
+
+    A URL is downloaded at most once: later calls (other objects, other
+    processes) read the bytes from disk. Permanently dead URLs (404/410,
+    undecodable or oversized images) are remembered for `negative_ttl`
+    seconds so they fail immediately; transient failures (timeouts,
+    connection errors, 429, 5xx) only for `transient_ttl`.
+    """
+
+    def __init__(self, cache_dir="image_cache", connect_timeout: float = 3.0, deadline: float = 8.0,
+                 max_workers: int = 16, max_bytes: int = 10 * 1024 * 1024,
+                 negative_ttl: float = 24 * 3600, transient_ttl: float = 300, max_side: Optional[int] = None):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.urls_dir = self.cache_dir / "urls"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.urls_dir.mkdir(parents=True, exist_ok=True)
+
+        self.connect_timeout = connect_timeout
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.transient_ttl = transient_ttl
+        # if set, images are stored pre-resized so the longest side is <= max_side
+        self.max_side = max_side
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "aphasia-aid-image-fetcher/1.0"
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+
+    # ---- cache bookkeeping ----
+    def _url_entry_path(self, url: str) -> Path:
+        return self.urls_dir / _sha1(url)
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _read_entry(self, url: str) -> Optional[dict]:
+        path = self._url_entry_path(url)
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _cached(self, url: str) -> Optional[bytes]:
+        """Cached bytes for url, or None if unknown. Raises ImageFetchError for known-dead URLs."""
+        entry = self._read_entry(url)
+        if entry is None:
+            return None
+        if "dead" in entry:
+            # entries without a ttl predate transient failures and may be one: expire them early
+            if time.time() - entry["dead"] < entry.get("ttl", self.transient_ttl):
+                raise ImageFetchError(f"cached failure: {entry.get('error', 'unknown')}",
+                                      permanent=entry.get("ttl", 0) >= self.negative_ttl)
+            self._evict(url)
+            return None
+        try:
+            with open(self._object_path(entry["content"]), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, url: str, data: bytes) -> bytes:
+        if self.max_side:
+            data = self._resize(data)
+        digest = hashlib.sha256(data).hexdigest()
+        obj_path = self._object_path(digest)
+        if not obj_path.exists():
+            self._atomic_write(obj_path, data)
+        self._atomic_write(self._url_entry_path(url), json.dumps({"content": digest}).encode())
+        return data
+
+    def _store_dead(self, url: str, error: str, permanent: bool):
+        ttl = self.negative_ttl if permanent else self.transient_ttl
+        self._atomic_write(self._url_entry_path(url),
+                           json.dumps({"dead": time.time(), "ttl": ttl, "error": error[:200]}).encode())
+
+    def _evict(self, url: str):
+        try:
+            self._url_entry_path(url).unlink()
+        except FileNotFoundError:
+            pass
+
+    def prune_dead(self) -> int:
+        """Delete expired failure entries (fetch also drops them as it meets them); returns how many."""
+        removed, now = 0, time.time()
+        for path in self.urls_dir.iterdir():
+            try:
+                with open(path, "r") as f:
+                    entry = json.load(f)
+                if "dead" in entry and now - entry["dead"] >= entry.get("ttl", self.transient_ttl):
+                    path.unlink()
+                    removed += 1
+            except (FileNotFoundError, ValueError, IsADirectoryError):
+                continue
+        return removed
+
+    def _resize(self, data: bytes) -> bytes:
+        img = Image.open(BytesIO(data)).convert("RGB")
+        if max(img.size) <= self.max_side:
+            return data
+        img.thumbnail((self.max_side, self.max_side))
+        out = BytesIO()
+        img.save(out, format="JPEG", quality=90)
+        return out.getvalue()
+
+    # ---- network ----
+    def _download(self, url: str) -> bytes:
+        start = time.monotonic()
+        with self.session.get(url, stream=True, timeout=(self.connect_timeout, self.deadline)) as r:
+            r.raise_for_status()
+            chunks, size = [], 0
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ImageFetchError(f"image larger than {self.max_bytes} bytes", permanent=True)
+                if time.monotonic() - start > self.deadline:
+                    raise ImageFetchError(f"download exceeded {self.deadline}s deadline")
+        data = b"".join(chunks)
+        # make sure it decodes before it goes into the cache
+        try:
+            Image.open(BytesIO(data)).verify()
+        except Exception as e:
+            raise ImageFetchError(f"undecodable image: {type(e).__name__}: {e}", permanent=True)
+        return data
+
+    def fetch(self, url: str) -> bytes:
+        """Image bytes for url, from cache or network. Raises on failure."""
+        cached = self._cached(url)
+        if cached is not None:
+            return cached
+
+        # single-flight: concurrent callers for the same url wait for one download
+        with self._lock:
+            event = self._inflight.get(url)
+            leader = event is None
+            if leader:
+                event = self._inflight[url] = threading.Event()
+        if not leader:
+            event.wait(self.connect_timeout + self.deadline + 1)
+            cached = self._cached(url)
+            if cached is None:
+                raise ImageFetchError("concurrent download failed")
+            return cached
+
+        try:
+            data = self._download(url)
+            return self._store(url, data)
+        except requests.HTTPError as e:
+            status = e.response.status_code
+            self._store_dead(url, f"HTTP {status}", permanent=status in PERMANENT_HTTP_STATUSES)
+            raise
+        except ImageFetchError as e:
+            self._store_dead(url, str(e), permanent=e.permanent)
+            raise
+        except Exception as e:
+            # timeouts, connection errors: try again soon
+            self._store_dead(url, f"{type(e).__name__}: {e}", permanent=False)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            event.set()
+
+    def fetch_many(self, urls: List[str]) -> Dict[str, Union[bytes, Exception]]:
+        """Fetch all urls concurrently; returns url -> bytes or the exception raised."""
+        unique = list(dict.fromkeys(u for u in urls if isinstance(u, str) and u.strip()))
+        if not unique:
+            return {}
+
+        def one(url):
+            try:
+                return url, self.fetch(url)
+            except Exception as e:
+                return url, e
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique))) as pool:
+            return dict(pool.map(one, unique))
+
+    def load_image(self, src: str) -> Image.Image:
+        return Image.open(BytesIO(self.fetch(src))).convert("RGB")
@@ -1,16 +1,18 @@
 import os
-import json
 import pandas as pd
 
 from therapist.image_generator.store_embeddings import store_embeddings
 from therapist.image_generator.caption_scorer import caption_scorer
 from therapist.image_generator.caption_generator import CaptionGenerator
 from therapist.image_generator.create_sim_score import SimilarityScorer
+from therapist.image_generator.caption_ann import CaptionANNIndex
+from therapist.image_generator.corpus import CaptionCorpus
+from therapist.image_generator.metadata_store import MetadataStore
 from therapist.image_generator.helper_functions import *
 
 
 class generate_image:
-    def __init__(self, model, batch_size, metadata_file="object_metadata.json"):
+    def __init__(self, model, batch_size, metadata_file="object_metadata.json", metadata_db="object_metadata.db"):
         self.embedding_model = model
         self.batch_size = batch_size
         self.scorer = caption_scorer()
@@ -18,68 +20,92 @@ class generate_image:
         self.store_emebddings = store_embeddings(model=self.embedding_model, batch_size=self.batch_size,
                                                  max_rows=2000)
         self.create_sim_score = SimilarityScorer()
+        # corpus-wide caption ANN index; when present, new objects need no bulk embedding
+        self.caption_ann = CaptionANNIndex.open()
+        if self.caption_ann is not None and self.caption_ann.model != self.embedding_model:
+            print(f"Ignoring caption ANN index built with {self.caption_ann.model}")
+            self.caption_ann = None
 
-        # metadata file to store object → {caption, url, sim_score}
+        # object → {caption, url, sim_score}, in SQLite; the legacy json is imported once
         self.metadata_file = metadata_file
-        self.metadata = self._load_metadata()
-
-    def _load_metadata(self):
-        """Load JSON metadata file if exists, else return empty dict"""
-        if os.path.exists(self.metadata_file):
-            with open(self.metadata_file, "r") as f:
-                return json.load(f)
-        return {}
-
-    def _save_metadata(self):
-        """Save current metadata to file"""
-        with open(self.metadata_file, "w") as f:
-            json.dump(self.metadata, f, indent=4)
+        self.metadata = MetadataStore(metadata_db, import_json=metadata_file)
 
     def generate_image(self, object_name, df):
-        emb_df = self.store_emebddings.generate_embeddings(object_name, df)
+        """`df` is the caption source: a CaptionCorpus or an in-memory DataFrame."""
         captions = self.caption_generator.generate_positive_and_negative_captions(object_name)
         print("captions ", captions)
+        pos_embs, neg_embs = self.scorer.embed_pos_neg(captions, model=self.embedding_model)
 
-        scored_df = self.scorer.score_embeddings_df_with_pos_neg(
-            emb_df, captions=captions, model=self.embedding_model
-        )
-        scored_df["score"] = scored_df["pos_sims"] - scored_df["neg_sims"]
+        emb_df = pd.DataFrame()
+        if self.caption_ann is not None and isinstance(df, CaptionCorpus):
+            emb_df = self.store_emebddings.candidates_from_ann(object_name, df, self.caption_ann, pos_embs)
+        if emb_df.empty:
+            emb_df = self.store_emebddings.generate_embeddings(object_name, df)
+
+        top_caption = self._top_captions(emb_df, captions, pos_embs, neg_embs)
+        sim_score_df = self.create_sim_score.score_dataframe_with_image(top_caption, self._target_caption(object_name))
+        return self._save_best(object_name, sim_score_df)
+
+    async def agenerate_image(self, object_name, df, limits):
+        """
+        Async `generate_image`. Each stage waits on its own limit in `limits`
+        (a therapist.concurrency.ResourceLimits): caption LLM call, embedding
+        calls, image downloads, then CLIP scoring on the bounded CLIP pool.
+        """
+        captions = await limits.llm_call(self.caption_generator.agenerate_positive_and_negative_captions(object_name))
+        print("captions ", captions)
+        pos_embs, neg_embs = await limits.embedding(self.scorer.embed_pos_neg, captions, model=self.embedding_model)
 
-        top_caption = scored_df.sort_values("pos_sims", ascending=False).head(10)
-        target_caption = (
+        emb_df = pd.DataFrame()
+        if self.caption_ann is not None and isinstance(df, CaptionCorpus):
+            emb_df = await self.store_emebddings.acandidates_from_ann(object_name, df, self.caption_ann, pos_embs, limits)
+        if emb_df.empty:
+            emb_df = await self.store_emebddings.agenerate_embeddings(object_name, df, limits)
+
+        top_caption = await limits.cpu(self._top_captions, emb_df, captions, pos_embs, neg_embs)
+        # warm the fetcher's disk cache so CLIP threads never wait on the network
+        urls = self._urls_to_fetch(top_caption)
+        if urls:
+            await limits.download(self.create_sim_score.fetcher.fetch_many, urls)
+        sim_score_df = await limits.clip(self.create_sim_score.score_dataframe_with_image,
+                                         top_caption, self._target_caption(object_name))
+        return await limits.cpu(self._save_best, object_name, sim_score_df)
+
+    @staticmethod
+    def _target_caption(object_name):
+        return (
             f"A clear, well-focused and real-life image of {object_name} "
             "centered on a plain, uncluttered background"
         )
 
-        sim_score_df = self.create_sim_score.score_dataframe_with_image(top_caption, target_caption)
+    def _top_captions(self, emb_df, captions, pos_embs, neg_embs):
+        scored_df = self.scorer.score_embeddings_df_with_pos_neg(
+            emb_df, captions=captions, model=self.embedding_model,
+            pos_embs=pos_embs, neg_embs=neg_embs
+        )
+        scored_df["score"] = scored_df["pos_sims"] - scored_df["neg_sims"]
+        return self.scorer.top_k(scored_df, "pos_sims", 10)
+
+    def _urls_to_fetch(self, top_caption):
+        """Urls CLIP will have to download: those without a stored image vector."""
+        urls = top_caption["url"]
+        store = self.create_sim_score.image_store
+        if store is not None and "row_id" in top_caption.columns:
+            found, _ = store.lookup(top_caption["row_id"].to_numpy())
+            urls = urls[~found]
+        return urls.tolist()
+
+    def _save_best(self, object_name, sim_score_df):
         best_row = sim_score_df.sort_values("sim_score_image", ascending=False).iloc[0]
         top_img_caption = best_row["caption"]
         top_img_url = best_row["url"]
         top_img_sim_score = float(best_row["sim_score_image"])
-        # Check metadata and update if necessary
-        if object_name not in self.metadata:
-            self.metadata[object_name] = {
-                "caption": top_img_caption,
-                "url": top_img_url,
-                "sim_score": top_img_sim_score,
-            }
-            
-        else:
-            existing_score = self.metadata[object_name]["sim_score"]
-            if top_img_sim_score > existing_score:
-                self.metadata[object_name] = {
-                    "caption": top_img_caption,
-                    "url": top_img_url,
-                    "sim_score": top_img_sim_score,
-                }
-                
-            else:
-                print(f"⏩ Kept existing entry for '{object_name}' (score {existing_score:.4f} >= {top_img_sim_score:.4f})")
-
-        # Save changes to JSON
-        self._save_metadata()
-
-        return self.metadata[object_name] ['url'] # return best entry
+        # Keep the stored entry unless this run found a better image (atomic per object)
+        entry = self.metadata.upsert_if_better(object_name, top_img_caption, top_img_url, top_img_sim_score)
+        if entry["url"] != top_img_url:
+            print(f"⏩ Kept existing entry for '{object_name}' (score {entry['sim_score']} >= {top_img_sim_score:.4f})")
+
+        return entry['url'] # return best entry
 
 
 if __name__ == "__main__":
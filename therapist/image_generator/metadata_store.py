@@ -0,0 +1,133 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class MetadataStore:
+    """
+    SQLite (WAL) store for object -> {caption, url, sim_score, updated_at}.
+
+    Every write is a single atomic per-object upsert, so the 20 question
+    threads and several uvicorn workers can update objects concurrently
+    without rewriting (or clobbering) everyone else's entries. Supports the
+    read side of a dict (`get`, `in`, `[]`) so callers can treat it like the
+    old metadata json.
+    """
+
+    def __init__(self, db_path="object_metadata.db", import_json: Optional[str] = "object_metadata.json"):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS object_metadata (
+                    object TEXT PRIMARY KEY,
+                    caption TEXT,
+                    url TEXT,
+                    sim_score REAL,
+                    updated_at REAL
+                )
+            """)
+        if import_json and os.path.exists(import_json):
+            self.import_json(import_json)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_entry(row) -> dict:
+        entry = {"caption": row["caption"], "url": row["url"], "sim_score": row["sim_score"]}
+        if row["updated_at"] is not None:
+            entry["updated_at"] = row["updated_at"]
+        return entry
+
+    # ---- dict-like reads ----
+    def get(self, object_name: str, default=None) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT * FROM object_metadata WHERE object = ?", (object_name,)
+        ).fetchone()
+        return self._row_to_entry(row) if row else default
+
+    def __contains__(self, object_name: str) -> bool:
+        return self.get(object_name) is not None
+
+    def __getitem__(self, object_name: str) -> dict:
+        entry = self.get(object_name)
+        if entry is None:
+            raise KeyError(object_name)
+        return entry
+
+    def all(self) -> Dict[str, dict]:
+        rows = self._conn().execute("SELECT * FROM object_metadata ORDER BY object").fetchall()
+        return {row["object"]: self._row_to_entry(row) for row in rows}
+
+    # ---- writes ----
+    def upsert_if_better(self, object_name: str, caption: str, url: str, sim_score: float) -> dict:
+        """
+        Insert the entry, or replace the stored one only if `sim_score` is higher.
+        Either way the entry's updated_at is bumped. Returns the entry now stored.
+        """
+        if sim_score is not None and isinstance(sim_score, float) and math.isnan(sim_score):
+            sim_score = None
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                INSERT INTO object_metadata (object, caption, url, sim_score, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(object) DO UPDATE SET
+                    caption = CASE WHEN COALESCE(excluded.sim_score, -1) > COALESCE(sim_score, -1)
+                                   THEN excluded.caption ELSE caption END,
+                    url = CASE WHEN COALESCE(excluded.sim_score, -1) > COALESCE(sim_score, -1)
+                               THEN excluded.url ELSE url END,
+                    sim_score = CASE WHEN COALESCE(excluded.sim_score, -1) > COALESCE(sim_score, -1)
+                                     THEN excluded.sim_score ELSE sim_score END,
+                    updated_at = excluded.updated_at
+            """, (object_name, caption, url, sim_score, time.time()))
+            row = conn.execute("SELECT * FROM object_metadata WHERE object = ?", (object_name,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row_to_entry(row)
+
+    def import_json(self, path: str) -> int:
+        """Import entries from the legacy metadata json; existing objects are left alone."""
+        with open(path, "r") as f:
+            data = json.load(f)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO object_metadata (object, caption, url, sim_score, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(obj, e.get("caption"), e.get("url"), e.get("sim_score"), e.get("updated_at"))
+                 for obj, e in data.items()],
+            )
+            imported = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if imported:
+            print(f"Imported {imported} objects from {path} into {self.db_path}")
+        return imported
+
+    def export_json(self, path: str):
+        """Write the whole table out in the legacy json format (for inspection/backups)."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.all(), f, indent=4)
+        os.replace(tmp, path)
@@ -1,14 +1,12 @@
 
-import httpx
-from therapist.utils import safe_parse_json,clean_json
-from therapist.config import url
+from therapist.structured_output import generate_structured, agenerate_structured, NEGATIVE_PATTERNS
 import os
 import openai
 import json
 class PatternGenerator:
     def __init__(self):
         pass
-    def generate_negative_patterns(self, object_name):
+    def _build_messages(self, object_name):
 
         user_prompt = """
         You are a regex pattern generator that BLACKLISTS captions unsuitable for flashcard-style image generation from a large (CLIP) dataset.
@@ -64,25 +62,10 @@ Output format (JSON only):
                 {"role": "user", "content": f"""
                  Target Object: {object_name}"""}
             ]
-        response = httpx.post(
-                url,
-                json={"input_text": messages},
-                timeout=60
-            )
-        response.raise_for_status()
-        data=response.json()["response"]
-        content=clean_json(data)
-        print(content)
-        content=json.loads(content)
+        return messages
 
-        # response = httpx.post(
-        #     url,
-        #     json={"input_text": messages},
-        #     timeout=60
-        # )
-        # response.raise_for_status()
-        # content = response.json()["response"]
-        # print(content, ' inside framer')
-        return content
+    def generate_negative_patterns(self, object_name):
+        return generate_structured(self._build_messages(object_name), NEGATIVE_PATTERNS, cache_route="negative_patterns")
 
-    
+    async def agenerate_negative_patterns(self, object_name):
+        return await agenerate_structured(self._build_messages(object_name), NEGATIVE_PATTERNS, cache_route="negative_patterns")
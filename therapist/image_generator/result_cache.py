@@ -0,0 +1,129 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from therapist.config import (IMAGE_CACHE_MIN_SCORE, IMAGE_CACHE_TTL_SEC, IMAGE_CACHE_TTL_OVERRIDES,
+                              IMAGE_CACHE_LOW_SCORE_RETRY_SEC)
+
+
+class ImageResultCache:
+    """
+    Cache in front of `generate_image.generate_image`, backed by its object metadata.
+
+    - fresh entry with sim_score >= min_score: returned immediately (hit)
+    - stale entry: returned immediately, and the full pipeline is re-run for
+      that object in the background (stale-while-revalidate)
+    - low-scoring entry: the same, but retried only every `low_score_retry_sec`,
+      doubling (up to the TTL) each time a refresh fails or leaves the score
+      below min_score
+    - no entry: the pipeline runs inline (miss)
+
+    At most one background refresh per object runs at a time.
+    """
+
+    def __init__(self, image_gen, min_score: float = IMAGE_CACHE_MIN_SCORE,
+                 ttl_sec: float = IMAGE_CACHE_TTL_SEC, ttl_overrides: Optional[Dict[str, float]] = None,
+                 refresh_workers: int = 2, low_score_retry_sec: float = IMAGE_CACHE_LOW_SCORE_RETRY_SEC):
+        self.image_gen = image_gen
+        self.min_score = min_score
+        self.ttl_sec = ttl_sec
+        self.ttl_overrides = dict(IMAGE_CACHE_TTL_OVERRIDES if ttl_overrides is None else ttl_overrides)
+        self.low_score_retry_sec = low_score_retry_sec
+        # object -> refreshes in a row that failed or left its score below min_score
+        self._low_score_retries: Dict[str, int] = {}
+        # object -> time of its last failed refresh; a failure does not bump updated_at
+        self._failed_at: Dict[str, float] = {}
+        self._refresh_pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="image-refresh")
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.counters = {"hit": 0, "stale_hit": 0, "low_score_hit": 0, "low_score_stale": 0, "miss": 0,
+                         "refresh_ok": 0, "refresh_failed": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def ttl_for(self, object_name: str) -> float:
+        return self.ttl_overrides.get(object_name, self.ttl_sec)
+
+    def _low_score(self, entry: Optional[dict]) -> bool:
+        score = (entry or {}).get("sim_score")
+        return score is None or (isinstance(score, float) and math.isnan(score)) or score < self.min_score
+
+    def _entry_state(self, object_name: str, entry: dict) -> str:
+        # entries written before timestamps existed count as stale
+        age = time.time() - entry.get("updated_at", 0)
+        ttl = self.ttl_for(object_name)
+        if self._low_score(entry):
+            # every refresh bumps updated_at (or _failed_at), so this bounds how often a poor image is retried
+            with self._lock:
+                retries = self._low_score_retries.get(object_name, 0)
+                failed_at = self._failed_at.get(object_name)
+            if failed_at is not None:
+                age = min(age, time.time() - failed_at)
+            return "low_score_hit" if age < min(ttl, self.low_score_retry_sec * 2 ** retries) else "low_score_stale"
+        return "hit" if age < ttl else "stale_hit"
+
+    def get(self, object_name: str, df) -> Optional[str]:
+        """Image url for object_name, running the pipeline inline only on a miss."""
+        entry = self.image_gen.metadata.get(object_name)
+        if not entry or not entry.get("url"):
+            self._count("miss")
+            return self.image_gen.generate_image(object_name, df)
+
+        state = self._entry_state(object_name, entry)
+        self._count(state)
+        if state in ("stale_hit", "low_score_stale"):
+            self._schedule_refresh(object_name, df)
+        return entry["url"]
+
+    async def aget(self, object_name: str, df, limits) -> Optional[str]:
+        """Async `get`: a miss runs `agenerate_image` under `limits`; refreshes stay on the refresh pool."""
+        entry = await limits.cpu(self.image_gen.metadata.get, object_name)
+        if not entry or not entry.get("url"):
+            self._count("miss")
+            return await self.image_gen.agenerate_image(object_name, df, limits)
+
+        state = self._entry_state(object_name, entry)
+        self._count(state)
+        if state in ("stale_hit", "low_score_stale"):
+            self._schedule_refresh(object_name, df)
+        return entry["url"]
+
+    def _schedule_refresh(self, object_name: str, df):
+        with self._lock:
+            if object_name in self._refreshing:
+                return
+            self._refreshing.add(object_name)
+        self._refresh_pool.submit(self._refresh, object_name, df)
+
+    def _refresh(self, object_name: str, df):
+        try:
+            self.image_gen.generate_image(object_name, df)
+            self._count("refresh_ok")
+            still_low = self._low_score(self.image_gen.metadata.get(object_name))
+            with self._lock:
+                self._failed_at.pop(object_name, None)
+                if still_low:
+                    self._low_score_retries[object_name] = self._low_score_retries.get(object_name, 0) + 1
+                else:
+                    self._low_score_retries.pop(object_name, None)
+        except Exception as e:
+            print(f"Background image refresh failed for '{object_name}': {type(e).__name__}: {e}")
+            self._count("refresh_failed")
+            with self._lock:
+                self._failed_at[object_name] = time.time()
+                self._low_score_retries[object_name] = self._low_score_retries.get(object_name, 0) + 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(object_name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            refreshing = sorted(self._refreshing)
+        served = counters["hit"] + counters["stale_hit"] + counters["low_score_hit"] + counters["low_score_stale"]
+        total = served + counters["miss"]
+        return {**counters, "hit_rate": round(served / total, 4) if total else None, "refreshing": refreshing}
@@ -1,10 +1,12 @@
 import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from therapist.image_generator.create_embeddings import embed_captions_df
 from therapist.image_generator.helper_functions import *
 from therapist.image_generator.negative_pattern_generator import PatternGenerator
+from therapist.image_generator.embedding_store import EmbeddingStore
 import re
 
 def chunk_df(df, size):
@@ -26,6 +28,8 @@ class store_embeddings:
         self.emb_dir = emb_dir
         self.cc=PatternGenerator()
         os.makedirs(self.emb_dir, exist_ok=True)
+        # one memory-mapped store for all objects instead of a parquet per object
+        self.store = EmbeddingStore(os.path.join(self.emb_dir, "store"), model=self.embedding_model)
 
     def _process_chunk(self, chunk):
         """Helper to process one chunk safely."""
@@ -35,37 +39,118 @@ class store_embeddings:
             print(f"Embedding failed for chunk: {e}")
             return None
 
-    def generate_embeddings(self, object_name,df):
-        emb_path = os.path.join(self.emb_dir, f"embeddings_{object_name}.parquet")
+    def _drop_negative_patterns(self, df, object_name, NEGATIVE_PATTERNS=None):
+        if NEGATIVE_PATTERNS is None:
+            NEGATIVE_PATTERNS = self.cc.generate_negative_patterns(object_name)['NEGATIVE_PATTERNS']
+        print(NEGATIVE_PATTERNS)
+        def has_negative_pattern(caption):
+            for pattern in NEGATIVE_PATTERNS:
+                # print(pattern)
+                if re.search(pattern, caption.lower()):
+                    return True
+            return False
+        return df[~df["caption"].apply(has_negative_pattern)]
 
-        # If already processed, load cached embeddings
+    def _ann_candidates(self, object_name, corpus, ann_index, pos_embs, k, nprobe):
+        row_ids, _ = ann_index.search(np.asarray(pos_embs, dtype=np.float32), k=k, nprobe=nprobe)
+        row_ids = np.unique(row_ids[row_ids >= 0])
+        cand = corpus.take(row_ids)
+        cand = cand[cand["caption"].astype(str).str.contains(object_name, case=False, regex=False, na=False)]
+        print(f"ANN candidates for '{object_name}': {len(row_ids)}, mentioning object: {len(cand)}")
+        return cand.reset_index(drop=True)
+
+    def _finish_ann_candidates(self, cand, object_name, ann_index, patterns=None):
+        cand = self._drop_negative_patterns(cand, object_name, patterns)
+        cand = cand.reset_index(drop=True)
+        cand["caption"] = cand["caption"].astype(str).str.replace(r"\s+", " ", regex=True).str.strip()
+        cand["embedding"] = list(ann_index.get_vectors(cand["row_id"].to_numpy()))
+        return cand[["caption", "embedding", "url", "row_id"]]
+
+    def candidates_from_ann(self, object_name, corpus, ann_index, pos_embs, k=500, nprobe=16):
+        """
+        Candidate captions for an object straight from the corpus-wide ANN index:
+        nearest neighbours of the positive caption embeddings, kept only if they
+        mention the object and pass the negative patterns. No embedding calls.
+        Returns the same columns as generate_embeddings (+ row_id).
+        """
+        cand = self._ann_candidates(object_name, corpus, ann_index, pos_embs, k, nprobe)
+        if cand.empty:
+            return pd.DataFrame()
+        return self._finish_ann_candidates(cand, object_name, ann_index)
+
+    async def acandidates_from_ann(self, object_name, corpus, ann_index, pos_embs, limits, k=500, nprobe=16):
+        """Async `candidates_from_ann`: index search on the CPU pool, pattern LLM call under the LLM limit."""
+        cand = await limits.cpu(self._ann_candidates, object_name, corpus, ann_index, pos_embs, k, nprobe)
+        if cand.empty:
+            return pd.DataFrame()
+        patterns = (await limits.llm_call(self.cc.agenerate_negative_patterns(object_name)))['NEGATIVE_PATTERNS']
+        return await limits.cpu(self._finish_ann_candidates, cand, object_name, ann_index, patterns)
+
+    def _cached_embeddings(self, object_name):
+        """Stored embeddings for the object (importing a legacy parquet once), else None."""
+        emb_path = os.path.join(self.emb_dir, f"embeddings_{object_name}.parquet")
+        if self.store.has(object_name):
+            print(f"Found existing embeddings for '{object_name}' in {self.store.store_dir}")
+            return self.store.get(object_name)
+        # legacy per-object parquet: import it into the store once
         if os.path.exists(emb_path):
-            print(f"Found existing embeddings: {emb_path}")
-            return pd.read_parquet(emb_path)
+            print(f"Importing existing embeddings: {emb_path}")
+            self.store.put(object_name, pd.read_parquet(emb_path))
+            return self.store.get(object_name)
+        return None
 
+    def _filter_candidates(self, object_name, df):
         filtered_df = filter_df_with_object(df, object_name)
-        print(f"Filtered rows for '{object_name}': {len(filtered_df)}") 
-        
-        del df  
+        print(f"Filtered rows for '{object_name}': {len(filtered_df)}")
         if filtered_df.empty:
-            print("No rows after filtering. Exiting.")
-            return pd.DataFrame()
-
+            return filtered_df
         filtered_df = filtered_df.iloc[: self.max_rows, :]
         filtered_df["token_length"] = filtered_df["caption"].fillna("").astype(str).str.split().map(len)
         filtered_df = filtered_df[filtered_df["token_length"] <= 20]
         print(f"Remaining after token length filter: {len(filtered_df)}")
-        NEGATIVE_PATTERNS = self.cc.generate_negative_patterns(object_name)['NEGATIVE_PATTERNS']
-        print(NEGATIVE_PATTERNS)
-        def has_negative_pattern(caption):
-            for pattern in NEGATIVE_PATTERNS:
-                # print(pattern)
-                if re.search(pattern, caption.lower()):
-                    return True
-            return False
+        return filtered_df
+
+    def _save_embeddings(self, object_name, emb_df):
+        # Ensure embedding column exists
+        if "embedding" not in emb_df.columns:
+            raise ValueError("embed_captions_df must return a column named 'embedding'.")
+        self.store.put(object_name, emb_df)
+        print(f"Saved embeddings for '{object_name}' to {self.store.store_dir}")
+        return emb_df
+
+    async def agenerate_embeddings(self, object_name, df, limits):
+        """
+        Async `generate_embeddings`: corpus filtering runs on the CPU pool, the
+        pattern call under the LLM limit and the embedding call under the
+        embedding limit.
+        """
+        cached = await limits.cpu(self._cached_embeddings, object_name)
+        if cached is not None:
+            return cached
+        filtered_df = await limits.cpu(self._filter_candidates, object_name, df)
+        if filtered_df.empty:
+            print("No rows after filtering. Exiting.")
+            return pd.DataFrame()
+        patterns = (await limits.llm_call(self.cc.agenerate_negative_patterns(object_name)))['NEGATIVE_PATTERNS']
+        filtered_df = self._drop_negative_patterns(filtered_df, object_name, patterns)
+        print(f"Remaining after regex pattern filtering: {len(filtered_df)}")
+        emb_df = await limits.embedding(embed_captions_df, filtered_df, model=self.embedding_model, batch_size=200)
+        return await limits.cpu(self._save_embeddings, object_name, emb_df)
+
+    def generate_embeddings(self, object_name,df):
+        # If already processed, load cached embeddings
+        cached = self._cached_embeddings(object_name)
+        if cached is not None:
+            return cached
+
+        filtered_df = self._filter_candidates(object_name, df)
+        del df  
+        if filtered_df.empty:
+            print("No rows after filtering. Exiting.")
+            return pd.DataFrame()
 
         # Step 4: Remove captions with negative patterns
-        filtered_df = filtered_df[~filtered_df["caption"].apply(has_negative_pattern)]
+        filtered_df = self._drop_negative_patterns(filtered_df, object_name)
         print(f"Remaining after regex pattern filtering: {len(filtered_df)}")
         chunks = chunk_df(filtered_df, self.batch_size)
 
@@ -94,12 +179,5 @@ class store_embeddings:
         # # Combine results
         # emb_df = pd.concat(results).reset_index(drop=True)
 
-        # Ensure embedding column exists
-        if "embedding" not in emb_df.columns:
-            raise ValueError("embed_captions_df must return a column named 'embedding'.")
-
         # Save results
-        emb_df.to_parquet(emb_path, index=False)
-        print(f"Saved embeddings to {emb_path}")
-
-        return emb_df
+        return self._save_embeddings(object_name, emb_df)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Iterator, List, Optional
+
+import httpx
+
+from therapist.config import LLM_ENDPOINT, LLM_TIMEOUT_SEC, LLM_MAX_RETRIES, LLM_MAX_CONNECTIONS
+
+
+class LLMError(Exception):
+    pass
+
+
+# worth retrying: the router is overloaded or restarting, or OpenAI rate-limited it
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMClient:
+    """
+    One pooled client for the /api/llm/generate router, shared by every agent.
+
+    Keeps keep-alive connections open (sync and async pools are separate,
+    both bounded by `max_connections`), applies a per-call timeout and
+    retries transport errors / 429 / 5xx with jittered backoff.
+    """
+
+    def __init__(self, endpoint: str = LLM_ENDPOINT, timeout: float = LLM_TIMEOUT_SEC,
+                 retries: int = LLM_MAX_RETRIES, backoff: float = 0.5,
+                 max_connections: int = LLM_MAX_CONNECTIONS):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self._client: Optional[httpx.Client] = None
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        return self._client
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        # created lazily inside the running loop that first uses it
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._aclient
+
+    def _payload(self, messages: List[dict], **extra) -> dict:
+        return {"input_text": messages, **extra}
+
+    def _delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    @staticmethod
+    def _should_retry(exc: Exception) -> bool:
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in _RETRY_STATUS
+        return isinstance(exc, httpx.TransportError)
+
+    def generate(self, messages: List[dict], timeout: Optional[float] = None, **extra) -> str:
+        """POST messages to the LLM router and return its `response` text."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.client.post(self.endpoint, json=self._payload(messages, **extra),
+                                            timeout=timeout or self.timeout)
+                response.raise_for_status()
+                return response.json()["response"]
+            except Exception as e:
+                if attempt >= self.retries or not self._should_retry(e):
+                    raise LLMError(f"LLM call failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}") from e
+                time.sleep(self._delay(attempt))
+
+    async def agenerate(self, messages: List[dict], timeout: Optional[float] = None, **extra) -> str:
+        """Async version of `generate`."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.aclient.post(self.endpoint, json=self._payload(messages, **extra),
+                                                   timeout=timeout or self.timeout)
+                response.raise_for_status()
+                return response.json()["response"]
+            except Exception as e:
+                if attempt >= self.retries or not self._should_retry(e):
+                    raise LLMError(f"LLM call failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}") from e
+                await asyncio.sleep(self._delay(attempt))
+
+    @property
+    def invalidate_endpoint(self) -> str:
+        return self.endpoint.rsplit("/", 1)[0] + "/cache/invalidate"
+
+    def invalidate(self, messages: List[dict], cache_route: Optional[str] = None, **extra) -> bool:
+        """Drop the router's cached reply to `messages` (one that turned out unusable). Best effort."""
+        if not cache_route:
+            return False
+        try:
+            response = self.client.post(self.invalidate_endpoint,
+                                        json=self._payload(messages, cache_route=cache_route), timeout=self.timeout)
+            response.raise_for_status()
+            return bool(response.json().get("invalidated"))
+        except Exception as e:
+            print(f"LLM cache invalidation failed: {type(e).__name__}: {e}")
+            return False
+
+    async def ainvalidate(self, messages: List[dict], cache_route: Optional[str] = None, **extra) -> bool:
+        """Async `invalidate`."""
+        if not cache_route:
+            return False
+        try:
+            response = await self.aclient.post(self.invalidate_endpoint,
+                                               json=self._payload(messages, cache_route=cache_route),
+                                               timeout=self.timeout)
+            response.raise_for_status()
+            return bool(response.json().get("invalidated"))
+        except Exception as e:
+            print(f"LLM cache invalidation failed: {type(e).__name__}: {e}")
+            return False
+
+    def stream(self, messages: List[dict], timeout: Optional[float] = None, **extra) -> Iterator[str]:
+        """
+        Yield the response text in deltas from the router's SSE mode. Connection
+        errors and 429/5xx are retried only before the first delta arrives.
+        """
+        for attempt in range(self.retries + 1):
+            started = False
+            try:
+                with self.client.stream("POST", self.endpoint, json=self._payload(messages, stream=True, **extra),
+                                        timeout=timeout or self.timeout) as response:
+                    response.raise_for_status()
+                    for event, data in _iter_sse(response.iter_lines()):
+                        if event == "delta":
+                            started = True
+                            yield data["delta"]
+                        elif event == "error":
+                            raise LLMError(f"LLM stream failed: {data.get('detail')}")
+                        elif event == "done":
+                            return
+                return
+            except LLMError:
+                raise
+            except Exception as e:
+                if started or attempt >= self.retries or not self._should_retry(e):
+                    raise LLMError(f"LLM stream failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}") from e
+                time.sleep(self._delay(attempt))
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+
+def _iter_sse(lines):
+    """(event, data) pairs from server-sent-event lines; data is JSON."""
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+    if data:
+        yield event, json.loads("\n".join(data))
+
+
+# process-wide client used by all agents
+llm = LLMClient()
@@ -1,40 +1,92 @@
 import os
 import time
+import asyncio
+import functools
+import threading
 import json
 import psutil
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeout
 import pandas as pd
 
 from pathlib import Path
 from therapist.conversation_generator.question_generator import QuestionGeneratorAgent
 from therapist.conversation_generator.phonetic_hint_agent import PhoneticHintAgent
 from therapist.conversation_generator.classifier_agent import ClassifierAgent
-from therapist.utils import extract_json_from_response
+from therapist.utils import clean_json
+from therapist.llm_client import llm
+from therapist.config import EVAL_SPECULATIVE, EVAL_HINT_CANDIDATES, EVAL_EXTRA_LLM_BUDGET
+from therapist.concurrency import limits
 from therapist.conversation_generator.question_framing_agent import QuestionFramingAgent
 from therapist.conversation_generator.phoentic_critic import PhoneticValidatorAgent
 from therapist.conversation_generator.evaluator_agent import EvaluatorAgent
 from therapist.conversation_generator.descriptive_hint_agent import HintgeneratorAgent
 from therapist.conversation_generator.descriptive_criric import ValidatorAgent
+from therapist.conversation_generator.object_lexicon import ObjectLexicon
 from therapist.image_generator.image_generator import generate_image
+from therapist.image_generator.corpus import CaptionCorpus
+from therapist.image_generator.result_cache import ImageResultCache
 
 # Agents initialization
 question_agent = QuestionGeneratorAgent()
 ph_hint = PhoneticHintAgent()
-classif = ClassifierAgent()
-evaluator = EvaluatorAgent()
-question_framer = QuestionFramingAgent()
+object_lexicon = ObjectLexicon()
+classif = ClassifierAgent(lexicon=object_lexicon)
+evaluator = EvaluatorAgent(lexicon=object_lexicon)
+question_framer = QuestionFramingAgent(lexicon=object_lexicon)
 ph_critic = PhoneticValidatorAgent()
 hint_agent = HintgeneratorAgent()
 hint_v = ValidatorAgent()
 BASE_DIR = Path(__file__).resolve().parent  # folder containing model.py
 parquet_path = BASE_DIR / "image_generator" / "cc12m_7m_subset_translated.parquet"
 
-df = pd.read_parquet(parquet_path) 
+# memory-mapped; only the parquet footer is read here, captions are decoded on demand
+corpus = CaptionCorpus(parquet_path)
 image_gen = generate_image(model='text-embedding-3-large', batch_size=200)
+image_cache = ImageResultCache(image_gen)
 
 FALLBACK_IMAGE = "http://static.flickr.com/2723/4385058960_b0f291553e.jpg"
-        
+
+# agent calls of speculative evaluate(), shared by all requests
+eval_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="evaluate")
+
+
+class _LLMBudget:
+    """LLM calls one evaluate() may spend beyond the sequential chain."""
+    def __init__(self, calls):
+        self.left = calls
+        self._lock = threading.Lock()
+
+    def take(self, n=1):
+        with self._lock:
+            if self.left < n:
+                return False
+            self.left -= n
+            return True
+
+
+class EvaluationTimeout(Exception):
+    """evaluate() passed its deadline; raised at the next step instead of starting more LLM calls."""
+
+
+def _remaining(deadline):
+    """Seconds left before `deadline` (a time.monotonic() value), None without one."""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise EvaluationTimeout("evaluation deadline passed")
+    return left
+
+
+def _result(future, deadline):
+    try:
+        return future.result(timeout=_remaining(deadline))
+    except FutureTimeout:
+        future.cancel()
+        raise EvaluationTimeout("evaluation deadline passed")
+
 def _extract_object_name(obj):
     if isinstance(obj, dict):
         return obj.get("english") or next((v for v in obj.values() if isinstance(v, str) and v.strip()), "")
@@ -50,7 +102,9 @@ class generate_therapist:
         self.hint_agent = hint_agent
         self.ph_hint = ph_hint
         self.image_gen = image_gen
-        self.url = "http://localhost:7879/api/llm/generate"
+        self.image_cache = image_cache
+        self.llm = llm
+        self.limits = limits
         self.profiling_log = profiling_log
         self.metrics = {}
 
@@ -70,10 +124,49 @@ class generate_therapist:
             json.dump(self.metrics, f, indent=4)
         print(f"[✓] Profiling data saved to {self.profiling_log}")
 
-    def _generatequestion(self, object, question_type):
+    def _accept_questions(self, questions, candidates):
+        """Add the candidate object -> question pairs that validate to `questions`."""
+        questions.update({o: q for o, q in candidates.items()
+                          if o not in questions and self.question_framer.is_valid_question(q, o)})
+
+    def _generated_questions(self, raw_output, objs):
+        questions = {}
+        generated = raw_output.get("question_list")
+        if isinstance(generated, list) and len(generated) == len(objs):
+            self._accept_questions(questions, dict(zip(objs, generated)))
+        return questions
+
+    def _frame_questions(self, raw_output, objs, question_type):
+        """
+        Questions for every object with as few LLM calls as possible: the
+        generator's own question_list where it validates, then one batched
+        framing call for the rest. Objects still without a valid question map
+        to None and get framed one by one later.
+        """
+        self.question_framer.prepare(objs)
+        questions = self._generated_questions(raw_output, objs)
+        missing = [o for o in objs if o not in questions]
+        if missing:
+            self._accept_questions(questions, self.question_framer.frame_questions_batch(missing, question_type))
+        print(f"Framed {len(questions)}/{len(objs)} questions without per-object calls")
+        return questions
+
+    async def _aframe_questions(self, raw_output, objs, question_type):
+        """Async `_frame_questions`."""
+        await asyncio.to_thread(self.question_framer.prepare, objs)
+        questions = self._generated_questions(raw_output, objs)
+        missing = [o for o in objs if o not in questions]
+        if missing:
+            framed = await self.limits.llm_call(self.question_framer.aframe_questions_batch(missing, question_type))
+            self._accept_questions(questions, framed)
+        print(f"Framed {len(questions)}/{len(objs)} questions without per-object calls")
+        return questions
+
+    def _generatequestion(self, object, question_type, question=None):
         start = time.time()
-        question = self.question_framer.frame_question_and_hint(object, question_type)
-        image_url = self.image_gen.generate_image(object,df) or FALLBACK_IMAGE
+        if question is None:
+            question = self.question_framer.frame_question_and_hint(object, question_type)
+        image_url = self.image_cache.get(object, corpus) or FALLBACK_IMAGE
         self._log_step(f"generate_question_{object}", start)
         return {
             "object": object,
@@ -82,12 +175,12 @@ class generate_therapist:
             "image": image_url
         }
 
-    def _generatequestion_parallel_task(self, idx, object_name, question_type, retries=2, backoff=0.8):
+    def _generatequestion_parallel_task(self, idx, object_name, question_type, retries=2, backoff=0.8, question=None):
         attempt, delay = 0, backoff
         while True:
             try:
                 start = time.time()
-                out = self._generatequestion(object_name, question_type)
+                out = self._generatequestion(object_name, question_type, question)
                 self._log_step(f"parallel_task_{idx}", start)
                 return idx, out
             except Exception as e:
@@ -111,11 +204,13 @@ class generate_therapist:
         )
         object_list = raw_output["object_list"]
         objs = [_extract_object_name(o) for o in object_list]
+        questions = self._frame_questions(raw_output, objs, question_type)
 
         results = {}
         with ThreadPoolExecutor(max_workers=max_workers) as pool:
             futures = {
-                pool.submit(self._generatequestion_parallel_task, i, obj, question_type, retries): i
+                pool.submit(self._generatequestion_parallel_task, i, obj, question_type, retries,
+                            question=questions.get(obj)): i
                 for i, obj in enumerate(objs)
             }
             for fut in tqdm(as_completed(futures), total=len(futures), desc="Generating questions"):
@@ -133,13 +228,152 @@ class generate_therapist:
         self._save_metrics()
         return questions
 
+    async def _agenerate_question(self, object, question_type, question=None):
+        start = time.time()
+        if question is None:
+            # framing and image lookup are independent; run them together
+            question, image_url = await asyncio.gather(
+                self.limits.llm_call(self.question_framer.aframe_question_and_hint(object, question_type)),
+                self.image_cache.aget(object, corpus, self.limits),
+            )
+        else:
+            image_url = await self.image_cache.aget(object, corpus, self.limits)
+        self._log_step(f"generate_question_{object}", start)
+        return {
+            "object": object,
+            "question": question,
+            "question_type": question_type,
+            "image": image_url or FALLBACK_IMAGE
+        }
+
+    async def _agenerate_question_parallel_task(self, idx, object_name, question_type, retries=2, backoff=0.8,
+                                                question=None):
+        attempt, delay = 0, backoff
+        while True:
+            try:
+                start = time.time()
+                out = await self._agenerate_question(object_name, question_type, question)
+                self._log_step(f"parallel_task_{idx}", start)
+                return idx, out
+            except Exception as e:
+                attempt += 1
+                if attempt > retries:
+                    return idx, {
+                        "object": object_name,
+                        "question": None,
+                        "question_type": question_type,
+                        "image": FALLBACK_IMAGE,
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+                await asyncio.sleep(delay)
+                delay *= 1.5
+
+    async def _agenerate_question_list(self, age, gender, location, profession, language, severity,
+                                       question_type="naming_from_description", retries=2):
+        start = time.time()
+        raw_output = await self.limits.llm_call(self.question_agent.agenerate_questions_for_severity(
+            age, gender, location, profession, language, severity
+        ))
+        object_list = raw_output["object_list"]
+        objs = [_extract_object_name(o) for o in object_list]
+        questions = await self._aframe_questions(raw_output, objs, question_type)
+
+        results = dict(await asyncio.gather(*(
+            self._agenerate_question_parallel_task(i, obj, question_type, retries, question=questions.get(obj))
+            for i, obj in enumerate(objs)
+        )))
+
+        self._log_step("generate_question_list", start)
+        return {f"q{i + 1}": results.get(i) for i in range(len(objs))}
+
+    async def amain(self, age, gender, location, profession, language, severity):
+        """Async `main`; concurrency across requests is bounded by `self.limits`."""
+        print("[✓] Generating full question set...")
+        start = time.time()
+        questions = await self._agenerate_question_list(age, gender, location, profession, language, severity)
+        self._log_step("main_execution", start)
+        await self.limits.cpu(self._save_metrics)
+        return questions
+
     def _testevaluator(self, object):
         start = time.time()
-        image_url = self.image_gen.generate_image(object,df) or FALLBACK_IMAGE
+        image_url = self.image_gen.generate_image(object, corpus) or FALLBACK_IMAGE
         self._log_step("test_evaluator", start)
         return image_url
 
-    def evaluate(self, object, question, question_type, user_response, user_history, hint_reponse):
+    def evaluate(self, object, question, question_type, user_response, user_history, hint_reponse,
+                 speculative=None, deadline=None):
+        """
+        `deadline` (a time.monotonic() value) is checked between LLM steps:
+        once it passes, no further call is started and EvaluationTimeout is
+        raised. A call already in flight is left to finish on its own.
+        """
+        if EVAL_SPECULATIVE if speculative is None else speculative:
+            return self._evaluate_speculative(object, question, question_type, user_response,
+                                              user_history, hint_reponse, deadline)
+        for event, data in self._evaluate_events(object, question, question_type, user_response,
+                                                 user_history, hint_reponse, stream=False, deadline=deadline):
+            if event == "done":
+                return data
+
+    def _first_accepted_hint(self, generate, validate, hint_futures, budget, history, attempt, deadline=None):
+        """
+        Critique hint candidates as soon as each is written and keep the first
+        the critic accepts. `hint_futures` are candidates already in flight;
+        more are started up to EVAL_HINT_CANDIDATES while the budget allows
+        (each extra costs a hint and a critic call). If every candidate is
+        rejected, one more hint is generated with the first critic's feedback,
+        as in the sequential chain.
+        """
+        hint_futures = list(hint_futures)
+        if not hint_futures:
+            hint_futures.append(eval_pool.submit(generate, None))
+        while len(hint_futures) < EVAL_HINT_CANDIDATES and budget.take(2):
+            hint_futures.append(eval_pool.submit(generate, None))
+
+        def critique(candidate):
+            history_copy = history.copy()
+            history_copy[attempt] = candidate
+            return validate(history_copy)
+
+        pending = {f: ("hint", None) for f in hint_futures}
+        rejected = []
+        while pending:
+            try:
+                done, _ = wait(pending, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise EvaluationTimeout("evaluation deadline passed")
+            except EvaluationTimeout:
+                for other in pending:
+                    other.cancel()
+                raise
+            for f in done:
+                kind, candidate = pending.pop(f)
+                if kind == "hint":
+                    candidate = f.result()
+                    if candidate:
+                        pending[eval_pool.submit(critique, candidate)] = ("critic", candidate)
+                    continue
+                accepted, reason = f.result()
+                if accepted:
+                    for other in pending:
+                        other.cancel()
+                    return candidate
+                rejected.append((candidate, reason))
+        _remaining(deadline)
+        if not rejected:
+            return generate(None)
+        candidate, reason = rejected[0]
+        return generate(candidate + ' is incorrect because ' + reason)
+
+    def _evaluate_speculative(self, object, question, question_type, user_response, user_history, hint_reponse,
+                              deadline=None):
+        """
+        Same result as the sequential chain, lower latency: the classifier, the
+        evaluator and a phonetic hint candidate start together, and hint
+        candidates are critiqued in parallel. Calls beyond the sequential
+        chain are capped by EVAL_EXTRA_LLM_BUDGET.
+        """
         start = time.time()
         obj = object
         q_type = question_type
@@ -148,48 +382,163 @@ class generate_therapist:
         if len(ph_hint_history) < 1:
             ph_hint_history[attempt] = "no hint given till now"
         user_history[attempt] = user_response
-        classifier_response = self.classifier.evaluate_and_predict(user_response)
+        budget = _LLMBudget(EVAL_EXTRA_LLM_BUDGET)
+        history = ph_hint_history.copy()
+
+        phonetic_hint = functools.partial(self.ph_hint.generate_hint, obj, question, user_response, history, coalesce=False)
+        classifier_future = eval_pool.submit(self.classifier.evaluate_and_predict, user_response, obj)
+        evaluator_future = (eval_pool.submit(self.evaluator.evaluate_and_predict, obj, question, q_type, user_response)
+                            if budget.take() else None)
+        phonetic_future = eval_pool.submit(phonetic_hint, None) if budget.take() else None
+
+        try:
+            is_gibberish = _result(classifier_future, deadline)
+        except EvaluationTimeout:
+            for f in (evaluator_future, phonetic_future):
+                if f is not None:
+                    f.cancel()
+            raise
+        if is_gibberish:
+            if evaluator_future is not None:
+                evaluator_future.cancel()
+            ph_hint_response = self._first_accepted_hint(
+                phonetic_hint,
+                lambda h: ph_critic.validate(obj, h, question, user_response),
+                [phonetic_future] if phonetic_future is not None else [],
+                budget, history, attempt + 1, deadline,
+            )
+            evaluation_result = "incorrect"
+            attempt += 1
+            ph_hint_history[attempt] = ph_hint_response
+        else:
+            if phonetic_future is not None:
+                phonetic_future.cancel()
+            if evaluator_future is not None:
+                evaluation = _result(evaluator_future, deadline)
+            else:
+                _remaining(deadline)
+                evaluation = self.evaluator.evaluate_and_predict(obj, question, q_type, user_response)
+            evaluation_result = evaluation.get('Evaluation', '').lower()
+            eval_reason = (evaluation.get('Reason') or '').lower()
+            descriptive_hint = functools.partial(self.hint_agent.generate_hint, obj, question, user_response,
+                                                 eval_reason, history, coalesce=False)
+
+            if evaluation_result != 'correct':
+                ph_hint_response = self._first_accepted_hint(
+                    descriptive_hint,
+                    lambda h: hint_v.validate(obj, h, question, user_response),
+                    [], budget, history, attempt + 1, deadline,
+                )
+                attempt += 1
+                ph_hint_history[attempt] = ph_hint_response
+            else:
+                _remaining(deadline)
+                ph_hint_response = descriptive_hint(None)
+
+        response = {'hint_history': ph_hint_history, 'user_history': user_history,
+                    'hint': ph_hint_response, 'evaluation': evaluation_result}
+        self._log_step("evaluate", start)
+        return response
+
+    def evaluate_stream(self, object, question, question_type, user_response, user_history, hint_reponse):
+        """
+        Streaming `evaluate`: yields ("evaluation", {...}) once the answer is judged,
+        ("hint_delta", text) while the final accepted hint is written, then
+        ("done", response) with the same payload `evaluate` returns. The deltas
+        are the model's raw text; response["hint"] is that text after
+        clean_json (code fences stripped) and is what gets stored, so clients
+        replace the streamed text with it. If the stream breaks mid-hint,
+        ("hint_failed", {...}) tells the client to drop the deltas so far; the
+        hint is then generated whole and sent as one delta.
+        """
+        return self._evaluate_events(object, question, question_type, user_response,
+                                     user_history, hint_reponse, stream=True)
+
+    def _final_hint(self, agent, stream, *args):
+        """The hint the patient will see; streamed as it is generated in streaming mode."""
+        if not stream:
+            return agent.generate_hint(*args)
+        parts = []
+        try:
+            for delta in agent.stream_hint(*args):
+                parts.append(delta)
+                yield "hint_delta", delta
+        except Exception as e:
+            # the deltas sent so far are a truncated hint: tell the client to drop them
+            yield "hint_failed", {"detail": str(e)}
+            parts = []
+        if parts:
+            return clean_json("".join(parts).strip())
+        hint = agent.generate_hint(*args)
+        if hint:
+            yield "hint_delta", hint
+        return hint
+
+    def _evaluate_events(self, object, question, question_type, user_response, user_history, hint_reponse, stream,
+                         deadline=None):
+        start = time.time()
+        obj = object
+        q_type = question_type
+        attempt = (max(user_history.keys()) if user_history else 0) + 1
+        ph_hint_history = hint_reponse
+        if len(ph_hint_history) < 1:
+            ph_hint_history[attempt] = "no hint given till now"
+        user_history[attempt] = user_response
+        classifier_response = self.classifier.evaluate_and_predict(user_response, obj)
 
         if classifier_response:
+            yield "evaluation", {"evaluation": "incorrect"}
+            _remaining(deadline)
             ph_hint_response = self.ph_hint.generate_hint(obj, question, user_response, ph_hint_history, critic_feedback=None)
             attempt += 1
             ph_hint_history_copy = ph_hint_history.copy()
             ph_hint_history_copy[attempt] = ph_hint_response
+            _remaining(deadline)
             critic_response = ph_critic.validate(obj, ph_hint_history_copy, question, user_response)
             if not critic_response[0]:
-                ph_hint_response = self.ph_hint.generate_hint(
-                    obj, question, user_response,
+                _remaining(deadline)
+                ph_hint_response = yield from self._final_hint(
+                    self.ph_hint, stream, obj, question, user_response,
                     ph_hint_history, ph_hint_response + ' is incorrect because ' + critic_response[1]
                 )
+            elif stream:
+                yield "hint_delta", ph_hint_response
             ph_hint_history[attempt] = ph_hint_response
             response = {'hint_history': ph_hint_history, 'user_history': user_history,
                         'hint': ph_hint_response, 'evaluation': "incorrect"}
         else:
-            evaluation_json = self.evaluator.evaluate_and_predict(obj, question, q_type, user_response)
-            evaluation = extract_json_from_response(evaluation_json)
+            _remaining(deadline)
+            evaluation = self.evaluator.evaluate_and_predict(obj, question, q_type, user_response)
             evaluation_result = evaluation.get('Evaluation', '').lower()
-            eval_reason = evaluation.get('Reason', '').lower()
+            eval_reason = (evaluation.get('Reason') or '').lower()
+            yield "evaluation", {"evaluation": evaluation_result}
 
             if evaluation_result != 'correct':
+                _remaining(deadline)
                 ph_hint_response = self.hint_agent.generate_hint(obj, question, user_response,
                                                                  eval_reason, ph_hint_history, critic_feedback=None)
                 attempt += 1
                 ph_hint_history_copy = ph_hint_history.copy()
                 ph_hint_history_copy[attempt] = ph_hint_response
+                _remaining(deadline)
                 critic_response = hint_v.validate(obj, ph_hint_history, question, user_response)
                 if not critic_response[0]:
-                    ph_hint_response = self.hint_agent.generate_hint(
-                        obj, question, user_response,
+                    _remaining(deadline)
+                    ph_hint_response = yield from self._final_hint(
+                        self.hint_agent, stream, obj, question, user_response,
                         eval_reason, ph_hint_history, ph_hint_response + ' is incorrect because ' + critic_response[1]
                     )
+                elif stream:
+                    yield "hint_delta", ph_hint_response
                 ph_hint_history[attempt] = ph_hint_response
                 response = {'hint_history': ph_hint_history, 'user_history': user_history,
                             'hint': ph_hint_response, 'evaluation': evaluation_result}
             else:
-                ph_hint_response = self.hint_agent.generate_hint(obj, question, user_response,
-                                                                 eval_reason, ph_hint_history, critic_feedback=None)
+                _remaining(deadline)
+                ph_hint_response = yield from self._final_hint(self.hint_agent, stream, obj, question, user_response,
+                                                               eval_reason, ph_hint_history, None)
                 response = {'hint_history': ph_hint_history, 'user_history': user_history,
                             'hint': ph_hint_response, 'evaluation': evaluation_result}
 
         self._log_step("evaluate", start)
-        return response
+        yield "done", response
@@ -0,0 +1,186 @@
+"""
+Parsing of JSON replies from the LLM agents.
+
+`first_json_object` finds the first balanced {...} in a reply in one pass
+(string- and escape-aware, so braces inside strings don't confuse it);
+`Schema` checks the fields an agent needs and coerces the usual model slips
+("true" for true, "correct" for "Correct"); `generate_structured` re-asks
+the same agent a bounded number of times with the parse error when a reply
+is unusable, instead of failing the whole request.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from therapist.llm_client import llm
+
+
+class ParseError(ValueError):
+    pass
+
+
+# ```json {...}```, ```python\n...```, ```\n...```: a language tag only counts as one
+# when it is "json" or ends its line, so a bare one-line ```text``` keeps its first word
+_CODE_FENCE = re.compile(r"```(?:json\b|[\w+-]+(?=[ \t]*\n))?\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+
+
+def strip_code_fence(text: str) -> str:
+    """Body of a ```json ... ``` (or bare ```) fence if the text has one, else the text."""
+    m = _CODE_FENCE.search(text)
+    return m.group(1) if m else text
+
+
+def _balanced_end(text: str, start: int) -> int:
+    """Index just past the bracket closing text[start], or -1 if it never closes."""
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def first_json_object(text: str, max_candidates: int = 4) -> Any:
+    """Decode the first balanced JSON object in text (prose and code fences around it are ignored)."""
+    if not isinstance(text, str) or not text.strip():
+        raise ParseError("empty model output")
+    text = text.strip()
+    if text[0] == "{":
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    pos, last_error = 0, "no JSON object found"
+    for _ in range(max_candidates):
+        start = text.find("{", pos)
+        if start < 0:
+            break
+        end = _balanced_end(text, start)
+        if end < 0:
+            last_error = "unterminated JSON object (truncated output?)"
+            break
+        try:
+            return json.loads(text[start:end])
+        except ValueError as e:
+            last_error = f"invalid JSON: {e}"
+            pos = start + 1
+    raise ParseError(last_error)
+
+
+_TRUE, _FALSE = {"true", "yes", "1"}, {"false", "no", "0"}
+
+
+class Schema:
+    """
+    Required/optional fields of an agent's JSON reply, with their types.
+
+    `choices` restricts string fields to fixed values (matched case-insensitively
+    and returned in canonical case); `item_types` checks list elements.
+    """
+
+    def __init__(self, name: str, required: Dict[str, type], optional: Optional[Dict[str, type]] = None,
+                 choices: Optional[Dict[str, Tuple[str, ...]]] = None, item_types: Optional[Dict[str, type]] = None):
+        self.name = name
+        self.required = required
+        self.optional = optional or {}
+        self.choices = choices or {}
+        self.item_types = item_types or {}
+
+    def _coerce(self, field: str, value: Any, expected: type) -> Any:
+        if expected is bool and isinstance(value, str) and value.strip().lower() in _TRUE | _FALSE:
+            value = value.strip().lower() in _TRUE
+        if expected is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, expected):
+            raise ParseError(f'"{field}" must be {expected.__name__}, got {type(value).__name__}')
+        if field in self.choices:
+            canonical = {c.lower(): c for c in self.choices[field]}
+            if value.strip().lower() not in canonical:
+                raise ParseError(f'"{field}" must be one of {list(self.choices[field])}, got {value!r}')
+            value = canonical[value.strip().lower()]
+        if field in self.item_types:
+            item_type = self.item_types[field]
+            bad = [v for v in value if not isinstance(v, item_type)]
+            if bad:
+                raise ParseError(f'"{field}" items must be {item_type.__name__}, got {bad[0]!r}')
+        return value
+
+    def validate(self, data: Any) -> dict:
+        if not isinstance(data, dict):
+            raise ParseError(f"expected a JSON object, got {type(data).__name__}")
+        out = dict(data)
+        for field, expected in self.required.items():
+            if field not in data:
+                raise ParseError(f'missing field "{field}"')
+            out[field] = self._coerce(field, data[field], expected)
+        for field, expected in self.optional.items():
+            if data.get(field) is not None:
+                out[field] = self._coerce(field, data[field], expected)
+        return out
+
+
+# one schema per agent reply
+CLASSIFIER = Schema("classifier", {"classification": bool}, {"reason": str})
+CRITIC = Schema("critic", {"accepted": bool}, {"reason": str})
+EVALUATOR = Schema("evaluator", {"Evaluation": str}, {"Reason": str},
+                   choices={"Evaluation": ("Correct", "Partially Correct", "Incorrect")})
+QUESTION_SET = Schema("question_set", {"object_list": list}, {"question_list": list})
+QUESTION_BATCH = Schema("question_batch", {"questions": dict})
+CAPTIONS = Schema("captions", {"positive_captions": list, "negative_captions": list},
+                  item_types={"positive_captions": str, "negative_captions": str})
+NEGATIVE_PATTERNS = Schema("negative_patterns", {"NEGATIVE_PATTERNS": list}, item_types={"NEGATIVE_PATTERNS": str})
+OBJECT_NAMES = Schema("object_names", {"names": list}, item_types={"names": str})
+
+
+def parse_structured(text: str, schema: Schema) -> dict:
+    return schema.validate(first_json_object(strip_code_fence(text)))
+
+
+def _repair_messages(messages: List[dict], reply: str, error: Exception) -> List[dict]:
+    return messages + [
+        {"role": "assistant", "content": reply or ""},
+        {"role": "user", "content": f"Your reply could not be used ({error}). "
+                                    "Reply again with only the corrected JSON object, no other text."},
+    ]
+
+
+def generate_structured(messages: List[dict], schema: Schema, repairs: int = 1, **extra) -> dict:
+    """LLM call whose reply must satisfy `schema`; a bad reply is sent back for repair up to `repairs` times."""
+    for attempt in range(repairs + 1):
+        reply = llm.generate(messages, **extra)
+        try:
+            return parse_structured(reply, schema)
+        except ParseError as e:
+            print(f"[{schema.name}] unusable reply (attempt {attempt + 1}/{repairs + 1}): {e}")
+            # a cached bad reply would fail the same way on every later call
+            llm.invalidate(messages, **extra)
+            if attempt == repairs:
+                raise
+            messages = _repair_messages(messages, reply, e)
+
+
+async def agenerate_structured(messages: List[dict], schema: Schema, repairs: int = 1, **extra) -> dict:
+    """Async `generate_structured`."""
+    for attempt in range(repairs + 1):
+        reply = await llm.agenerate(messages, **extra)
+        try:
+            return parse_structured(reply, schema)
+        except ParseError as e:
+            print(f"[{schema.name}] unusable reply (attempt {attempt + 1}/{repairs + 1}): {e}")
+            await llm.ainvalidate(messages, **extra)
+            if attempt == repairs:
+                raise
+            messages = _repair_messages(messages, reply, e)
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from therapist.config import EXERCISE_SET_DEADLINE_SEC, VALIDATE_DEADLINE_SEC
 from pydantic import BaseModel
-from therapist.model import generate_therapist
-from typing import Dict
+from therapist.model import generate_therapist, EvaluationTimeout
+from typing import Dict, Optional
 import asyncio
-from time import time
+import json
+from time import time, monotonic
 router = APIRouter()
 therapist = generate_therapist()
 
@@ -26,26 +30,28 @@ class ValidRequest(BaseModel):
     user_response: str
     user_history: Dict[int, str] = {} 
     hint_history: Dict[int, str] = {}  
+    # stream evaluation + hint as server-sent events
+    stream: bool = False
+    # None: server default (config.EVAL_SPECULATIVE); streaming always runs sequentially
+    speculative: Optional[bool] = None
     
 
 @router.post("/exercise_sets")
 async def generate_exercise_sets(request: PromptRequest):
     try:
     
-        loop = asyncio.get_event_loop()
         start=time()
-        output = await loop.run_in_executor(
-            None,
-            lambda: therapist.main(
-                request.age,
-                request.gender,
-                request.location,
-                request.profession,
-                request.language,
-                request.severity,
-            )
-        )
+        output = await asyncio.wait_for(therapist.amain(
+            request.age,
+            request.gender,
+            request.location,
+            request.profession,
+            request.language,
+            request.severity,
+        ), EXERCISE_SET_DEADLINE_SEC)
         return {"response": output, "time": time()-start}
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"exercise set not ready within {EXERCISE_SET_DEADLINE_SEC:.0f}s")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -62,20 +68,64 @@ def evaluator_test(request: EvalTestrequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/image_cache_stats")
+def image_cache_stats():
+    """
+    Hit/miss counters of the generate_image result cache
+    """
+    return {"response": therapist.image_cache.stats()}
+
+def _sse_events(request: ValidRequest):
+    """
+    Server-sent events of a streamed validation, in order:
+      evaluation   {"evaluation": ...} once the answer is judged
+      hint_delta   {"delta": text} while the hint is written (raw model text)
+      hint_failed  {"detail": ...} the stream broke mid-hint: discard the deltas so far;
+                   the regenerated hint follows as hint_delta
+      done         {"response": ...} the same payload as the non-streaming route; its
+                   "hint" is the cleaned, stored hint and replaces the streamed text
+      error        {"detail": ...} the validation failed
+    """
+    try:
+        for event, data in therapist.evaluate_stream(
+            request.object,
+            request.question,
+            request.question_type,
+            request.user_response,
+            request.user_history,
+            request.hint_history,
+        ):
+            if event == "hint_delta":
+                data = {"delta": data}
+            elif event == "done":
+                data = {"response": data}
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
 @router.post("/validate_sets")
-def validate_user_response(request: ValidRequest):
+async def validate_user_response(request: ValidRequest):
     """
     Validate user's answer against expected answer using therapist model logic.
     """
+    if request.stream:
+        return StreamingResponse(_sse_events(request), media_type="text/event-stream")
     try:
-        output = therapist.evaluate(
+        # the same deadline goes into evaluate, so its thread stops starting LLM calls
+        # once the request has been answered with a 504
+        output = await asyncio.wait_for(run_in_threadpool(
+            therapist.evaluate,
             request.object,
             request.question,
             request.question_type,
             request.user_response,
             request.user_history,
             request.hint_history,  
-        )
+            speculative=request.speculative,
+            deadline=monotonic() + VALIDATE_DEADLINE_SEC,
+        ), VALIDATE_DEADLINE_SEC)
         return {"response": output}
+    except (asyncio.TimeoutError, EvaluationTimeout):
+        raise HTTPException(status_code=504, detail=f"validation not ready within {VALIDATE_DEADLINE_SEC:.0f}s")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))